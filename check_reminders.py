@@ -1,42 +1,65 @@
-import time
-
+import reminders.dispatch as dispatch
 import reminders.dynamodb as db
+import reminders.metrics as metrics
+import reminders.recurrence as recurrence
 import reminders.reschedule as reschedule
+import reminders.scheduler as scheduler
 import reminders.utils as utils
 import reminders.whatsapp as wa
 
 
 DUMMY_WA_ID = "test"
+MAX_CATCHUP_BUCKETS = 24 * 60 // db.BUCKET_WINDOW  # we don't send reminders older than a day.
 
-# TODO:
-# programmatically update event bridge rule with earliest
-# reminder time instead of checking every 5 minutes
+# check_reminders is invoked by the EventBridge schedule armed in reminders/scheduler.py.
+# it sends every reminder due before the end of the fire window, then re-arms the
+# schedule for the next pending reminder.
 def check_reminders():
     client = db.get_client()
-    events, err = db.get_upcoming_events(client)
+    now_ts = utils.utc_now_ts()
+    horizon_ts = now_ts + scheduler.FIRE_WINDOW
 
+    # catch up on buckets left unsent by a missed or late invocation.
+    window = db.BUCKET_WINDOW * 60
+    from_ts_bucket = db.get_ts_bucket(now_ts)
+    watermark, err = db.get_events_watermark(client)
     if err:
-        print(f"get_upcoming_events error: {err}")
-        return
-
-    if not events:
-        return
-    
-    # sort events by ascending reminder time.
-    events = sorted(events, key=lambda e: int(e["from_date"]))
-    for event in events:
-        # ignore test events.
-        if event["wa_id"] == DUMMY_WA_ID:
-            continue
+        print(f"get_events_watermark error: {err}")
+    elif watermark != -1:
+        catchup_ts_bucket = max(watermark + window, from_ts_bucket - MAX_CATCHUP_BUCKETS * window)
+        from_ts_bucket = min(catchup_ts_bucket, from_ts_bucket)
+    # the fire window can overlap two buckets.
+    to_ts_bucket = db.get_ts_bucket(horizon_ts)
+
+    events = []
+    complete = True
+    try:
+        for event in db.iter_upcoming_events(client, from_ts_bucket, to_ts_bucket):
+            events.append(event)
+    except Exception as e:
+        print(f"iter_upcoming_events error: {e}")
+        complete = False
+
+    # events after the fire window are sent by a later invocation.
+    events = [e for e in events if int(e["from_date"]) < horizon_ts]
+
+    # ignore test events.
+    events = [e for e in events if e["wa_id"] != DUMMY_WA_ID]
+
+    # schedule new event if this is a recurrent event.
+    # runs off the send path: returns an error message to append to the reminder.
+    def prepare(event):
+        if event.get("rule_id"):
+            return recurrence.roll_forward(client, event)
+        return reschedule.reschedule_reminder_v2(client, event)
+
+    def send(event, err_msg):
         # update `scheduled` status to True
-        db.mark_event_as_scheduled(client, event["ts_bucket"], event["event_id"])
-        # schedule new event if this is a recurrent event
-        err_msg = reschedule.reschedule_reminder_v2(client, event)
+        err = db.mark_event_as_scheduled(client, event["ts_bucket"], event["event_id"])
+        if err == "already_scheduled":
+            return
         if err_msg:
             utils.log_msg({"wa_id": event["wa_id"], "verbose": True}, err_msg)
-        curr_ts = int(event["from_date"])
-        t = max(0, curr_ts - utils.utc_now_ts())
-        time.sleep(t)
         text = event["event_name"]
         frequency = event["frequency"]
         if frequency != "once":
@@ -57,4 +80,18 @@ def check_reminders():
                 "version": "2",
             }
         ]
-        db.update_user_conversation(client, event["wa_id"], new_msg)
\ No newline at end of file
+        db.update_user_conversation(client, event["wa_id"], new_msg)
+
+    metrics.reset()
+    dispatch.run(events, send=send, prepare=prepare)
+    metrics.log("check_reminders")
+
+    # every bucket that ends before the fire window has been fully sent.
+    if complete:
+        err = db.set_events_watermark(client, to_ts_bucket - window)
+        if err:
+            print(f"set_events_watermark error: {err}")
+
+    err = scheduler.rearm(client)
+    if err:
+        print(f"scheduler.rearm error: {err}")
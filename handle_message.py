@@ -1,11 +1,12 @@
 import os
 
 import json
-import time
 import traceback
 
 # reminders is a custom package with util functions for dynamodb, openai, whatsapp and time conversions.
 import reminders.dynamodb as db
+import reminders.lock as lock
+import reminders.resilience as resilience
 import reminders.whatsapp as wa
 import reminders.utils as utils
 import reminders.handler_v2 as handler_v2
@@ -32,7 +33,9 @@ def handle_message(event, whatsapp_enabled=True):
 
     client = db.get_client()
     # fetch user and their events via dynamoDB.
-    user, err = db.get_user(client, wa_id) # user is a dict.
+    # other messages than texts (consent button, voice notes...) only need to know if the user is set up.
+    profile = db.USER_FULL if msg["type"] == "text" else db.USER_SETUP
+    user, err = db.get_user(client, wa_id, profile=profile) # user is a dict.
     # todo: what do we do if user exists but we can't fetch it?
     if err:
         utils.log_msg(user, f"Could not get user: {err}")
@@ -105,77 +108,89 @@ def handle_message(event, whatsapp_enabled=True):
         return
 
     # USER LOCK
-    # mark user as locked to prevent concurrent updates
-    wait_time = 5
-    cumulative_wait_time = 0
-    max_wait_time = 60  # seconds
-    while wa_id == tim and user.get("locked", False) and int(user.get("locked_ts", "0")) > utils.utc_now_ts() - 5 * 60:
-        if cumulative_wait_time == 0:
-            utils.log_msg(user, f"User id: {wa_id} marked as locked. Waiting {max_wait_time} seconds...")
-        time.sleep(wait_time)
-        cumulative_wait_time += wait_time
-        user, err_get_user = db.get_user(client, wa_id)
-        if not user or err_get_user:
-            utils.log_msg(user, f"User id: {wa_id} marked as locked and can't get user object. Aborting.")
+    # begin_request takes a lease on the user to prevent concurrent updates (see reminders/lock.py).
+    # if another delivery holds it, we wait for its release, reading only the lock attributes,
+    # then reload the user since the other request updated it.
+    deadline = utils.utc_now_ts() + lock.MAX_WAIT
+    while True:
+        is_user_setup = user["user_name"] and user["user_timezone"]
+
+        # the conversation lives in its own table: only the recent messages are loaded.
+        user["conversation"], err = db.get_conversation(client, wa_id)
+        if err:
+            utils.log_msg(user, f"Could not get conversation: {err}")
+
+        # MESSAGE IDS
+        for past_msg_id in user.get("message_ids", []):
+            if past_msg_id != msg_id:
+                continue
+            utils.log_msg(user, f"event already processed: msg={msg}")
             return
-        if cumulative_wait_time >= max_wait_time:
-            utils.log_msg(user, f"User id: {wa_id} marked as locked. Aborting.")
+
+        # check that msg_id not already in conversation
+        for prev_msg in user.get("conversation", []):
+            if not (msg_id and prev_msg.get("id", "") == msg_id):
+                continue
             return
 
-    err = db.mark_user_as_locked(client, wa_id)
-    if err:
-        utils.log_msg(user, f"mark_user_as_locked error {err}")
-        # wa.send_message(wa_id, "Sorry there was an error 😔 let's try again later")
-        # db.mark_user_as_unlocked(client, wa_id=wa_id)
-        # return
-
-    # MESSAGE IDS
-    for past_msg_id in user.get("message_ids", []):
-        if past_msg_id != msg_id:
-            continue
-        utils.log_msg(user, f"event already processed: msg={msg}")
-        db.mark_user_as_unlocked(client, wa_id=wa_id)
-        return
+        # GDPR CONSENT FOR EU COUNTRIES
+        country_code = utils.country_code_from_wa_id(wa_id)
+        is_eu_country = utils.is_eu_country(country_code)
+        needs_consent = not user.get("consent", False) and (is_eu_country or wa_id == tim)
 
-    # check that msg_id not already in conversation
-    for prev_msg in user.get("conversation", []):
-        if not (msg_id and prev_msg.get("id", "") == msg_id):
-            continue
-        db.mark_user_as_unlocked(client, wa_id=wa_id)
-        return
+        # count number of messages that are not part of setup.
+        # TODO: handle case where user is trying to use mindy as chatgpt.
+        # setup messages are included because some people use Mindy as chatGPT.
+        # the counter is maintained by db.update_user_conversation.
+        num_messages = user.get("stats", {}).get("chat_messages", 0)
+        over_free_limit = not utils.is_vip(user["wa_id"])\
+            and (user.get("subscription", {}).get("subStatus", "") != "active")\
+            and num_messages >= 100
+
+        # lock the user, record the message id and, unless the message is turned away,
+        # increment message count and add user to DAUs. One round trip (two for the first message of the day).
+        status, token, err = db.begin_request(
+            client,
+            wa_id=wa_id,
+            msg_id=msg_id,
+            prev_ids=user.get("message_ids", []),
+            is_user_setup=is_user_setup,
+            count_activity=not (needs_consent or over_free_limit),
+        )
+        if status == "duplicate":
+            utils.log_msg(user, f"event already processed: msg={msg}")
+            return
+        if status != "locked":
+            break
 
-    db.update_message_ids(client=client, wa_id=wa_id, prev_ids=user.get("message_ids", []), msg_id=msg_id)
+        utils.log_msg(user, f"User id: {wa_id} marked as locked. Waiting up to {deadline - utils.utc_now_ts()} seconds...")
+        if not lock.wait_for_release(client, wa_id, deadline):
+            utils.log_msg(user, f"User id: {wa_id} marked as locked. Aborting.")
+            return
+        user, err_get_user = db.get_user(client, wa_id)
+        if not user or err_get_user:
+            utils.log_msg(user, f"User id: {wa_id} marked as locked and can't get user object. Aborting.")
+            return
 
-    # GDPR CONSENT FOR EU COUNTRIES
-    country_code = utils.country_code_from_wa_id(wa_id)
-    is_eu_country = utils.is_eu_country(country_code)
+    if err:
+        # we continue without the lock.
+        utils.log_msg(user, f"begin_request error {err}")
 
-    if not user.get("consent", False) and (is_eu_country or wa_id == tim):
+    if needs_consent:
         # right now we'll continue sending opt in even if user never clicks on a button.
         wa.send_opt_in(wa_id)
-        err = db.mark_user_as_unlocked(client, wa_id=wa_id)
+        lock.release(client, wa_id, token)
         return
 
     events_v1 = []
     if user.get("events_v1", []):
         events_v1, err = db.get_events(client, user.get("events_v1", [])) # events is a list of dicts.
         # todo: what do we do if events evists but there was an error?
-    events_v2 = user.get("events_v2", [])
+    events_v2 = db.user_events_v2(user)
     events = events_v1 + events_v2
-    
-    # count number of messages that are not part of setup.
-    # TODO: handle case where user is trying to use mindy as chatgpt.
-    num_messages = 0
-    for prev_msg in user["conversation"]:
-        if prev_msg.get("type", "") in ["error", "request", "command"]:
-            continue
-        # setup messages are included because some people use Mindy as chatGPT.
-        num_messages += 1
 
-    if not utils.is_vip(user["wa_id"])\
-        and (user.get("subscription", {}).get("subStatus", "") != "active")\
-        and num_messages >= 100:
-        db.mark_user_as_unlocked(client, wa_id=wa_id)
+    if over_free_limit:
+        lock.release(client, wa_id, token)
         if not whatsapp_enabled:
             return
         un = user.get("user_name", "")
@@ -187,41 +202,35 @@ def handle_message(event, whatsapp_enabled=True):
         wa_msg = f"Sorry{un_with_space}, you reached the limit of the free version... 😔 But you can sign up for a subscription here! {url} 😊"
         wa.send_message(wa_id, wa_msg)
         return
-    
-    # increment message count
-    err_stats = db.set_user_stats(client=client, wa_id=wa_id, stats=user["stats"], conversation=user["conversation"], message_inc=1, reminder_inc=0)
-    if err_stats:
-        utils.log_msg(user, f"set_user_stats error: {err_stats}")
-    # add user to DAUs
-    err_dau = db.add_user_to_dau(client, wa_id=wa_id, is_user_setup=is_user_setup)
-    if err_dau:
-        utils.log_msg(user, f"Could not add user to DAU: {err_dau}")
 
     # code path 1: setup user if missing info.
     if not is_user_setup:
         try:
-            setup_v2.run(usr_msg, user=user, timestamp=timestamp, client=client)
+            with resilience.deadline(resilience.REQUEST_BUDGET):
+                setup_v2.run(usr_msg, user=user, timestamp=timestamp, client=client)
         except Exception as e:
             utils.log_msg(user, f"Setup exception: {traceback.format_exc()}")
-        err = db.mark_user_as_unlocked(client, wa_id=wa_id)
+        err = lock.release(client, wa_id, token)
         if err:
-            utils.log_msg(user, f"mark_user_as_unlocked error: {err}")
+            utils.log_msg(user, f"lock.release error: {err}")
         return
 
     try:
-        handler_v2.run(
-            msg=usr_msg,
-            msg_id=msg_id,
-            user=user,
-            timestamp=timestamp,
-            events=events,
-            client=client
-        )
+        # bounds the time spent on LLM calls, including retries.
+        with resilience.deadline(resilience.REQUEST_BUDGET):
+            handler_v2.run(
+                msg=usr_msg,
+                msg_id=msg_id,
+                user=user,
+                timestamp=timestamp,
+                events=events,
+                client=client
+            )
     except Exception as e:
         utils.log_msg(user, f"handler_v2 exception: {traceback.format_exc()}")
         if utils.is_vip(user["wa_id"]):
             wa.send_message(tim, f"VIP Exeption ({user['user_name']}):\nOriginal message:{usr_msg}\n{traceback.format_exc()}")
-    err = db.mark_user_as_unlocked(client, wa_id=wa_id)
+    err = lock.release(client, wa_id, token)
     if err:
-        utils.log_msg(user, f"mark_user_as_unlocked error: {err}")
+        utils.log_msg(user, f"lock.release error: {err}")
     return
\ No newline at end of file
@@ -1,6 +1,6 @@
-from check_reminders import check_reminders
-from handle_message import handle_message
-import reminders.whatsapp as wa
+# imports are done per code path: a cold start only loads what its code path needs.
+# e.g. the whatsapp verification does not need boto3, and reminders checks don't need the LLM prompts.
+# see reminders/benchmarks/startup_bench.py.
 
 # lambda_handler is the entry point for AWS Lambda requests.
 # AWS Lambda requires it to take an event and context as input.
@@ -8,13 +8,28 @@ import reminders.whatsapp as wa
 def lambda_handler(event, context):
     # code path 1: whatsapp requests verification. Only happens once.
     if event.get("requestContext", {}).get("http", {}).get("method") == "GET":
+        import reminders.whatsapp as wa
         return wa.verify(event)
     # code path 2: Amazon EventBridge triggers a reminders check. We look for reminders to send out.
     elif event.get("message", "") == "check_for_reminders":
         # event is coming from Amazon EventBridge. Format is: {"message": "check_for_reminders"}
+        from check_reminders import check_reminders
         check_reminders()
-    # code path 3: a user sent a message via WhatsApp and we need to respond.
+    # code path 3: in queue mode, the SQS queue hands us the messages acknowledged by code path 4.
+    elif event.get("Records"):
+        # event format for SQS invocations: https://docs.aws.amazon.com/lambda/latest/dg/with-sqs.html
+        import reminders.message_queue as message_queue
+        from handle_message import handle_message
+        if message_queue.is_queue_event(event):
+            return message_queue.work(event, handle_message)
+        print(f"Unknown event source: {event['Records'][0].get('eventSource', '')}")
+    # code path 4: a user sent a message via WhatsApp and we need to respond.
     else:
         # event is coming from whatsapp.
         # event format for URL invocations: https://docs.aws.amazon.com/lambda/latest/dg/urls-invocation.html
-        handle_message(event)
\ No newline at end of file
+        import reminders.message_queue as message_queue
+        # in queue mode, we only queue the message and acknowledge it right away.
+        if message_queue.is_enabled():
+            return message_queue.ingest(event)
+        from handle_message import handle_message
+        handle_message(event)
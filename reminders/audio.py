@@ -1,6 +1,7 @@
-import requests
 import os
 
+import reminders.connections as connections
+
 # WIP: this does not work yet.
 def transcribe(path):
     url = "https://api.openai.com/v1/audio/transcriptions"
@@ -18,7 +19,7 @@ def transcribe(path):
         "model": "whisper-1",
     }
 
-    response = requests.post(url, headers=headers, files=files, data=data)
+    response = connections.get_session("openai").post(url, headers=headers, files=files, data=data)
     print(response.json())
     if response.status_code == 200:
         return response.json()["data"]["text"]
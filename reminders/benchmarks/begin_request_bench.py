@@ -0,0 +1,73 @@
+import argparse
+import os
+import statistics
+import sys
+import time
+reminders_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+sys.path.append(reminders_dir)
+import reminders.dynamodb as db
+import reminders.lock as lock
+import reminders.utils as utils
+from reminders.benchmarks.stubs import StubDynamoDBClient
+
+# compares the bookkeeping done before any LLM work in handle_message:
+# the previous sequence of calls vs db.begin_request.
+# to run: python reminders/benchmarks/begin_request_bench.py [--endpoint http://localhost:8000]
+# without --endpoint, calls go to a stub client that simulates a round trip latency.
+
+WA_ID = "bench"
+
+def previous_sequence(client, msg_id, prev_ids):
+    lock.acquire(client, WA_ID)
+    db.update_message_ids(client=client, wa_id=WA_ID, prev_ids=prev_ids, msg_id=msg_id)
+    db.set_user_stats(client=client, wa_id=WA_ID, message_inc=1, reminder_inc=0)
+    db.add_user_to_dau(client, wa_id=WA_ID, is_user_setup=True)
+
+def begin_request(client, msg_id, prev_ids):
+    db.begin_request(client, wa_id=WA_ID, msg_id=msg_id, prev_ids=prev_ids, is_user_setup=True)
+
+def bench(name, fn, client, n):
+    durations = []
+    calls = 0
+    for i in range(n):
+        before = len(client.calls) if hasattr(client, "calls") else 0
+        start = time.perf_counter()
+        fn(client, msg_id=f"{name}-{time.time_ns()}-{i}", prev_ids=[])
+        durations.append(time.perf_counter() - start)
+        calls += (len(client.calls) - before) if hasattr(client, "calls") else 0
+    calls_str = f", {calls / n:.1f} calls/request" if hasattr(client, "calls") else ""
+    print(f"{name}: mean={1000 * statistics.mean(durations):.1f}ms p95={1000 * sorted(durations)[int(0.95 * n)]:.1f}ms{calls_str}")
+
+def local_client(endpoint):
+    import boto3
+    client = boto3.client("dynamodb", endpoint_url=endpoint, region_name="us-east-1", aws_access_key_id="local", aws_secret_access_key="local")
+    tables = client.list_tables()["TableNames"]
+    for table, key in [(db.USERS_TABLE, "wa_id"), (db.DAU_TABLE, "date")]:
+        if table not in tables:
+            client.create_table(
+                TableName=table,
+                KeySchema=[{"AttributeName": key, "KeyType": "HASH"}],
+                AttributeDefinitions=[{"AttributeName": key, "AttributeType": "S"}],
+                BillingMode="PAY_PER_REQUEST",
+            )
+    client.put_item(TableName=db.USERS_TABLE, Item={"wa_id": {"S": WA_ID}, "stats": {"M": {}}})
+    return client
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--endpoint", default="", help="DynamoDB Local endpoint")
+    parser.add_argument("--latency", type=float, default=0.01, help="stub round trip latency in seconds")
+    parser.add_argument("-n", type=int, default=50)
+    args = parser.parse_args()
+
+    os.environ.setdefault("TIM_PHONE_NUMBER", "")
+    if args.endpoint:
+        client = local_client(args.endpoint)
+    else:
+        # same day as the last request: no DAU call.
+        client = StubDynamoDBClient(args.latency, responses={"update_item": {"Attributes": {
+            "last_dau_date": {"S": utils.utc_now().strftime("%Y%m%d")},
+            "lock_token": {"N": "1"},
+        }}})
+    bench("previous sequence", previous_sequence, client, args.n)
+    bench("begin_request", begin_request, client, args.n)
@@ -0,0 +1,163 @@
+import json
+import os
+import statistics
+import sys
+import time
+reminders_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+sys.path.append(reminders_dir)
+import reminders.codec as codec
+
+# compares codec.User.decode with the previous hand written decoding of db.get_user,
+# on a synthetic user item close to the 400 KB dynamodb item size limit.
+# to run: python reminders/benchmarks/codec_bench.py
+
+TARGET_SIZE = 400 * 1000  # in bytes, approximated by the size of the item's json.
+
+def synthetic_user_item(target_size=TARGET_SIZE):
+    item = {
+        "wa_id": {"S": "33612345678"},
+        "user_name": {"S": "Tim"},
+        "user_timezone": {"S": "Europe/Paris"},
+        "consent": {"BOOL": True},
+        "locked": {"BOOL": False},
+        "locked_ts": {"N": "1700000000"},
+        "verbose": {"BOOL": False},
+        "message_ids": {"L": [{"S": f"wamid.{i:040d}"} for i in range(3)]},
+        "subscription": {"M": {"subID": {"S": "sub_123"}, "subStatus": {"S": "active"}}},
+        "stats": {"M": {
+            "messages_sent": {"N": "5000"},
+            "reminders_created": {"N": "1200"},
+            "creation_ts": {"N": "1680000000"},
+            "last_active_ts": {"N": "1700000000"},
+            "chat_messages": {"N": "4000"},
+            "active_days": {"SS": [f"2023{m:02d}{d:02d}" for m in range(1, 13) for d in range(1, 29)]},
+        }},
+        "events": {"L": []},
+        "events_v2": {"L": []},
+    }
+    i = 0
+    while len(json.dumps(item)) < target_size:
+        from_date = 1700000000 + i * 3600
+        item["events"]["L"].append({"M": {"ts_bucket": {"N": str(from_date - from_date % 360)}, "event_id": {"S": f"33612345678:legacy {i}:{from_date}:once"}}})
+        item["events_v2"]["L"].append({"M": {
+            "ts_bucket": {"N": str(from_date - from_date % 360)},
+            "event_id": {"S": f"33612345678:water the plants {i}:{from_date}:-1:every day"},
+            "event_name": {"S": f"water the plants {i}"},
+            "from_date": {"N": str(from_date)},
+            "from_date_str": {"S": "Tuesday, 2023-11-14 23:13:20"},
+            "to_date": {"N": "-1"},
+            "to_date_str": {"S": ""},
+            "frequency": {"S": "every day"},
+            "version": {"S": "2"},
+            "reschedule": {"BOOL": True},
+            "children": {"L": [{"M": {"ts_bucket": {"N": str(from_date + 86400 * k)}, "event_id": {"S": f"child {k}"}}} for k in range(2)]},
+        }})
+        i += 1
+    return item
+
+# previous decoding of db.get_user.
+def previous_decode(item):
+    events_v1 = []
+    for e in item.get("events", {}).get("L", []):
+        m = e.get("M", {})
+        events_v1.append({"ts_bucket": m.get("ts_bucket", {}).get("N", "-1"), "event_id": m.get("event_id", {}).get("S", "")})
+    events_v2 = []
+    for e in item.get("events_v2", {}).get("L", []):
+        m = e.get("M", {})
+        try:
+            from_date = int(m.get("from_date", {}).get("N", "-1"))
+        except:
+            from_date = -1
+        try:
+            to_date = int(m.get("to_date", {}).get("N", "-1"))
+        except:
+            to_date = -1
+        events_v2.append({
+            "ts_bucket": m.get("ts_bucket", {}).get("N", ""),
+            "event_id": m.get("event_id", {}).get("S", ""),
+            "event_name": m.get("event_name", {}).get("S", ""),
+            "from_date": from_date,
+            "from_date_str": m.get("from_date_str", {}).get("S", ""),
+            "to_date": to_date,
+            "to_date_str": m.get("to_date_str", {}).get("S", ""),
+            "frequency": m.get("frequency", {}).get("S", ""),
+            "children": [
+                {
+                    "ts_bucket": c.get("M", {}).get("ts_bucket", {}).get("N", ""),
+                    "event_id": c.get("M", {}).get("event_id", {}).get("S", ""),
+                } for c in m.get("children", {}).get("L", [])
+            ],
+            "version": "2",
+        })
+    subscription_map = item.get("subscription", {}).get("M", {})
+    subscription = {
+        "subID": subscription_map.get("subID", {}).get("S", ""),
+        "subStatus": subscription_map.get("subStatus", {}).get("S", ""),
+    }
+    stats = item.get("stats", {}).get("M", {})
+    counters = {}
+    for name in ["messages_sent", "reminders_created", "creation_ts", "last_active_ts", "chat_messages"]:
+        try:
+            counters[name] = int(stats.get(name, {}).get("N", "0"))
+        except:
+            counters[name] = 0
+    stats = {"active_days": stats.get("active_days", {}).get("SS", []), **counters}
+    message_ids = [m.get("S", "") for m in item.get("message_ids", {"L": []})["L"]]
+    return {
+        "wa_id": item["wa_id"]["S"],
+        "user_name": item.get("user_name", {}).get("S", ""),
+        "user_timezone": item.get("user_timezone", {}).get("S", "UTC"),
+        "subscription": subscription,
+        "conversation": [],
+        "events_v1": events_v1,
+        "events_v2": events_v2,
+        "consent": item.get("consent", {"BOOL": False})["BOOL"],
+        "locked": item.get("locked", {"BOOL": False})["BOOL"],
+        "locked_ts": item.get("locked_ts", {"N": "0"})["N"],
+        "message_ids": [m for m in message_ids if m != ""],
+        "stats": stats,
+        "verbose": item.get("verbose", {"BOOL": False})["BOOL"],
+    }
+
+# previous encoding of db.set_user_events_v2 and db.update_user_events_v2.
+def previous_encode(events):
+    return [{
+        "M": {
+            "ts_bucket": {"N": str(e.get("ts_bucket", "0"))},
+            "event_id": {"S": e["event_id"]},
+            "event_name": {"S": e["event_name"]},
+            "from_date": {"N": str(e["from_date"])},
+            "from_date_str": {"S": e["from_date_str"]},
+            "to_date": {"N": str(e["to_date"])},
+            "to_date_str": {"S": e["to_date_str"]},
+            "frequency": {"S": e["frequency"]},
+            "version": {"S": "2"},
+            "reschedule": {"BOOL": e.get("reschedule", True)},
+            "children": {"L": [
+                {"M": {
+                    "ts_bucket": {"N": c["ts_bucket"]},
+                    "event_id": {"S": c["event_id"]},
+                }} for c in e["children"]
+            ]}
+        }
+    } for e in events]
+
+def bench(name, fn, n=200):
+    durations = []
+    for _ in range(n):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    print(f"{name}: median={1000 * statistics.median(durations):.2f}ms p95={1000 * sorted(durations)[int(0.95 * n)]:.2f}ms")
+
+if __name__ == "__main__":
+    item = synthetic_user_item()
+    print(f"user item: {len(json.dumps(item)) // 1000} KB, {len(item['events_v2']['L'])} events_v2")
+    previous = previous_decode(item)
+    user = codec.User.decode(item)
+    if user != {**previous, "events_v2": [{**e, "reschedule": True} for e in previous["events_v2"]], "events_by_id": {}}:
+        print("codec.User.decode and previous_decode differ")
+    bench("previous decode", lambda: previous_decode(item))
+    bench("codec.User.decode", lambda: codec.User.decode(item))
+    bench("previous encode events_v2", lambda: previous_encode(previous["events_v2"]))
+    bench("codec.Event.encode_list events_v2", lambda: [{"M": e} for e in codec.Event.encode_list(user["events_v2"])])
@@ -0,0 +1,52 @@
+import argparse
+import os
+import statistics
+import sys
+import time
+reminders_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+sys.path.append(reminders_dir)
+import requests
+import reminders.connections as connections
+from reminders.benchmarks.stubs import StubHTTPServer
+
+# compares the per-call latency of a bare requests.post (new connection on every call)
+# against the pooled session of connections.py, on a local HTTP stub.
+# the stub sleeps --connect-latency on every new connection to stand in for the TCP + TLS handshake.
+# to run: python reminders/benchmarks/connections_bench.py [--connect-latency 0.05] [--workers 8]
+
+PAYLOAD = {"messaging_product": "whatsapp", "to": "bench", "type": "text", "text": {"body": "hello"}}
+
+def bare_post(url):
+    return requests.post(url, json=PAYLOAD, timeout=10)
+
+def pooled_post(url):
+    return connections.get_session("bench").post(url, json=PAYLOAD, timeout=10)
+
+def bench(name, post, server, n, workers):
+    from concurrent.futures import ThreadPoolExecutor
+    connections.reset()
+    before = server.connections
+
+    def timed(_):
+        start = time.perf_counter()
+        post(server.url).raise_for_status()
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        durations = sorted(executor.map(timed, range(n)))
+    elapsed = time.perf_counter() - start
+    print(f"{name}: mean={1000 * statistics.mean(durations):.2f}ms p95={1000 * durations[int(0.95 * n)]:.2f}ms "
+          f"total={elapsed:.2f}s connections={server.connections - before}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--connect-latency", type=float, default=0.03, help="simulated handshake time per connection, in seconds")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated server time per request, in seconds")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("-n", type=int, default=200)
+    args = parser.parse_args()
+
+    with StubHTTPServer(latency=args.latency, connect_latency=args.connect_latency) as server:
+        bench("requests.post", bare_post, server, args.n, args.workers)
+        bench("connections.get_session", pooled_post, server, args.n, args.workers)
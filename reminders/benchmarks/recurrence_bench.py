@@ -0,0 +1,55 @@
+import datetime
+import os
+import statistics
+import sys
+import time
+reminders_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+sys.path.append(reminders_dir)
+import reminders.recurrence as recurrence
+import reminders.utils as utils
+
+# compares recurrence.occurrences with the previous implementation of reschedule.future_dates_from_regex,
+# which built a list of datetimes and converted each one back with timestamp().
+# to run: python reminders/benchmarks/recurrence_bench.py
+
+YEAR = 365 * 24 * 60 * 60
+FROM_TS = 1700000000
+
+def previous_dates(value, unit, from_ts, to_ts):
+    from_date = utils.from_timestamp(from_ts, "UTC")
+    delta = datetime.timedelta(**{unit: value})
+    intervals = (to_ts - from_ts) // int(delta.total_seconds())
+    all_dates = [from_date + i * delta for i in range(1, intervals)]
+    return [int(d.timestamp()) for d in all_dates]
+
+def previous_next_n(value, unit, from_ts, after_ts, n):
+    # the previous code only stepped from the last date: reaching `after_ts` walks every occurrence before it.
+    dates = previous_dates(value, unit, from_ts, after_ts + (n + 1) * int(datetime.timedelta(**{unit: value}).total_seconds()))
+    return [ts for ts in dates if ts > after_ts][:n]
+
+def bench(name, fn, n=3):
+    durations = []
+    for _ in range(n):
+        start = time.perf_counter()
+        out = fn()
+        durations.append(time.perf_counter() - start)
+    print(f"{name}: median={1000 * statistics.median(durations):.2f}ms ({len(out)} dates)")
+
+if __name__ == "__main__":
+    for frequency, value, unit, years in [
+        ("every 5 minutes", 5, "minutes", 1),
+        ("every hour", 1, "hours", 10),
+        ("every day", 1, "days", 50),
+    ]:
+        to_ts = FROM_TS + years * YEAR
+        print(f"--- {frequency}, {years} years")
+        bench("previous: all dates", lambda: previous_dates(value, unit, FROM_TS, to_ts))
+        bench("recurrence: all dates", lambda: list(recurrence.occurrences(frequency, FROM_TS, to_ts=to_ts)[0]))
+        # roll forward of a reminder created `years` ago.
+        bench("previous: next 3 dates", lambda: previous_next_n(value, unit, FROM_TS, to_ts, 3))
+        bench("recurrence: next 3 dates", lambda: recurrence.next_occurrences(frequency, FROM_TS, to_ts, -1, 3)[0])
+
+    print("--- every month, 100 years")
+    to_ts = FROM_TS + 100 * YEAR
+    bench("recurrence: all dates", lambda: list(recurrence.occurrences("every month", FROM_TS, to_ts=to_ts)[0]))
+    bench("recurrence: next 3 dates", lambda: recurrence.next_occurrences("every month", FROM_TS, to_ts, -1, 3)[0])
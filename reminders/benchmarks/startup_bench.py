@@ -0,0 +1,63 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+# reports -X importtime timings for each code path of lambda_function, from a fresh interpreter
+# like a lambda cold start. Each code path imports lambda_function then what its branch imports.
+# "eager" is what every cold start used to import, before imports were moved into the branches.
+# the breakdown sums the self time of every module by top-level package (boto3, botocore, pendulum...).
+# to run: python reminders/benchmarks/startup_bench.py [-n 5] [--top 10]
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+
+CODE_PATHS = {
+    "verify (GET)": "import reminders.whatsapp",
+    "check_reminders (EventBridge)": "from check_reminders import check_reminders",
+    "handle_message (WhatsApp)": "from handle_message import handle_message",
+    "ingest (WhatsApp, queue mode)": "import reminders.message_queue; import reminders.connections",
+    "eager": "from check_reminders import check_reminders; from handle_message import handle_message; import reminders.whatsapp",
+}
+
+# returns [(module, self_us, cumulative_us, depth)] from the stderr of `python -X importtime`.
+def parse_importtime(stderr):
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    # drop the interpreter startup, which ends with `site`.
+    site = [i for i, r in enumerate(rows) if r[0] == "site" and r[3] == 0]
+    return rows[site[-1] + 1:] if site else rows
+
+def profile(code):
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    env.setdefault("TIM_PHONE_NUMBER", "")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import lambda_function; {code}"],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    return parse_importtime(proc.stderr)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=5, help="fresh interpreters per code path")
+    parser.add_argument("--top", type=int, default=8, help="heaviest packages to show")
+    args = parser.parse_args()
+
+    for name, code in CODE_PATHS.items():
+        totals = []
+        for _ in range(args.n):
+            rows = profile(code)
+            top_level = [r for r in rows if r[3] == 0]
+            totals.append(sum(r[2] for r in top_level))
+        packages = {}
+        for module, self_us, _, _ in rows:
+            package = module.split(".")[0]
+            packages[package] = packages.get(package, 0) + self_us
+        print(f"{name}: median={statistics.median(totals) / 1000:.1f}ms min={min(totals) / 1000:.1f}ms modules={len(rows)}")
+        for package, self_us in sorted(packages.items(), key=lambda p: -p[1])[:args.top]:
+            print(f"    {self_us / 1000:8.1f}ms  {package}")
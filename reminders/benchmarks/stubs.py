@@ -0,0 +1,138 @@
+import time
+
+# StubDynamoDBClient stands in for a DynamoDB client in benchmarks.
+# every call sleeps for `latency` seconds (a network round trip) and succeeds.
+# `responses` maps an operation name to the response it returns.
+class StubDynamoDBClient:
+    def __init__(self, latency=0.01, responses=None):
+        self.latency = latency
+        self.responses = responses or {}
+        self.calls = []
+
+    def _call(self, operation, kwargs):
+        self.calls.append(operation)
+        time.sleep(self.latency)
+        response = {"ResponseMetadata": {"HTTPStatusCode": 200}}
+        response.update(self.responses.get(operation, {}))
+        return response
+
+    def __getattr__(self, operation):
+        return lambda **kwargs: self._call(operation, kwargs)
+
+# StubHTTPServer is a local HTTP/1.1 server with keep-alive that answers every request with `body`.
+# `connect_latency` is slept once per new connection, to stand in for the TCP + TLS handshake
+# of a remote API. Use as a context manager: `with StubHTTPServer() as server: server.url`.
+# `respond(method, path, request_body)` can return (status, headers, body) to script the responses.
+# if body is a list of (chunk, delay), the chunks are streamed (chunked encoding), each after its delay.
+class StubHTTPServer:
+    def __init__(self, body=b"{}", latency=0.0, connect_latency=0.0, respond=None):
+        import http.server
+        import threading
+
+        stub = self
+        self.connections = 0
+        self.requests = 0
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # without it, keep-alive connections stall on delayed ACKs.
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                stub.connections += 1
+                time.sleep(connect_latency)
+
+            def do_POST(self):
+                self.reply(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+
+            def do_GET(self):
+                self.reply(b"")
+
+            def reply(self, request_body):
+                stub.requests += 1
+                time.sleep(latency)
+                status, headers, resp_body = 200, {}, body
+                if respond:
+                    status, headers, resp_body = respond(self.command, self.path, request_body)
+                try:
+                    self.send_response(status)
+                    if "Content-Type" not in headers:
+                        self.send_header("Content-Type", "application/json")
+                    for k, v in headers.items():
+                        self.send_header(k, v)
+                    if isinstance(resp_body, list):
+                        self.send_header("Transfer-Encoding", "chunked")
+                        self.end_headers()
+                        for chunk, delay in resp_body:
+                            time.sleep(delay)
+                            self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+                            self.wfile.flush()
+                        self.wfile.write(b"0\r\n\r\n")
+                        return
+                    self.send_header("Content-Length", str(len(resp_body)))
+                    self.end_headers()
+                    self.wfile.write(resp_body)
+                except (BrokenPipeError, ConnectionResetError):
+                    # the client timed out.
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        # clients closing connections (timeouts, closed streams) are expected.
+        self.server.handle_error = lambda request, client_address: None
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# FakeOpenAIServer stands in for the openai chat completions API.
+# `script` is a list of (status, headers, content, delay): the n-th request gets the n-th response,
+# the last one is repeated. A 200 returns `content` as the completion, other statuses return an error body.
+# streamed requests get `content` as server-sent events, one word every `token_delay` seconds.
+# non streamed completions report PROMPT_TOKENS prompt tokens and one completion token per word.
+class FakeOpenAIServer(StubHTTPServer):
+    PROMPT_TOKENS = 100
+
+    def __init__(self, script, token_delay=0.0):
+        import json
+        import threading
+
+        self.script = list(script)
+        self.received = []
+        lock = threading.Lock()
+
+        def respond(method, path, request_body):
+            with lock:
+                self.received.append(json.loads(request_body or b"{}"))
+                status, headers, content, delay = self.script[min(len(self.received), len(self.script)) - 1]
+            time.sleep(delay)
+            if status == 200 and self.received[-1].get("stream"):
+                events = [(f"data: {json.dumps({'choices': [{'index': 0, 'delta': {'role': 'assistant'}, 'finish_reason': None}]})}\n\n".encode(), 0)]
+                for token in content.split(" "):
+                    delta = {"choices": [{"index": 0, "delta": {"content": token + " "}, "finish_reason": None}]}
+                    events.append((f"data: {json.dumps(delta)}\n\n".encode(), token_delay))
+                events.append((f"data: {json.dumps({'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]})}\n\n".encode(), 0))
+                events.append((b"data: [DONE]\n\n", 0))
+                return status, {"Content-Type": "text/event-stream"}, events
+            if status == 200:
+                body = {
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": self.PROMPT_TOKENS, "completion_tokens": len(content.split(" "))},
+                }
+            else:
+                body = {"error": {"message": content, "type": "server_error"}}
+            return status, headers, json.dumps(body).encode()
+
+        super().__init__(respond=respond)
+        self.url += "/v1/chat/completions"
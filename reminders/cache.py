@@ -0,0 +1,45 @@
+import threading
+import time
+from collections import OrderedDict
+
+# LRUCache is a thread-safe in-process cache with an optional time to live.
+# it lives as long as the lambda container: entries are shared by warm invocations.
+class LRUCache:
+    def __init__(self, maxsize=256, ttl=0, clock=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl  # in seconds. 0 means entries never expire.
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._items = OrderedDict()  # key -> (value, expires_ts)
+
+    # returns value, found
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None, False
+            value, expires_ts = item
+            if expires_ts and expires_ts <= self.clock():
+                del self._items[key]
+                return None, False
+            self._items.move_to_end(key)
+            return value, True
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = (value, self.clock() + self.ttl if self.ttl else 0)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
@@ -1,9 +1,21 @@
 import os
+import contextvars
 import datetime
+import hashlib
+import json
 import requests
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+import reminders.cache as cache
+import reminders.connections as connections
+import reminders.dynamodb as db
+import reminders.metrics as metrics
+import reminders.prompt_builder as prompt_builder
 import reminders.prompts as prompts
+import reminders.resilience as resilience
 import reminders.utils as utils
 
 
@@ -12,30 +24,214 @@ logging.basicConfig(level = logging.INFO)
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
-def get_openai_completion(messages):
-    timeout = 10
-    retries = 5
-    headers = {"Content-Type": "application/json", "Authorization": "Bearer %s" % os.environ["OPENAI_KEY"]}
-    data = {"model": "gpt-3.5-turbo", "messages": messages, "temperature": 0, "max_tokens": 500}
-    req_counter = 0
-    timed_out = False
-    while req_counter == 0 or (timed_out and req_counter < retries):
-        try:
-            response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=data, timeout=timeout)
-            timed_out = False
-            result = response.json()
-        except requests.exceptions.Timeout:
-            logger.debug(f"make_completion_request: retry after timeout={timeout}. attempt: {req_counter}")
-            timed_out = True
-            result = dict()
-        req_counter += 1
+MODEL = "gpt-3.5-turbo"
+
+# completions of deterministic prompts (timezone and name commands, next date of a reminder) can be cached:
+# - in process, shared by the warm invocations of a lambda container.
+# - in dynamodb (db.COMPLETION_CACHE_TABLE), shared by all containers until the TTL expires.
+# the key is a hash of the whole request, so editing a prompt never serves a stale completion.
+COMPLETION_CACHE_SIZE = 512
+COMPLETION_CACHE_TTL = 30 * 24 * 60 * 60  # in seconds.
+completion_cache = cache.LRUCache(maxsize=COMPLETION_CACHE_SIZE, ttl=COMPLETION_CACHE_TTL)
+
+def completion_key(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+# returns the cached completion, "" if not cached.
+def get_cached_completion(key):
+    out, found = completion_cache.get(key)
+    if found:
+        metrics.incr("completion_cache.hit.memory")
+        return out
+    out, err = db.get_cached_completion(db.get_client(), key)
+    if err:
+        print(f"get_cached_completion error: {err}")
+    if out:
+        metrics.incr("completion_cache.hit.dynamodb")
+        completion_cache.set(key, out)
+        return out
+    metrics.incr("completion_cache.miss")
+    return ""
+
+def set_cached_completion(key, out):
+    completion_cache.set(key, out)
+    err = db.put_cached_completion(db.get_client(), key, out, COMPLETION_CACHE_TTL)
+    if err:
+        print(f"set_cached_completion error: {err}")
+
+# only use `cache=True` for prompts whose answer does not depend on when they are sent.
+# empty completions (errors) are never cached.
+# `stage` names the step of the request in the token usage metrics (see record_usage).
+def get_openai_completion(messages, cache=False, stage="other"):
+    data = {"model": MODEL, "messages": messages, "temperature": 0, "max_tokens": prompt_builder.COMPLETION_TOKENS}
+    if cache:
+        key = completion_key(data)
+        out = get_cached_completion(key)
+        if out:
+            return out
+    out = request_completion(data, stage=stage)
+    if cache and out:
+        set_cached_completion(key, out)
+    return out
+
+OPENAI_URL = "https://api.openai.com/v1/chat/completions"
+CONNECT_TIMEOUT = 3  # in seconds.
+ATTEMPT_TIMEOUT = 15  # in seconds.
+MAX_ATTEMPTS = 4
+# time budget of a completion when the caller did not set a deadline (see resilience.deadline).
+CALL_BUDGET = 30  # in seconds.
+MIN_ATTEMPT_TIME = 1  # in seconds. We don't start an attempt with less time left.
+BACKOFF_BASE = 0.5  # in seconds.
+BACKOFF_CAP = 8  # in seconds.
+RETRYABLE_STATUS = (408, 409, 429, 500, 502, 503, 504)
+# shared by all requests of the lambda container: during an outage, calls fail fast instead of
+# holding the invocation until the timeouts.
+openai_breaker = resilience.CircuitBreaker(failure_threshold=5, reset_timeout=30)
+
+# request_completion returns the completion, "" on error.
+def request_completion(data, stage="other", sleep=time.sleep):
+    response = post_completion(data, sleep=sleep)
+    if response is None:
+        return ""
+    out = completion_content(response)
+    try:
+        usage = response.json()["usage"]
+        prompt_builder.record_usage(stage, usage["prompt_tokens"], usage["completion_tokens"])
+    except Exception:
+        record_usage(stage, data["messages"], out)
+    return out
+
+# record_usage adds the estimated token usage of a completion to the metrics,
+# for responses that don't report it (streamed completions).
+def record_usage(stage, messages, out):
+    prompt_builder.record_usage(stage, prompt_builder.count_message_tokens(messages), prompt_builder.count_tokens(out))
+
+# post_completion returns the 200 response of the chat completions API, None on error.
+# it retries timeouts, connection errors, 429 and 5xx with backoff (or the delay the server asks for),
+# within the deadline of the request.
+# with `stream`, it returns as soon as the headers are received.
+def post_completion(data, stream=False, sleep=time.sleep):
+    if not openai_breaker.allow():
+        metrics.incr("openai.circuit_open")
+        logger.debug("post_completion: circuit open, failing fast.")
+        return None
+    headers = {"Content-Type": "application/json", "Authorization": "Bearer %s" % os.environ.get("OPENAI_KEY", "")}
+    with resilience.deadline(CALL_BUDGET):
+        attempt = 0
+        while True:
+            left = resilience.remaining(CALL_BUDGET)
+            delay = -1
+            try:
+                with metrics.timer("openai.latency"):
+                    response = connections.get_session("openai").post(
+                        OPENAI_URL,
+                        headers=headers,
+                        json=data,
+                        timeout=(min(CONNECT_TIMEOUT, left), min(ATTEMPT_TIMEOUT, left)),
+                        stream=stream,
+                    )
+                if response.status_code == 200:
+                    openai_breaker.record_success()
+                    return response
+                metrics.incr(f"openai.status.{response.status_code}")
+                if response.status_code not in RETRYABLE_STATUS:
+                    # the upstream is up but refuses the request: retrying won't help.
+                    openai_breaker.record_success()
+                    logger.debug(f"post_completion: status {response.status_code}: {response.text}")
+                    return None
+                delay = resilience.retry_after(response.headers)
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+                metrics.incr("openai.connection_error")
+                logger.debug(f"post_completion: {e}. attempt: {attempt}")
+            openai_breaker.record_failure()
 
+            attempt += 1
+            if delay < 0:
+                delay = resilience.backoff(attempt - 1, BACKOFF_BASE, BACKOFF_CAP)
+            if attempt >= MAX_ATTEMPTS or delay + MIN_ATTEMPT_TIME > resilience.remaining(CALL_BUDGET):
+                metrics.incr("openai.gave_up")
+                return None
+            # the upstream may have been declared down by other calls in the meantime.
+            if not openai_breaker.allow():
+                metrics.incr("openai.circuit_open")
+                return None
+            sleep(delay)
+
+def completion_content(response):
     try:
-        out_msg = result['choices'][0]['message']['content']
+        return response.json()['choices'][0]['message']['content']
     except Exception as e:
-        out_msg = ""
-        # logger.debug(f"get_openai_completion. Error: {e}. Response: {result}")
-    return out_msg
+        logger.debug(f"completion_content. Error: {e}. Response: {response.text}")
+        return ""
+
+# stream_completion requests the completion as server-sent events.
+# iterate over the returned CompletionStream to get the text as it is generated.
+def stream_completion(messages, stage="other"):
+    data = {"model": MODEL, "messages": messages, "temperature": 0, "max_tokens": prompt_builder.COMPLETION_TOKENS, "stream": True}
+    return CompletionStream(post_completion(data, stream=True), stage=stage, messages=messages)
+
+# CompletionStream yields the content deltas of a streamed completion.
+# `text` is the content received so far. `error` is set if the request or the stream failed:
+# `text` is then incomplete. `close` stops the generation, e.g. once the caller has what it needs.
+# streamed responses don't report their token usage: it is estimated from the text received when the stream is closed.
+class CompletionStream:
+    def __init__(self, response, stage="other", messages=None):
+        self.response = response
+        self.text = ""
+        self.error = None if response is not None else "request failed"
+        self.finished = False
+        self.stage = stage
+        self.messages = messages or []
+        self.usage_recorded = False
+
+    def __iter__(self):
+        if self.response is None:
+            return
+        try:
+            for line in self.response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                payload = line[len("data:"):].strip()
+                if payload == "[DONE]":
+                    break
+                choice = json.loads(payload)["choices"][0]
+                delta = choice.get("delta", {}).get("content") or ""
+                if delta:
+                    self.text += delta
+                    yield delta
+                if choice.get("finish_reason"):
+                    break
+            self.finished = True
+        except GeneratorExit:
+            raise
+        except Exception as e:
+            self.error = e
+            logger.debug(f"CompletionStream error: {e}")
+        finally:
+            self.close()
+
+    def close(self):
+        if self.response is not None:
+            self.response.close()
+            if not self.usage_recorded:
+                self.usage_recorded = True
+                record_usage(self.stage, self.messages, self.text)
+
+# completions are network bound: a few threads are enough to run the independent calls of a request together.
+COMPLETION_WORKERS = 4
+_executor = None
+_executor_lock = threading.Lock()
+
+# submit_completion runs get_openai_completion in a thread pool.
+# returns a concurrent.futures.Future: `future.result()` returns the completion.
+def submit_completion(messages, stage="other"):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=COMPLETION_WORKERS, thread_name_prefix="completion")
+    # the completion runs with the deadline of the caller.
+    ctx = contextvars.copy_context()
+    return _executor.submit(ctx.run, get_openai_completion, messages, stage=stage)
 
 # todo: retry when params are wrong
 # todo: still log usr_msg if chat doesn't work
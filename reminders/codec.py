@@ -0,0 +1,580 @@
+import collections
+import itertools
+import operator
+
+# typed records for the dynamodb items, with their wire format ({"S": ..}, {"N": ..}, {"M": ..}) in one place.
+# each record class lists its fields once: the decode and encode tables are built from it, so the users,
+# events, messages and rules formats can't drift apart between readers and writers.
+# records behave like the dicts they replace: user["user_name"], user.get("verbose", False).
+
+# field kinds:
+# - S: string.
+# - N: number, decoded as int. Values that don't parse get the default.
+# - N_STR: number, kept as a string (e.g. legacy ts_bucket).
+# - BOOL: boolean.
+# - SS: string set, decoded as a list.
+# - L_S: list of strings. Empty strings are dropped.
+# - L: list of records of class `record`.
+# - M: record of class `record`.
+# - M_MAP: map of records of class `record`, decoded as a dict (e.g. reminders by event_id).
+# - LOCAL: not stored in the item (e.g. the conversation, loaded from its own table).
+#
+# decoding and encoding are table driven: each record class builds, once, tables of its fields by kind.
+# a single item is read with one loop per scalar kind, that reads the wire format inline. Lists of items
+# (the reminders of a user) are read a field (a column) at a time, with map over builtins: the python
+# work is per field, not per field and per item. A column with a missing or malformed value falls back
+# to the per value functions, item by item. The records of nested lists and maps (e.g. the children of
+# every reminder) are decoded as one list.
+
+get_s = operator.itemgetter("S")
+get_n = operator.itemgetter("N")
+get_bool = operator.itemgetter("BOOL")
+get_ss = operator.itemgetter("SS")
+get_l = operator.itemgetter("L")
+get_m = operator.itemgetter("M")
+SCALAR_KINDS = ("S", "N", "N_STR", "BOOL")
+DECODE_ERRORS = (KeyError, TypeError, ValueError, AttributeError)
+# lists shorter than this are decoded and encoded item by item: setting up the columns costs more.
+COLUMN_MIN = 16
+# consume runs an iterator for its side effects.
+consume = collections.deque(maxlen=0).extend
+
+# decode functions of the value `v` of an attribute, for each kind.
+# the kinds of records take the decode function of the record class (of lists of records for L and M_MAP).
+def decode_s(v):
+    return v["S"]
+
+def decode_n(v):
+    return int(v["N"])
+
+def decode_n_str(v):
+    return v["N"]
+
+def decode_bool(v):
+    return v["BOOL"]
+
+def decode_ss(v):
+    return list(v["SS"])
+
+def decode_l_s(v):
+    return [x["S"] for x in v["L"] if x.get("S")]
+
+def decode_l(decode_list):
+    return lambda v: decode_list([x.get("M", {}) for x in v["L"]])
+
+def decode_m(decode):
+    return lambda v: decode(v["M"])
+
+def decode_m_map(decode_list):
+    return lambda v: dict(zip(v["M"], decode_list([x.get("M", {}) for x in v["M"].values()])))
+
+DECODERS = {"S": decode_s, "N": decode_n, "N_STR": decode_n_str, "BOOL": decode_bool, "SS": decode_ss, "L_S": decode_l_s}
+RECORD_DECODERS = {"L": decode_l, "M": decode_m, "M_MAP": decode_m_map}
+
+# split returns `values` cut into lists of the given lengths.
+def split(values, lengths):
+    offsets = list(itertools.accumulate(lengths, initial=0))
+    return [values[i:j] for i, j in zip(offsets, offsets[1:])]
+
+# column decoders return the decoded values of a column of attribute values, for each kind.
+# they raise on the first malformed value.
+def column_s(values):
+    return map(get_s, values)
+
+def column_n(values):
+    return map(int, map(get_n, values))
+
+def column_n_str(values):
+    return map(get_n, values)
+
+def column_bool(values):
+    return map(get_bool, values)
+
+def column_ss(values):
+    return map(list, map(get_ss, values))
+
+def column_l_s(values):
+    return map(decode_l_s, values)
+
+# the records of all the lists (or maps) are decoded at once, then split back.
+def column_l(decode_list):
+    def column(values):
+        lists = list(map(get_l, values))
+        records = decode_list(list(map(get_m, itertools.chain.from_iterable(lists))))
+        return split(records, map(len, lists))
+    return column
+
+def column_m(decode_list):
+    return lambda values: decode_list(list(map(get_m, values)))
+
+def column_m_map(decode_list):
+    def column(values):
+        maps = list(map(get_m, values))
+        records = iter(decode_list(list(map(get_m, itertools.chain.from_iterable(map(dict.values, maps))))))
+        # zip stops at the last key of each map, before taking a record of the next one.
+        return [dict(zip(m, records)) for m in maps]
+    return column
+
+COLUMN_DECODERS = {"S": column_s, "N": column_n, "N_STR": column_n_str, "BOOL": column_bool, "SS": column_ss, "L_S": column_l_s}
+RECORD_COLUMN_DECODERS = {"L": column_l, "M": column_m, "M_MAP": column_m_map}
+
+# column encoders return the attribute values of the values `values` (without None), for each kind.
+# None stands for a value that is not written: dynamodb rejects empty numbers and sets.
+def encode_s(values):
+    return [{"S": v} for v in values]
+
+def encode_n(values):
+    return [{"N": s} if s else None for s in map(str, values)]
+
+def encode_bool(values):
+    return [{"BOOL": v} for v in map(bool, values)]
+
+def encode_ss(values):
+    return [{"SS": list(v)} if v else None for v in values]
+
+def encode_l_s(values):
+    return [{"L": [{"S": s} for s in v]} for v in values]
+
+# the records of all the lists (or maps) are encoded at once, then split back.
+def encode_l(encode_list):
+    def encode(values):
+        records = [{"M": r} for r in encode_list(list(itertools.chain.from_iterable(values)))]
+        return [{"L": l} for l in split(records, map(len, values))]
+    return encode
+
+def encode_m(encode_list):
+    return lambda values: [{"M": r} for r in encode_list(values)]
+
+def encode_m_map(encode_list):
+    def encode(values):
+        records = iter(encode_list(list(itertools.chain.from_iterable(map(dict.values, values)))))
+        return [{"M": {k: {"M": r} for k, r in zip(v, records)}} for v in values]
+    return encode
+
+ENCODERS = {"S": encode_s, "N": encode_n, "N_STR": encode_n, "BOOL": encode_bool, "SS": encode_ss, "L_S": encode_l_s}
+RECORD_ENCODERS = {"L": encode_l, "M": encode_m, "M_MAP": encode_m_map}
+
+class Field:
+    __slots__ = ("name", "kind", "default", "attr", "record")
+
+    def __init__(self, name, kind, default=None, attr=None, record=None):
+        if kind not in DECODERS and kind not in RECORD_DECODERS and kind != "LOCAL":
+            raise ValueError(f"unknown field kind: {kind}")
+        self.name = name
+        self.kind = kind
+        self.default = default
+        self.attr = attr or name
+        self.record = record
+
+    # mutable defaults are never shared: they are created for each record.
+    def mutable(self):
+        return self.kind not in SCALAR_KINDS and (self.kind != "LOCAL" or isinstance(self.default, list))
+
+    # returns a function that creates the default value.
+    def default_factory(self):
+        if self.kind in ("SS", "L_S", "L") or (self.kind == "LOCAL" and isinstance(self.default, list)):
+            return list
+        if self.kind == "M":
+            return self.record.new
+        if self.kind == "M_MAP":
+            return dict
+        default = self.default
+        return lambda: default
+
+    # returns the defaults of `n` records.
+    def defaults(self, n):
+        if not self.mutable():
+            return itertools.repeat(self.default, n)
+        factory = self.default_factory()
+        return [factory() for _ in range(n)]
+
+    def decode_fn(self):
+        if self.kind in RECORD_DECODERS:
+            return RECORD_DECODERS[self.kind](self.record.decoder() if self.kind == "M" else self.record.list_decoder())
+        return DECODERS[self.kind]
+
+    def column_decoder(self):
+        if self.kind in RECORD_COLUMN_DECODERS:
+            return RECORD_COLUMN_DECODERS[self.kind](self.record.list_decoder())
+        return COLUMN_DECODERS[self.kind]
+
+    def encoder(self):
+        if self.kind in RECORD_ENCODERS:
+            return RECORD_ENCODERS[self.kind](self.record.encode_list)
+        return ENCODERS[self.kind]
+
+
+# records keep their values in one list, in the order of FIELDS: decoding an item fills the list and
+# sets it on a new record, without an attribute assignment per field. Fields are also attributes
+# (event.from_date), through properties.
+class Record:
+    __slots__ = ("_values",)
+    FIELDS = ()
+
+    def __init_subclass__(cls):
+        super().__init_subclass__()
+        cls._names = tuple(f.name for f in cls.FIELDS)
+        cls._index = {name: i for i, name in enumerate(cls._names)}
+        cls._defaults = tuple(f.default_factory() for f in cls.FIELDS)
+        cls._attrs = frozenset(f.attr for f in cls.FIELDS if f.kind != "LOCAL")
+        for i, name in enumerate(cls._names):
+            setattr(cls, name, property(field_getter(i), field_setter(i)))
+        # (index, attr, default) of the stored scalar fields by kind, (index, attr, column encoder, default) of the others.
+        stored = [(i, f) for i, f in enumerate(cls.FIELDS) if f.kind != "LOCAL"]
+        cls._string_encoders = tuple((i, f.attr, f.default) for i, f in stored if f.kind == "S")
+        cls._number_encoders = tuple((i, f.attr, f.default) for i, f in stored if f.kind in ("N", "N_STR"))
+        cls._bool_encoders = tuple((i, f.attr, f.default) for i, f in stored if f.kind == "BOOL")
+        cls._other_encoders = tuple((i, f.attr, f.encoder(), f.default_factory()) for i, f in stored if f.kind not in SCALAR_KINDS)
+        cls._column_encoders = tuple((i, f.encoder(), f.default_factory()) for i, f in stored)
+        cls._stored_attrs = tuple(f.attr for _, f in stored)
+        # attributes whose encoder can return None.
+        cls._skipped_attrs = tuple((k, f.attr) for k, (_, f) in enumerate(stored) if f.kind in ("N", "N_STR", "SS"))
+        cls._decoders = {}
+
+    # decoder returns the decode function of items that only have the attributes `attrs` (e.g. read with a
+    # ProjectionExpression): the other fields are set to their default value without looking them up.
+    # attrs=None decodes all the attributes. Decoders are built once per set of attributes.
+    @classmethod
+    def decoder(cls, attrs=None):
+        return cls.decoders(attrs)[0]
+
+    # list_decoder is decoder for lists of items.
+    @classmethod
+    def list_decoder(cls, attrs=None):
+        return cls.decoders(attrs)[1]
+
+    # decoders returns the decode functions of an item and of a list of items.
+    # a single item is decoded with one loop per kind of scalar field, so that each loop reads the wire
+    # format inline, and lists of at least COLUMN_MIN items a column at a time.
+    @classmethod
+    def decoders(cls, attrs=None):
+        attrs = cls._attrs if attrs is None else frozenset(attrs)
+        if attrs in cls._decoders:
+            return cls._decoders[attrs]
+        unknown = attrs - cls._attrs
+        if unknown:
+            raise ValueError(f"{cls.__name__} has no attributes {sorted(unknown)}")
+        fields = [(i, f) for i, f in enumerate(cls.FIELDS) if f.kind != "LOCAL" and f.attr in attrs]
+        strings = tuple((i, f.attr) for i, f in fields if f.kind == "S")
+        numbers = tuple((i, f.attr) for i, f in fields if f.kind == "N")
+        number_strings = tuple((i, f.attr) for i, f in fields if f.kind == "N_STR")
+        bools = tuple((i, f.attr) for i, f in fields if f.kind == "BOOL")
+        others = tuple((i, f.attr, f.decode_fn(), f.default_factory()) for i, f in fields if f.kind not in SCALAR_KINDS)
+        columns = tuple((i, operator.itemgetter(f.attr), f.attr, f.column_decoder(), f.decode_fn(), f.default_factory()) for i, f in fields)
+        defaulted = tuple((i, f) for i, f in enumerate(cls.FIELDS) if f.kind == "LOCAL" or f.attr not in attrs)
+        # the values of a new item: the immutable defaults, the others are set by decode.
+        template = [None if f.mutable() else f.default for f in cls.FIELDS]
+        factories = tuple((i, f.default_factory()) for i, f in defaulted if f.mutable())
+        n_fields = len(cls.FIELDS)
+        new = object.__new__
+        repeat = itertools.repeat
+
+        # missing or malformed attributes keep the default value.
+        def decode(item):
+            values = template.copy()
+            for i, attr in strings:
+                try:
+                    values[i] = item[attr]["S"]
+                except DECODE_ERRORS:
+                    pass
+            for i, attr in numbers:
+                try:
+                    values[i] = int(item[attr]["N"])
+                except DECODE_ERRORS:
+                    pass
+            for i, attr in number_strings:
+                try:
+                    values[i] = item[attr]["N"]
+                except DECODE_ERRORS:
+                    pass
+            for i, attr in bools:
+                try:
+                    values[i] = item[attr]["BOOL"]
+                except DECODE_ERRORS:
+                    pass
+            for i, attr, decode_fn, default in others:
+                try:
+                    values[i] = decode_fn(item[attr])
+                except DECODE_ERRORS:
+                    values[i] = default()
+            for i, default in factories:
+                values[i] = default()
+            obj = new(cls)
+            obj._values = values
+            return obj
+
+        def decode_list(items):
+            if len(items) < COLUMN_MIN:
+                return list(map(decode, items))
+            cols = [None] * n_fields
+            for i, get, attr, column, decode_fn, default in columns:
+                try:
+                    cols[i] = list(column(map(get, items)))
+                # a missing or malformed attribute: the column is decoded item by item.
+                except DECODE_ERRORS:
+                    cols[i] = [decode_item(item, attr, decode_fn, default) for item in items]
+            for i, f in defaulted:
+                cols[i] = f.defaults(len(items))
+            objs = list(map(new, repeat(cls, len(items))))
+            consume(map(setattr, objs, repeat("_values"), map(list, zip(*cols))))
+            return objs
+
+        cls._decoders[attrs] = decode, decode_list
+        return decode, decode_list
+
+    # new returns a record with the default values, updated with `values`.
+    @classmethod
+    def new(cls, **values):
+        obj = object.__new__(cls)
+        obj._values = [values[name] if name in values else default() for name, default in zip(cls._names, cls._defaults)]
+        return obj
+
+    # decode returns the record of a dynamodb item (the value of "Item", or of an "M").
+    @classmethod
+    def decode(cls, item):
+        return cls.decoders()[0](item)
+
+    @classmethod
+    def decode_list(cls, items):
+        return cls.decoders()[1](items)
+
+    # encode returns the dynamodb item of a record or a dict with the same keys.
+    # keys missing from a dict (or None) are written with their default value.
+    # like decode, one loop per kind of scalar field.
+    @classmethod
+    def encode(cls, obj):
+        values = obj._values if type(obj) is cls else [obj.get(name) for name in cls._names]
+        item = {}
+        for i, attr, default in cls._string_encoders:
+            v = values[i]
+            item[attr] = {"S": default if v is None else v}
+        for i, attr, default in cls._number_encoders:
+            v = values[i]
+            v = str(default if v is None else v)
+            # dynamodb rejects empty numbers.
+            if v:
+                item[attr] = {"N": v}
+        for i, attr, default in cls._bool_encoders:
+            v = values[i]
+            item[attr] = {"BOOL": bool(default if v is None else v)}
+        for i, attr, encode, default in cls._other_encoders:
+            v = values[i]
+            v = encode([default() if v is None else v])[0]
+            if v is not None:
+                item[attr] = v
+        return item
+
+    # encode_list returns the items of a list of records or dicts, a column at a time.
+    @classmethod
+    def encode_list(cls, objs):
+        if len(objs) < COLUMN_MIN:
+            return list(map(cls.encode, objs))
+        if set(map(type, objs)) <= {cls}:
+            cols = list(zip(*map(get_values, objs)))
+        else:
+            cols = list(zip(*[[obj.get(name) for name in cls._names] for obj in objs]))
+        encoded = []
+        for i, encode, default in cls._column_encoders:
+            values = cols[i]
+            if None in values:
+                values = [default() if v is None else v for v in values]
+            encoded.append(encode(values))
+        # the items are built from their rows of attribute values.
+        items = list(map(dict, map(zip, itertools.repeat(cls._stored_attrs), zip(*encoded))))
+        for k, attr in cls._skipped_attrs:
+            if None in encoded[k]:
+                for item in items:
+                    if item[attr] is None:
+                        del item[attr]
+        return items
+
+    # dict interface.
+    def __getitem__(self, key):
+        return self._values[self._index[key]]
+
+    def __setitem__(self, key, value):
+        self._values[self._index[key]] = value
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def get(self, key, default=None):
+        i = self._index.get(key)
+        return default if i is None else self._values[i]
+
+    def keys(self):
+        return self._names
+
+    def values(self):
+        return list(self._values)
+
+    def items(self):
+        return list(zip(self._names, self._values))
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    # to_dict returns the record as plain dicts and lists, e.g. to serialize it.
+    def to_dict(self):
+        return {name: to_plain(v) for name, v in zip(self._names, self._values)}
+
+    def __eq__(self, other):
+        if isinstance(other, (Record, dict)):
+            return self.to_dict() == to_plain(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+get_values = operator.attrgetter("_values")
+
+def field_getter(i):
+    return lambda self: self._values[i]
+
+def field_setter(i):
+    def set_(self, value):
+        self._values[i] = value
+    return set_
+
+def decode_item(item, attr, decode_fn, default):
+    try:
+        return decode_fn(item[attr])
+    except DECODE_ERRORS:
+        return default()
+
+def to_plain(value):
+    if isinstance(value, Record):
+        return value.to_dict()
+    if isinstance(value, dict):
+        return {k: to_plain(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [to_plain(v) for v in value]
+    return value
+
+
+# ----- RECORDS -----
+# key of an item of the events table, in the user's `events` (v1) and in `children`.
+class EventKey(Record):
+    FIELDS = (
+        Field("ts_bucket", "N_STR", "-1"),
+        Field("event_id", "S", ""),
+    )
+    __slots__ = ()
+
+# reminder in the user's `events_v2` list.
+class Event(Record):
+    FIELDS = (
+        Field("ts_bucket", "N_STR", ""),  # legacy
+        Field("event_id", "S", ""),
+        Field("event_name", "S", ""),
+        Field("from_date", "N", -1),
+        Field("from_date_str", "S", ""),
+        Field("to_date", "N", -1),
+        Field("to_date_str", "S", ""),
+        Field("frequency", "S", ""),
+        Field("version", "S", "2"),
+        Field("reschedule", "BOOL", True),
+        Field("children", "L", record=EventKey),
+    )
+    __slots__ = ()
+
+# item of the events table (db.EVENTS_TABLE).
+class EventItem(Record):
+    FIELDS = (
+        Field("ts_bucket", "N", -1),
+        Field("event_id", "S", ""),
+        Field("wa_id", "S", ""),
+        Field("event_name", "S", ""),
+        Field("event_timestamp_str", "S", ""),  # legacy
+        Field("event_timestamp", "N_STR", ""),  # legacy
+        Field("from_date", "N_STR", ""),
+        Field("from_date_str", "S", ""),
+        Field("to_date", "N_STR", "-1"),
+        Field("to_date_str", "S", ""),
+        Field("frequency", "S", ""),
+        Field("scheduled", "BOOL", False),
+        Field("version", "S", ""),
+        Field("reschedule", "BOOL", True),
+        Field("rule_id", "S", ""),
+        Field("user_timezone", "S", ""),
+    )
+    __slots__ = ()
+
+# item of the messages table (db.MESSAGES_TABLE).
+class Message(Record):
+    FIELDS = (
+        Field("text", "S", ""),
+        Field("timestamp", "N", 0),
+        Field("role", "S", ""),
+        Field("setup", "S", ""),
+        Field("type", "S", ""),
+        Field("version", "S", ""),
+        Field("id", "S", ""),
+    )
+    __slots__ = ()
+
+# see db.set_user_stats.
+class Stats(Record):
+    FIELDS = (
+        Field("messages_sent", "N", 0),
+        Field("active_days", "SS"),
+        Field("reminders_created", "N", 0),
+        Field("creation_ts", "N", 0),
+        Field("last_active_ts", "N", 0),
+        Field("chat_messages", "N", 0),
+    )
+    __slots__ = ()
+
+class Subscription(Record):
+    FIELDS = (
+        Field("subID", "S", ""),
+        Field("subStatus", "S", ""),
+    )
+    __slots__ = ()
+
+# item of the users table (db.USERS_TABLE).
+class User(Record):
+    FIELDS = (
+        Field("wa_id", "S", ""),
+        Field("user_name", "S", ""),
+        Field("user_timezone", "S", "UTC"),
+        Field("subscription", "M", record=Subscription),
+        Field("conversation", "LOCAL", []),  # see db.get_conversation.
+        Field("events_v1", "L", attr="events", record=EventKey),
+        Field("events_v2", "L", record=Event),  # legacy, see migrations.index_user_events.
+        Field("events_by_id", "M_MAP", record=Event),  # event_id -> reminder. See db.put_user_event.
+        Field("consent", "BOOL", False),
+        Field("locked", "BOOL", False),
+        Field("locked_ts", "N_STR", "0"),
+        Field("message_ids", "L_S"),  # last message ids. Used to make sure we don't process the same message twice.
+        Field("stats", "M", record=Stats),
+        Field("verbose", "BOOL", False),
+    )
+    __slots__ = ()
+
+# key and date of a pending occurrence of a rule.
+class Occurrence(Record):
+    FIELDS = (
+        Field("ts_bucket", "N", -1),
+        Field("event_id", "S", ""),
+        Field("from_date", "N", -1),
+    )
+    __slots__ = ()
+
+# item of the rules table (db.RULES_TABLE), see recurrence.py.
+class Rule(Record):
+    FIELDS = (
+        Field("rule_id", "S", ""),
+        Field("wa_id", "S", ""),
+        Field("event_name", "S", ""),
+        Field("frequency", "S", ""),
+        Field("from_date", "N", -1),
+        Field("to_date", "N", -1),
+        Field("to_date_str", "S", ""),
+        Field("cursor", "N", -1),
+        Field("occurrences", "L", record=Occurrence),
+    )
+    __slots__ = ()
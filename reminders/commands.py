@@ -67,7 +67,9 @@ def timezone_command(msg, client, user, hist):
         [
             {"role": "system", "content": prompts.UPDATE_TIMEZONE_PROMPT}, 
             {"role": "user", "content": msg}
-        ]
+        ],
+        cache=True,
+        stage="timezone",
     )
     if not out:
         print("0. OpenAI empty response")
@@ -129,7 +131,9 @@ def name_command(user, hist, client, msg):
         [
             {"role": "system", "content": prompts.UPDATE_USERNAME_PROMPT}, 
             {"role": "user", "content": msg}
-        ]
+        ],
+        cache=True,
+        stage="name",
     )
     print(f"OpenAI response: {out}")
     if out.strip("`\"\' ").startswith("YES"):
@@ -0,0 +1,74 @@
+import threading
+
+import boto3
+import requests
+from botocore.config import Config
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# process-wide AWS clients and HTTP sessions.
+# they are created on first use and kept in module globals, so warm lambda invocations
+# reuse open connections instead of paying TCP + TLS setup on every call.
+
+# dispatch.py sends up to SEND_WORKERS reminders in parallel, each holding a connection.
+POOL_MAXSIZE = 32
+POOL_CONNECTIONS = 4  # number of hosts per session.
+# retries only cover failures before the request is sent, and 502/503/504 on GET.
+# a POST that reached the server is never replayed: it could send a whatsapp message twice.
+CONNECT_RETRIES = 2
+BACKOFF_FACTOR = 0.2  # in seconds.
+
+_lock = threading.Lock()
+_clients = {}
+_sessions = {}
+
+# returns the boto3 client for `service` (e.g. "dynamodb", "scheduler").
+def get_client(service):
+    client = _clients.get(service)
+    if client is not None:
+        return client
+    with _lock:
+        if service not in _clients:
+            config = Config(
+                max_pool_connections=POOL_MAXSIZE,
+                tcp_keepalive=True,
+                retries={"mode": "standard"},
+            )
+            _clients[service] = boto3.client(service, config=config)
+        return _clients[service]
+
+def new_session():
+    retry = Retry(
+        total=CONNECT_RETRIES,
+        connect=CONNECT_RETRIES,
+        read=0,
+        status=CONNECT_RETRIES,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset(["GET"]),
+        backoff_factor=BACKOFF_FACTOR,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+# returns the shared session for `name` (e.g. "whatsapp", "openai").
+# one session per API so that a slow API does not exhaust the pool of the other.
+def get_session(name):
+    session = _sessions.get(name)
+    if session is not None:
+        return session
+    with _lock:
+        if name not in _sessions:
+            _sessions[name] = new_session()
+        return _sessions[name]
+
+# drops every client and session. Used in tests and benchmarks.
+def reset():
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+        _clients.clear()
@@ -0,0 +1,68 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import reminders.metrics as metrics
+
+# this file fans reminders out to a bounded pool of workers.
+# events are grouped by due second: each group is submitted to the send pool when it is due.
+# `prepare` (e.g. rescheduling, which may call OpenAI) runs in its own pool as soon as
+# dispatching starts, so a slow reschedule never delays a send.
+
+SEND_WORKERS = 32
+PREPARE_WORKERS = 8
+
+# run sends every event at its `from_date` and returns the number of events sent.
+# - prepare(event) returns a value handed to send, or None.
+# - send(event, prepared) is called when the event is due. If prepare is not done yet,
+#   send gets None instead of waiting for it.
+def run(events, send, prepare=None, send_workers=SEND_WORKERS, prepare_workers=PREPARE_WORKERS, sleep=time.sleep, clock=time.time):
+    if not events:
+        return 0
+
+    groups = {}
+    for event in events:
+        groups.setdefault(int(event["from_date"]), []).append(event)
+
+    start = clock()
+    with ThreadPoolExecutor(max_workers=prepare_workers) as prepare_pool, ThreadPoolExecutor(max_workers=send_workers) as send_pool:
+        prepared = {}
+        if prepare:
+            for event in events:
+                prepared[event["event_id"]] = prepare_pool.submit(prepare, event)
+
+        sent = []
+        for due_ts in sorted(groups):
+            t = due_ts - clock()
+            if t > 0:
+                sleep(t)
+            for event in groups[due_ts]:
+                sent.append(send_pool.submit(_send, send, event, prepared.get(event["event_id"]), clock))
+        wait(sent)
+
+    elapsed = clock() - start
+    num_sent = sum(1 for f in sent if f.result())
+    metrics.incr("reminders.sent", num_sent)
+    metrics.incr("reminders.failed", len(sent) - num_sent)
+    if elapsed > 0:
+        metrics.observe("reminders.throughput", num_sent / elapsed)
+    return num_sent
+
+def _send(send, event, prepared, clock):
+    value = None
+    if prepared is not None and prepared.done():
+        try:
+            value = prepared.result()
+        except Exception as e:
+            print(f"dispatch: prepare failed for event_id={event['event_id']}: {e}")
+    elif prepared is not None:
+        metrics.incr("reminders.prepare_not_ready")
+
+    try:
+        with metrics.timer("reminders.send_duration"):
+            send(event, value)
+    except Exception as e:
+        print(f"dispatch: send failed for event_id={event['event_id']}: {e}")
+        return False
+    # how late the reminder went out compared to its due time.
+    metrics.observe("reminders.latency", clock() - int(event["from_date"]))
+    return True
@@ -1,19 +1,47 @@
 import json
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import reminders.cache as cache
 import reminders.utils as utils
+import reminders.codec as codec
+import reminders.connections as connections
 
-import boto3
 from botocore.exceptions import ClientError
 
 USERS_TABLE = "RemindersUsers"
 EVENTS_TABLE = "RemindersEvents"
 FEEDBACK_TABLE = "MindyFeedback"
 DAU_TABLE = "daily_active_users"
+META_TABLE = "RemindersMeta"
+# completions of deterministic prompts. partition key: key (see chat.completion_key). TTL attribute: expires_ts.
+COMPLETION_CACHE_TABLE = "RemindersCompletionCache"
+# one item per message. partition key: wa_id, sort key: msg_key (see message_key).
+MESSAGES_TABLE = "RemindersMessages"
+# one item per recurring reminder (see recurrence.py). partition key: rule_id.
+RULES_TABLE = "RemindersRules"
+
+EVENTS_WATERMARK = "events_watermark"
+
+# sparse GSI on RemindersEvents: only pending events carry `pending_bucket` (= ts_bucket).
+# mark_event_as_scheduled removes it, so the poller never reads events that were already sent.
+# partition key: pending_bucket, sort key: from_date. See migrations.add_pending_index.
+PENDING_INDEX = "pending_bucket-from_date-index"
 
 BUCKET_WINDOW = 6  # in minutes. Should be >= event bridge rate.
+CONVERSATION_LIMIT = 20  # number of past messages loaded per request.
+# messages that don't count towards the free tier.
+NON_CHAT_MESSAGE_TYPES = ["error", "request", "command"]
+BATCH_WRITE_LIMIT = 25  # max number of items per BatchWriteItem call.
+BATCH_WRITE_RETRIES = 5
+BATCH_GET_LIMIT = 100  # max number of keys per BatchGetItem call.
+BATCH_GET_RETRIES = 5
+BATCH_GET_WORKERS = 4  # chunks of keys fetched concurrently.
 
+# the client is shared across warm invocations (see connections.py).
 def get_client():
-    return boto3.client("dynamodb")
+    return connections.get_client("dynamodb")
 
 # ----- USERS -----
 def create_user(client, user):
@@ -29,10 +57,10 @@ def create_user(client, user):
                 "wa_id": {"S": user["wa_id"]},
                 "user_name": {"S": user["user_name"]},
                 "user_timezone": {"S": user["user_timezone"]},
-                "conversation": {"L": []},
                 "events": {"L": []},
-                "events_v2": {"L": []},
+                "events_by_id": {"M": {}},
                 "consent": {"BOOL": False}, # was consent collected?
+                "stats": {"M": {}},
             },
             ConditionExpression="attribute_not_exists(wa_id)"
         )
@@ -42,26 +70,38 @@ def create_user(client, user):
             return e
     return ""
 
+# user profiles: the attributes read by get_user. The other fields of the user get their default value.
+# USER_FULL: everything a message needs. The conversation is loaded from its own table (see get_conversation).
+USER_FULL = [
+    "wa_id",
+    "user_name",
+    "user_timezone",
+    "subscription",
+    "events",
+    "events_v2",
+    "events_by_id",
+    "consent",
+    "locked",
+    "locked_ts",
+    "message_ids",
+    "stats",
+    "verbose", # for me only
+]
+# USER_SETUP: is the user set up? e.g. to answer the consent button.
+USER_SETUP = ["wa_id", "user_name", "user_timezone", "verbose"]
+# USER_SETTINGS: e.g. the timezone, to format the date of a reminder. See get_user_settings.
+USER_SETTINGS = ["wa_id", "user_name", "user_timezone", "consent"]
+
 # returns user dict, error string
-def get_user(client, wa_id: str):
+# only the attributes of `profile` are read, and decoded.
+def get_user(client, wa_id: str, profile=USER_FULL):
+    projection_expr, names = projection(profile)
     try:
         response = client.get_item(
             TableName=USERS_TABLE, 
             Key={"wa_id": {"S": wa_id}},
-            AttributesToGet=[
-                "wa_id", 
-                "user_name", 
-                "user_timezone", 
-                "conversation", 
-                "events",
-                "events_v2", 
-                "consent",
-                "locked",
-                "locked_ts",
-                "message_ids",
-                "stats",
-                "verbose", # for me only
-            ], 
+            ProjectionExpression=projection_expr,
+            ExpressionAttributeNames=names,
         )
 
         if response["ResponseMetadata"]["HTTPStatusCode"] != 200:
@@ -70,123 +110,37 @@ def get_user(client, wa_id: str):
         if "Item" not in response:
             return {}, ""
         
-        item = response["Item"]
-
-        conversation = []
-        for msg in item.get("conversation", {}).get("L", []):
-            m = msg.get("M", {})
-            try:
-                timestamp = int(m.get("timestamp", {}).get("N", "0"))
-            except:
-                print(f"Error parsing timestamp: {m.get('timestamp', {}).get('N', '0')}")
-                timestamp = 0
-            conversation.append({
-                "text": m.get("text", {}).get("S", ""),
-                "timestamp": timestamp,
-                "role": m.get("role", {}).get("S", ""),
-                "setup": m.get("setup", {}).get("S", ""),
-                "type": m.get("type", {}).get("S", ""),
-                "version": m.get("version", {}).get("S", ""),
-                "id": m.get("id", {}).get("S", ""),
-            })
-
-        events_v1 = []
-        for e in item.get("events", {}).get("L", []):
-            m = e.get("M", {})
-            events_v1.append(
-                {
-                    "ts_bucket": m.get("ts_bucket", {}).get("N", "-1"),
-                    "event_id": m.get("event_id", {}).get("S", ""),
-                },
-            )
-
-        events_v2 = []
-        for e in item.get("events_v2", {}).get("L", []):
-            m = e.get("M", {})
-            try:
-                from_date = int(m.get("from_date", {}).get("N", "-1"))
-            except:
-                from_date = -1
-            try:
-                to_date = int(m.get("to_date", {}).get("N", "-1"))
-            except:
-                to_date = -1
-            events_v2.append(
-                {
-                    "ts_bucket": m.get("ts_bucket", {}).get("N", ""),  # legacy
-                    "event_id": m.get("event_id", {}).get("S", ""),
-                    "event_name": m.get("event_name", {}).get("S", ""),
-                    "from_date": from_date,
-                    "from_date_str": m.get("from_date_str", {}).get("S", ""),
-                    "to_date": to_date,
-                    "to_date_str": m.get("to_date_str", {}).get("S", ""),
-                    "frequency": m.get("frequency", {}).get("S", ""),
-                    "children": [
-                        {
-                            "ts_bucket": c.get("M", {}).get("ts_bucket", {}).get("N", ""),
-                            "event_id": c.get("M", {}).get("event_id", {}).get("S", ""),
-                        } for c in m.get("children", {}).get("L", [])
-                    ],
-                    "version": "2",
-                }
-            ) 
-        subscription_map = item.get("subscription", {}).get("M", {})
-        subscription = {
-            "subID": subscription_map.get("subID", {}).get("S", ""),
-            "subStatus": subscription_map.get("subStatus", {}).get("S", ""),
-        }
-        
-        stats = item.get("stats", {}).get("M", {})
-        try:
-            messages_sent = int(stats.get("messages_sent", {}).get("N", "0"))
-        except:
-            print("Error parsing messages_sent: ", stats.get("messages_sent", {}).get("N", "0"))
-            messages_sent = 0
-        try:
-            reminders_created = int(stats.get("reminders_created", {}).get("N", "0"))
-        except:
-            print("Error parsing reminders_created: ", stats.get("reminders_created", {}).get("N", "0"))
-            reminders_created = 0
-        try:
-            creation_ts = int(stats.get("creation_ts", {}).get("N", "0"))
-        except:
-            print("Error parsing creation_ts: ", stats.get("creation_ts", {}).get("N", "0"))
-            creation_ts = 0
-        try:
-            last_active_ts = int(stats.get("last_active_ts", {}).get("N", "0"))
-        except:
-            print("Error parsing last_active_ts: ", stats.get("last_active_ts", {}).get("N", "0"))
-            last_active_ts = 0
-
-        stats = {
-            "messages_sent": messages_sent,
-            "active_days": stats.get("active_days", {}).get("SS", []),
-            "reminders_created": reminders_created,
-            "creation_ts": creation_ts,
-            "last_active_ts": last_active_ts,
-        }
-
-        # last 3 message ids. Used to make sure we don't process the same message twice.
-        message_ids = [m.get("S", "") for m in item.get("message_ids", {"L": []})["L"]]
-        message_ids = [m for m in message_ids if m != ""]
-        return {
-            "wa_id": item["wa_id"]["S"],
-            "user_name": item.get("user_name", {}).get("S", ""),
-            "user_timezone": item.get("user_timezone", {}).get("S", "UTC"),
-            "subscription": subscription,
-            "conversation": conversation,
-            "events_v1": events_v1,
-            "events_v2": events_v2,
-            "consent": item.get("consent", {"BOOL": False})["BOOL"],
-            "locked": item.get("locked", {"BOOL": False})["BOOL"],
-            "locked_ts": item.get("locked_ts", {"N": "0"})["N"],
-            "message_ids": message_ids,
-            "stats": stats,
-            "verbose": item.get("verbose", {"BOOL": False})["BOOL"],
-        }, None
+        return codec.User.decoder(profile)(response["Item"]), None
     except Exception as e:
         return {}, e
     
+# SETTINGS CACHE
+# the settings of a user (USER_SETTINGS) are cached in process, shared by the warm invocations of a
+# lambda container: check_reminders reads the timezone of a user once, however many of their reminders fire.
+# the update functions of this file invalidate the entry, other containers see the change after the TTL.
+SETTINGS_CACHE_SIZE = 1024
+SETTINGS_CACHE_TTL = 5 * 60  # in seconds.
+settings_cache = cache.LRUCache(maxsize=SETTINGS_CACHE_SIZE, ttl=SETTINGS_CACHE_TTL)
+# concurrent reads of the same user wait for the first one instead of reading it again.
+_settings_locks = [threading.Lock() for _ in range(32)]
+
+# returns the settings of the user (dict with the fields of USER_SETTINGS), error.
+# returns {} if the user doesn't exist. Missing users and errors are not cached.
+def get_user_settings(client, wa_id):
+    settings, found = settings_cache.get(wa_id)
+    if found:
+        return settings, None
+    with _settings_locks[hash(wa_id) % len(_settings_locks)]:
+        settings, found = settings_cache.get(wa_id)
+        if found:
+            return settings, None
+        user, err = get_user(client, wa_id, profile=USER_SETTINGS)
+        if err or not user:
+            return {}, err
+        settings = {k: user[k] for k in USER_SETTINGS}
+        settings_cache.set(wa_id, settings)
+        return settings, None
+
 def set_verbosity(client, wa_id, verbose=False):
     if wa_id != os.environ["TIM_PHONE_NUMBER"]:
         return
@@ -214,54 +168,129 @@ def set_verbosity(client, wa_id, verbose=False):
         return json.dumps(e)
     
 
-def set_user_stats(client, wa_id, stats, conversation=[], message_inc=0, reminder_inc=0):
-    # stats is a dictionary containing:
-    # - messages sent
-    # - unique active days (string set)
-    # - reminders created
-    # - creation date (timestamp of first message)
-    # - last active date (timestamp of last message)
-    messages_sent = stats.get("messages_sent", 0) + message_inc
-    date = utils.utc_now().strftime("%Y-%m-%d")
-    active_days = stats.get("active_days", [])
-    if date not in active_days:
-        active_days.append(date)
-    reminders_created = stats.get("reminders_created", 0) + reminder_inc
-
-    creation_ts = stats.get("creation_ts", 0)
-    if creation_ts == 0 and len(conversation) > 0:
-        # get min timestamp from conversation
-        creation_ts = min([int(m["timestamp"]) for m in conversation if m["role"] == "user"])
-
-    # last_active_ts = stats.get("last_active_ts", 0)
-    # if len(conversation) > 0:
-    #     # get max timestamp from conversation
-    #     last_active_ts = max([int(m["timestamp"]) for m in conversation if m["role"] == "user"])
-    last_active_ts = utils.utc_now_ts()
+# stats is a map on the user item containing:
+# - messages_sent: messages sent by the user
+# - active_days: unique active days (string set)
+# - reminders_created: reminders created
+# - creation_ts: timestamp of the user's first message
+# - last_active_ts: timestamp of the last message
+# - chat_messages: messages counted against the free tier (see update_user_conversation)
+# counters are updated in place with ADD, so no stats path needs the conversation or the previous values.
+def set_user_stats(client, wa_id, message_inc=0, reminder_inc=0):
+    return update_user_stats(
+        client,
+        wa_id,
+        "ADD stats.messages_sent :m, stats.reminders_created :r, stats.active_days :d SET stats.last_active_ts = :now",
+        {
+            ":m": {"N": str(message_inc)},
+            ":r": {"N": str(reminder_inc)},
+            ":d": {"SS": [utils.utc_now().strftime("%Y-%m-%d")]},
+            ":now": {"N": str(utils.utc_now_ts())},
+        },
+    )
 
-    try:
-        resp = client.update_item(
-            TableName=USERS_TABLE,
-            Key={"wa_id": {"S": wa_id}},
-            UpdateExpression="SET stats = :s",
-            ExpressionAttributeValues={
-                ":s": {"M": {
-                    "messages_sent": {"N": str(messages_sent)},
-                    "active_days": {"SS": active_days},
-                    "reminders_created": {"N": str(reminders_created)},
-                    "creation_ts": {"N": str(creation_ts)},
-                    "last_active_ts": {"N": str(last_active_ts)},
-                }}
-            },
-            ReturnValues="NONE"
-        )
-        if resp["ResponseMetadata"]["HTTPStatusCode"] != 200:
-            return json.dumps(resp["Error"])
-    except Exception as e:
-        return e
-    return None
+def update_user_stats(client, wa_id, update_expression, values):
+    _, err = update_user_item(client, {
+        "Key": {"wa_id": {"S": wa_id}},
+        "UpdateExpression": update_expression,
+        "ExpressionAttributeValues": values,
+        "ReturnValues": "NONE",
+    })
+    return err
+
+# runs update_item on the users table and returns response, error.
+# updates on nested attributes of `parent` (a map) fail if the map does not exist yet: create it and try again.
+def update_user_item(client, params, parent="stats"):
+    for attempt in range(2):
+        try:
+            resp = client.update_item(TableName=USERS_TABLE, **params)
+            if resp["ResponseMetadata"]["HTTPStatusCode"] != 200:
+                return resp, json.dumps(resp["Error"])
+            return resp, None
+        except ClientError as e:
+            if attempt > 0 or e.response["Error"]["Code"] != "ValidationException":
+                return {}, e
+        except Exception as e:
+            return {}, e
+        try:
+            client.update_item(
+                TableName=USERS_TABLE,
+                Key=params["Key"],
+                UpdateExpression=f"SET {parent} = if_not_exists({parent}, :empty)",
+                ExpressionAttributeValues={":empty": {"M": {}}},
+                ReturnValues="NONE"
+            )
+        except Exception as e:
+            return {}, e
+
+# ----- USER LOCK -----
+# the user lock is a lease: it expires on its own after LEASE_TTL seconds if the holder dies.
+# every acquisition increments lock_token, a fencing token: only the holder of the current token
+# can release the lock. See reminders/lock.py.
+LEASE_TTL = 5 * 60  # in seconds.
+LOCK_FIELDS = ["locked", "lock_expires_ts", "lock_token"]
+# values: :now, :f
+LEASE_FREE_CONDITION = "(attribute_not_exists(lock_expires_ts) OR lock_expires_ts < :now OR locked = :f)"
+
+def lease_values(now_ts, ttl=LEASE_TTL):
+    return {
+        ":l": {"BOOL": True},
+        ":f": {"BOOL": False},
+        ":now": {"N": str(now_ts)},
+        ":exp": {"N": str(now_ts + ttl)},
+        ":one": {"N": "1"},
+    }
+
+# begin_request does all the bookkeeping for an incoming message in a single update:
+# - acquires the user lease (see lock.acquire)
+# - records the message id (see update_message_ids), unless it was already processed
+# - if count_activity, increments message count and last active date (see set_user_stats)
+# the user is added to the DAUs on their first counted message of the day (see add_user_to_dau),
+# which is the only case where a second call is made.
+# returns status ("ok", "duplicate" or "locked"), lock token, error
+def begin_request(client, wa_id, msg_id, prev_ids, is_user_setup, count_activity=True):
+    now_ts = utils.utc_now_ts()
+    today = utils.utc_now().strftime("%Y%m%d")
+    set_parts = ["locked = :l", "locked_ts = :now", "lock_expires_ts = :exp", "message_ids = :ids"]
+    add_parts = ["lock_token :one"]
+    values = lease_values(now_ts)
+    # last 3 message ids.
+    values[":ids"] = {"L": [{"S": id_} for id_ in [msg_id] + prev_ids[:2]]}
+    values[":mid"] = {"S": msg_id}
+    if count_activity:
+        set_parts += ["stats.last_active_ts = :now", "last_dau_date = :today"]
+        add_parts += ["stats.messages_sent :one", "stats.active_days :d"]
+        values.update({
+            ":today": {"S": today},
+            ":d": {"SS": [utils.utc_now().strftime("%Y-%m-%d")]},
+        })
+    resp, err = update_user_item(client, {
+        "Key": {"wa_id": {"S": wa_id}},
+        "UpdateExpression": f"SET {', '.join(set_parts)} ADD {', '.join(add_parts)}",
+        # the same message can be delivered concurrently by whatsapp.
+        "ConditionExpression": f"{LEASE_FREE_CONDITION} AND (attribute_not_exists(message_ids) OR NOT contains(message_ids, :mid))",
+        "ExpressionAttributeValues": values,
+        "ReturnValues": "UPDATED_OLD",
+        "ReturnValuesOnConditionCheckFailure": "ALL_OLD",
+    })
+    if isinstance(err, ClientError) and err.response["Error"]["Code"] == "ConditionalCheckFailedException":
+        old_ids = [m.get("S", "") for m in err.response.get("Item", {}).get("message_ids", {}).get("L", [])]
+        if msg_id in old_ids:
+            return "duplicate", -1, None
+        return "locked", -1, None
+    if err:
+        return "", -1, err
+
+    # UPDATED_OLD returns the previous token.
+    token = int(resp.get("Attributes", {}).get("lock_token", {}).get("N", "0")) + 1
+    if count_activity and resp.get("Attributes", {}).get("last_dau_date", {}).get("S", "") != today:
+        err = add_user_to_dau(client, wa_id=wa_id, is_user_setup=is_user_setup, date=today)
+        if err:
+            return "ok", token, err
+    return "ok", token, None
 
 def update_user_consent(client, wa_id, consent):
+    settings_cache.delete(wa_id)
     try:
         resp = client.update_item(
             TableName=USERS_TABLE,
@@ -279,6 +308,7 @@ def update_user_consent(client, wa_id, consent):
     return None
 
 def update_user_name(client, wa_id, name):
+    settings_cache.delete(wa_id)
     try:
         resp = client.update_item(
             TableName=USERS_TABLE,
@@ -294,6 +324,7 @@ def update_user_name(client, wa_id, name):
     return None
 
 def update_user_timezone(client, wa_id, timezone):
+    settings_cache.delete(wa_id)
     try:
         resp = client.update_item(
             TableName=USERS_TABLE,
@@ -325,75 +356,6 @@ def update_message_ids(client, wa_id, prev_ids, msg_id):
     except Exception as e:
         return e
 
-# implement "lock" to prevent multiple concurrent updates
-# while we process a user's message.
-def mark_user_as_locked(client, wa_id):
-    try:
-        resp = client.update_item(
-            TableName=USERS_TABLE,
-            Key={"wa_id": {"S": wa_id}},
-            UpdateExpression="SET locked = :l, locked_ts = :ts",
-            # add condition that locked should be false
-            ConditionExpression=" attribute_not_exists(locked) OR locked = :f OR attribute_not_exists(locked_ts) OR locked_ts < :tslimit",
-            ExpressionAttributeValues={
-                ":l": {"BOOL": True},
-                ":f": {"BOOL": False},
-                ":ts": {"N": str(utils.utc_now_ts())},
-                ":tslimit": {"N": str(utils.utc_now_ts() - 15*60)},  # 15 minutes limit
-            },
-            ReturnValues="NONE",
-        )
-        if resp["ResponseMetadata"]["HTTPStatusCode"] != 200:
-            return json.dumps(resp["Error"])
-    except Exception as e:
-        return e
-
-# unlock user once we are done processing the message
-def mark_user_as_unlocked(client, wa_id):
-    try:
-        resp = client.update_item(
-            TableName=USERS_TABLE,
-            Key={"wa_id": {"S": wa_id}},
-            UpdateExpression="SET locked = :l",
-            ExpressionAttributeValues={":l": {"BOOL": False}},
-            ReturnValues="NONE",
-        )
-        if resp["ResponseMetadata"]["HTTPStatusCode"] != 200:
-            return json.dumps(resp["Error"])
-    except Exception as e:
-        return e
-
-def update_user_conversation(client, wa_id: str, messages: list):
-    # messages is a list of dict with keys text, timestamp and role (user or assistant)
-    try:
-        resp = client.update_item(
-            TableName=USERS_TABLE,
-            Key={'wa_id': {"S": wa_id}},
-            UpdateExpression="SET conversation = list_append(conversation, :m)",
-            ExpressionAttributeValues={
-                ':m': {"L":
-                [
-                    {"M": {
-                        "text": {"S": msg["text"]},
-                        "timestamp": {"N": str(msg["timestamp"])},
-                        "role": {"S": msg["role"]},
-                        "setup": {"S": msg.get("setup", "false")},
-                        "type": {"S": msg.get("type", "")},
-                        "version": {"S": msg.get("version", "")},
-                        "id": {"S": msg.get("id", "")},
-                    }}
-                    for msg in messages
-                ]
-                },
-            },
-            ReturnValues="NONE"
-        )
-        if resp["ResponseMetadata"]["HTTPStatusCode"] != 200:
-            return json.dumps(resp["Error"])
-    except Exception as e:
-        return e
-    return None
-
 def update_user_events(client, wa_id: str, events: list):
     # events: list of dict with keys ts_bucket and event_id
     try:
@@ -421,44 +383,56 @@ def update_user_events(client, wa_id: str, events: list):
         return e
     return None
 
-def update_user_events_v2(client, wa_id: str, events: list):
-    # events: list of dict with keys ts_bucket and event_id
-    try:
-        resp = client.update_item(
-            TableName=USERS_TABLE,
-            Key={"wa_id": {"S": wa_id}},
-            UpdateExpression="SET events_v2 = list_append(if_not_exists(events_v2, :empty_list), :e)",
-            ExpressionAttributeValues={
-                ":e": {
-                    "L": [{
-                            "M": {
-                                "ts_bucket": {"N": str(e["ts_bucket"])},  # legacy
-                                "event_id": {"S": e["event_id"]},
-                                "event_name": {"S": e["event_name"]},
-                                "from_date": {"N": str(e["from_date"])},
-                                "from_date_str": {"S": e["from_date_str"]},
-                                "to_date": {"N": str(e["to_date"])},
-                                "to_date_str": {"S": e["to_date_str"]},
-                                "frequency": {"S": e["frequency"]},
-                                "children": {"L": [
-                                    {"M": {
-                                        "ts_bucket": {"N": c["ts_bucket"]},
-                                        "event_id": {"S": c["event_id"]},
-                                    }} for c in e["children"]
-                                ]}
-                        } for e in events
-                    }],
-                },
-                ":empty_list": {"L": []},
-            },
-            ReturnValues="NONE",
-        )
-        if resp["ResponseMetadata"]["HTTPStatusCode"] != 200:
-            return json.dumps(resp["Error"])
-    except Exception as e:
-        return e
-    return None
+# the reminders of a user are stored in the `events_by_id` map of the user item, keyed by event_id:
+# adding or removing one writes that entry only, whatever the number of reminders of the user.
+# users that were not migrated yet (see migrations.index_user_events) also have a legacy `events_v2` list.
+
+# returns the reminders of the user (legacy list and map), sorted by date.
+def user_events_v2(user):
+    events = {e["event_id"]: e for e in user.get("events_v2", [])}
+    events.update(user.get("events_by_id", {}))
+    return sorted(events.values(), key=lambda e: (int(e["from_date"]), e["event_id"]))
 
+# returns the entry of a reminder in the user's events (see put_user_event).
+def user_event(event_id, ts_bucket, event_name, from_date, from_date_str, to_date, to_date_str, frequency):
+    return {
+        "event_id": event_id,
+        "event_name": event_name,
+        "from_date": from_date,
+        "from_date_str": from_date_str,
+        "to_date": to_date,
+        "to_date_str": to_date_str,
+        "frequency": frequency,
+        "children": [],
+        "ts_bucket": ts_bucket,  # legacy
+    }
+
+# adds `event` to the reminders of the user. If remove_id is set, the reminder remove_id is removed
+# in the same update (e.g. an updated reminder gets a new event_id). Returns error.
+def put_user_event(client, wa_id, event, remove_id=""):
+    update_expression = "SET events_by_id.#id = :e"
+    names = {"#id": event["event_id"]}
+    if remove_id and remove_id != event["event_id"]:
+        update_expression += " REMOVE events_by_id.#rid"
+        names["#rid"] = remove_id
+    params = {
+        "Key": {"wa_id": {"S": wa_id}},
+        "UpdateExpression": update_expression,
+        "ExpressionAttributeNames": names,
+        "ExpressionAttributeValues": {":e": {"M": codec.Event.encode(event)}},
+    }
+    # users created before events_by_id don't have the map yet: update_user_item creates it.
+    _, err = update_user_item(client, params, parent="events_by_id")
+    return err
+
+# removes the reminder event_id from the reminders of the user. Returns error.
+def remove_user_event(client, wa_id, event_id):
+    _, err = update_user_item(client, {
+        "Key": {"wa_id": {"S": wa_id}},
+        "UpdateExpression": "REMOVE events_by_id.#id",
+        "ExpressionAttributeNames": {"#id": event_id},
+    }, parent="events_by_id")
+    return err
 
 # replaces user events every time.
 def set_user_events(client, wa_id: str, events: list):
@@ -495,28 +469,7 @@ def set_user_events_v2(client, wa_id: str, events: list):
             Key={"wa_id": {"S": wa_id}},
             UpdateExpression="SET events_v2 = :e",
             ExpressionAttributeValues={
-                ":e": {
-                    "L": [{
-                            "M": {
-                                "ts_bucket": {"N": str(e.get("ts_bucket", "0"))},  # legacy soon
-                                "event_id": {"S": e["event_id"]},
-                                "event_name": {"S": e["event_name"]},
-                                "from_date": {"N": str(e["from_date"])},
-                                "from_date_str": {"S": e["from_date_str"]},
-                                "to_date": {"N": str(e["to_date"])},
-                                "to_date_str": {"S": e["to_date_str"]},
-                                "frequency": {"S": e["frequency"]},
-                                "version": {"S": "2"},
-                                "reschedule": {"BOOL": e.get("reschedule", True)},
-                                "children": {"L": [
-                                    {"M": {
-                                        "ts_bucket": {"N": c["ts_bucket"]},
-                                        "event_id": {"S": c["event_id"]},
-                                    }} for c in e["children"]
-                                ]}
-                        } for e in events
-                    }] if events else [],
-                }
+                ":e": {"L": [{"M": e} for e in codec.Event.encode_list(events)]},
             },
             ReturnValues="NONE",
         )
@@ -526,6 +479,143 @@ def set_user_events_v2(client, wa_id: str, events: list):
         return e
     return None
 
+# ----- MESSAGES -----
+# msg_key sorts messages by timestamp, then by write order for messages sent in the same second.
+def message_key(timestamp, seq):
+    return f"{int(timestamp):010d}#{seq}"
+
+def update_user_conversation(client, wa_id: str, messages: list):
+    # messages is a list of dict with keys text, timestamp and role (user or assistant)
+    now_ns = time.time_ns()
+    requests = [
+        {"PutRequest": {"Item": {
+            "wa_id": {"S": wa_id},
+            "msg_key": {"S": message_key(msg["timestamp"], f"{now_ns}#{i:03d}")},
+            "text": {"S": msg["text"]},
+            "timestamp": {"N": str(msg["timestamp"])},
+            "role": {"S": msg["role"]},
+            "setup": {"S": msg.get("setup", "false")},
+            "type": {"S": msg.get("type", "")},
+            "version": {"S": msg.get("version", "")},
+            "id": {"S": msg.get("id", "")},
+        }}}
+        for i, msg in enumerate(messages)
+    ]
+    err = batch_write(client, MESSAGES_TABLE, requests)
+    if err:
+        return err
+
+    # keep the free tier counter and the creation date up to date.
+    chat_messages = sum(1 for msg in messages if msg.get("type", "") not in NON_CHAT_MESSAGE_TYPES)
+    user_timestamps = [int(msg["timestamp"]) for msg in messages if msg["role"] == "user"]
+    if not chat_messages and not user_timestamps:
+        return None
+    update_expression = "ADD stats.chat_messages :c"
+    values = {":c": {"N": str(chat_messages)}}
+    if user_timestamps:
+        update_expression += " SET stats.creation_ts = if_not_exists(stats.creation_ts, :ts)"
+        values[":ts"] = {"N": str(min(user_timestamps))}
+    return update_user_stats(client, wa_id, update_expression, values)
+
+# returns the last `limit` messages in chronological order, error.
+# reads only the newest items of the user's partition, however long the history is.
+def get_conversation(client, wa_id: str, limit=CONVERSATION_LIMIT):
+    try:
+        response = client.query(
+            TableName=MESSAGES_TABLE,
+            KeyConditionExpression="wa_id = :w",
+            ExpressionAttributeValues={":w": {"S": wa_id}},
+            ScanIndexForward=False,
+            Limit=limit,
+        )
+        if response["ResponseMetadata"]["HTTPStatusCode"] != 200:
+            return [], json.dumps(response["Error"])
+        conversation = codec.Message.decode_list(response["Items"][::-1])
+        return conversation, None
+    except Exception as e:
+        return [], e
+
+# counts the user's messages whose type is not in exclude_types, error.
+def count_messages(client, wa_id: str, exclude_types=()):
+    params = {
+        "TableName": MESSAGES_TABLE,
+        "KeyConditionExpression": "wa_id = :w",
+        "ExpressionAttributeValues": {":w": {"S": wa_id}},
+        "Select": "COUNT",
+    }
+    if exclude_types:
+        params["FilterExpression"] = "NOT (#t IN (" + ", ".join(f":t{i}" for i in range(len(exclude_types))) + "))"
+        params["ExpressionAttributeNames"] = {"#t": "type"}
+        params["ExpressionAttributeValues"].update({f":t{i}": {"S": t} for i, t in enumerate(exclude_types)})
+    try:
+        count = 0
+        while True:
+            response = client.query(**params)
+            if response["ResponseMetadata"]["HTTPStatusCode"] != 200:
+                return 0, json.dumps(response["Error"])
+            count += response["Count"]
+            if "LastEvaluatedKey" not in response:
+                return count, None
+            params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+    except Exception as e:
+        return 0, e
+
+# writes `requests` in chunks of BATCH_WRITE_LIMIT, retrying UnprocessedItems with exponential backoff.
+def batch_write(client, table, requests):
+    try:
+        for i in range(0, len(requests), BATCH_WRITE_LIMIT):
+            pending = {table: requests[i:i + BATCH_WRITE_LIMIT]}
+            for attempt in range(BATCH_WRITE_RETRIES + 1):
+                resp = client.batch_write_item(RequestItems=pending)
+                if resp["ResponseMetadata"]["HTTPStatusCode"] != 200:
+                    return json.dumps(resp["Error"])
+                pending = resp.get("UnprocessedItems", {})
+                if not pending:
+                    break
+                if attempt == BATCH_WRITE_RETRIES:
+                    return f"batch_write: {len(pending[table])} unprocessed items in {table}"
+                time.sleep(0.05 * 2 ** attempt)
+    except Exception as e:
+        return e
+    return None
+
+# reads the items of `keys` in chunks of BATCH_GET_LIMIT, fetched concurrently,
+# retrying UnprocessedKeys with exponential backoff.
+# returns items (in no particular order), error. On error, the items that could be read are returned.
+def batch_get(client, table, keys):
+    chunks = [keys[i:i + BATCH_GET_LIMIT] for i in range(0, len(keys), BATCH_GET_LIMIT)]
+    if len(chunks) <= 1:
+        return _batch_get_chunk(client, table, keys)
+    with ThreadPoolExecutor(max_workers=min(BATCH_GET_WORKERS, len(chunks))) as pool:
+        results = list(pool.map(lambda chunk: _batch_get_chunk(client, table, chunk), chunks))
+    items, errors = [], []
+    for chunk_items, err in results:
+        items += chunk_items
+        if err:
+            errors.append(err)
+    return items, errors[0] if errors else None
+
+def _batch_get_chunk(client, table, keys):
+    items = []
+    if not keys:
+        return items, None
+    try:
+        pending = {table: {"Keys": keys}}
+        for attempt in range(BATCH_GET_RETRIES + 1):
+            resp = client.batch_get_item(RequestItems=pending)
+            if resp["ResponseMetadata"]["HTTPStatusCode"] != 200:
+                return items, json.dumps(resp["Error"])
+            items += resp.get("Responses", {}).get(table, [])
+            pending = resp.get("UnprocessedKeys", {})
+            if not pending:
+                break
+            if attempt == BATCH_GET_RETRIES:
+                return items, f"batch_get: {len(pending[table]['Keys'])} unprocessed keys in {table}"
+            time.sleep(0.05 * 2 ** attempt)
+    except Exception as e:
+        return items, e
+    return items, None
+
 # ----- EVENTS -----
 def get_ts_bucket(event_timestamp: int):
     # event_timestamp is in seconds.
@@ -560,8 +650,10 @@ def create_event(client, event):
                 "event_name": {"S": event_name},
                 "event_timestamp": {"N": str(event_timestamp)},
                 "event_timestamp_str": {"S": event_timestamp_str},
+                "from_date": {"N": str(event_timestamp)},
                 "frequency": {"S": frequency},
                 "scheduled": {"BOOL": False},
+                "pending_bucket": {"N": str(ts_bucket)},
             }
         )
         if response["ResponseMetadata"]["HTTPStatusCode"] != 200:
@@ -572,6 +664,47 @@ def create_event(client, event):
         return e
     return None
 
+def event_v2_item(
+        wa_id,
+        event_id,
+        ts_bucket,
+        event_name,
+        from_date,
+        from_date_str,
+        to_date,
+        to_date_str,
+        frequency,
+        reschedule=True,
+        rule_id="",
+        expires_ts=0,
+        user_timezone="",
+    ):
+    item = {
+        "ts_bucket": {"N": str(ts_bucket)},
+        "event_id": {"S": event_id},
+        "wa_id": {"S": wa_id},
+        "event_name": {"S": event_name},
+        "event_timestamp": {"N": str(from_date)}, # legacy
+        "event_timestamp_str": {"S": from_date_str}, # legacy
+        "from_date": {"N": str(from_date)},
+        "from_date_str": {"S": from_date_str},
+        "to_date": {"N": str(to_date)},
+        "to_date_str": {"S": to_date_str},
+        "frequency": {"S": frequency},
+        "scheduled": {"BOOL": False},
+        "pending_bucket": {"N": str(ts_bucket)},
+        "version": {"S": "2"},
+        "reschedule": {"BOOL": reschedule},  # if reschedule=False, it will not be rescheduled at fire time. (reschedule=False for child events)
+    }
+    if rule_id:
+        item["rule_id"] = {"S": rule_id}  # occurrence of a recurring reminder.
+    if expires_ts:
+        item["expires_ts"] = {"N": str(expires_ts)}  # dynamodb TTL.
+    if user_timezone:
+        # timezone of the user when the event was written: rescheduling doesn't need to read the user.
+        item["user_timezone"] = {"S": user_timezone}
+    return item
+
 def create_event_v2(
         client,
         wa_id,
@@ -584,26 +717,24 @@ def create_event_v2(
         to_date_str,
         frequency,
         reschedule=True,
+        user_timezone="",
     ):
     try:
         response = client.put_item(
             TableName=EVENTS_TABLE,
-            Item={
-                "ts_bucket": {"N": str(ts_bucket)},
-                "event_id": {"S": event_id},
-                "wa_id": {"S": wa_id},
-                "event_name": {"S": event_name},
-                "event_timestamp": {"N": str(from_date)}, # legacy
-                "event_timestamp_str": {"S": from_date_str}, # legacy
-                "from_date": {"N": str(from_date)},
-                "from_date_str": {"S": from_date_str},
-                "to_date": {"N": str(to_date)},
-                "to_date_str": {"S": to_date_str},
-                "frequency": {"S": frequency},
-                "scheduled": {"BOOL": False},
-                "version": {"S": "2"},
-                "reschedule": {"BOOL": reschedule},  # if reschedule=False, it will not be rescheduled at fire time. (reschedule=False for child events)
-            }
+            Item=event_v2_item(
+                wa_id=wa_id,
+                event_id=event_id,
+                ts_bucket=ts_bucket,
+                event_name=event_name,
+                from_date=from_date,
+                from_date_str=from_date_str,
+                to_date=to_date,
+                to_date_str=to_date_str,
+                frequency=frequency,
+                reschedule=reschedule,
+                user_timezone=user_timezone,
+            )
         )
         if response["ResponseMetadata"]["HTTPStatusCode"] != 200:
             return json.dumps(response["Error"])
@@ -613,6 +744,18 @@ def create_event_v2(
         return e
     return None
 
+# creates the events of a user with BatchWriteItem (see batch_write) instead of one put_item each,
+# and increments the reminder count once for all of them.
+# events: list of dicts with the keyword arguments of create_event_v2 except client and wa_id.
+def create_events_v2_batch(client, wa_id, events):
+    if not events:
+        return None
+    requests = [{"PutRequest": {"Item": event_v2_item(wa_id=wa_id, **e)}} for e in events]
+    err = batch_write(client, EVENTS_TABLE, requests)
+    if err:
+        return err
+    return increment_reminder(client, wa_id=wa_id, increment=len(events))
+
 def delete_event(client, wa_id, ts_bucket, event_id):
     try:
         resp = client.delete_item(
@@ -627,96 +770,230 @@ def delete_event(client, wa_id, ts_bucket, event_id):
         return e
     return None
 
+# deletes events with BatchWriteItem. keys: list of dicts with keys ts_bucket and event_id.
+def delete_events(client, keys):
+    requests = [
+        {"DeleteRequest": {"Key": {"ts_bucket": {"N": str(k["ts_bucket"])}, "event_id": {"S": k["event_id"]}}}}
+        for k in keys
+    ]
+    return batch_write(client, EVENTS_TABLE, requests)
+
+# returns the events sorted by date, error. On error, the events that could be read are returned.
 def get_events(client, events):
-    def parse_children(item):
-        children = []
-        for child in item.get("children", []):
-            children.append(
-                {
-                    "ts_bucket": child.get("ts_bucket", {}).get("N", -1),
-                    "event_id": child.get("event_id", {}).get("S", ""),
-                }
-            )
-        return children
     if not events:
         return [], None
     # events = list of dictionaries containing `ts_bucket` and `event_id` keys.
+    # dict.fromkeys drops duplicate keys and keeps their order.
+    unique_keys = dict.fromkeys((str(e["ts_bucket"]), e["event_id"]) for e in events)
+    items, err = batch_get(client, EVENTS_TABLE, [{"ts_bucket": {"N": ts}, "event_id": {"S": eid}} for ts, eid in unique_keys])
     try:
-        unique_keys = []
-        for e in events:
-            new_key = (e["ts_bucket"], e["event_id"])
-            if new_key not in unique_keys:
-                unique_keys.append(new_key)
-        response = client.batch_get_item(
-            RequestItems={EVENTS_TABLE: {"Keys": [{"ts_bucket": {"N": ts}, "event_id": {"S": eid}} for ts, eid in unique_keys]}},
-        )
-        items = response["Responses"][EVENTS_TABLE]
-        results = [
-            {
-                "ts_bucket": item["ts_bucket"]["N"],
-                "event_id": item["event_id"]["S"],
-                "wa_id": item["wa_id"]["S"],
-                "event_name": item["event_name"]["S"],
-                "event_timestamp_str": item.get("event_timestamp_str", {}).get("S", ""),
-                "event_timestamp": item.get("event_timestamp", {}).get("N", ""),
-                "from_date": item.get("from_date", {}).get("N", ""),
-                "from_date_str": item.get("from_date_str", {}).get("S", ""),
-                "to_date": item.get("to_date", {}).get("N", ""),
-                "to_date_str": item.get("to_date_str", {}).get("S", ""),
-                "frequency": item["frequency"]["S"],
-                "scheduled": item["scheduled"]["BOOL"],
-                "version": item.get("version", {}).get("S", ""),
-                "reschedule": item.get("reschedule", {}).get("BOOL", True),
-            } for item in items
-        ]
+        results = codec.EventItem.decode_list(items)
         results = sorted(results, key=lambda e: (int(e["event_timestamp"]), e["event_id"]))  # adding e["event_id"] to make sure order is deterministic
-        return results, None
+        return results, err
     except Exception as e:
         return [], e
 
-def get_upcoming_events(client):
+# ----- RULES -----
+# a rule is a recurring reminder (see recurrence.py). `cursor` is the date of the last occurrence written
+# to the events table, `occurrences` the keys and dates of the occurrences that were written.
+def occurrences_value(occurrences):
+    return {"L": [{"M": o} for o in codec.Occurrence.encode_list(occurrences)]}
+
+def put_rule(client, rule):
+    try:
+        resp = client.put_item(
+            TableName=RULES_TABLE,
+            Item=codec.Rule.encode(rule),
+        )
+        if resp["ResponseMetadata"]["HTTPStatusCode"] != 200:
+            return json.dumps(resp["Error"])
+    except Exception as e:
+        return e
+    return None
+
+# returns the rule ({} if it doesn't exist), error.
+def get_rule(client, rule_id):
+    try:
+        resp = client.get_item(TableName=RULES_TABLE, Key={"rule_id": {"S": rule_id}}, ConsistentRead=True)
+        if resp["ResponseMetadata"]["HTTPStatusCode"] != 200:
+            return {}, json.dumps(resp["Error"])
+        if "Item" not in resp:
+            return {}, None
+        return codec.Rule.decode(resp["Item"]), None
+    except Exception as e:
+        return {}, e
+
+# moves the cursor of the rule from `prev_cursor` to `cursor`.
+# returns "conflict" if the cursor was moved in the meantime (the rule was already rolled forward, or deleted).
+def advance_rule(client, rule_id, prev_cursor, cursor, occurrences):
+    try:
+        resp = client.update_item(
+            TableName=RULES_TABLE,
+            Key={"rule_id": {"S": rule_id}},
+            UpdateExpression="SET #c = :c, occurrences = :o",
+            ConditionExpression="#c = :prev",
+            ExpressionAttributeNames={"#c": "cursor"},
+            ExpressionAttributeValues={
+                ":c": {"N": str(cursor)},
+                ":prev": {"N": str(prev_cursor)},
+                ":o": occurrences_value(occurrences),
+            },
+        )
+        if resp["ResponseMetadata"]["HTTPStatusCode"] != 200:
+            return json.dumps(resp["Error"])
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            return "conflict"
+        return e
+    except Exception as e:
+        return e
+    return None
+
+def delete_rule(client, rule_id):
+    try:
+        resp = client.delete_item(TableName=RULES_TABLE, Key={"rule_id": {"S": rule_id}})
+        if resp["ResponseMetadata"]["HTTPStatusCode"] != 200:
+            return json.dumps(resp["Error"])
+    except Exception as e:
+        return e
+    return None
+
+# fields the reminder sender, reschedule_reminder_v2 and recurrence.roll_forward need.
+UPCOMING_EVENT_FIELDS = [
+    "ts_bucket",
+    "event_id",
+    "wa_id",
+    "event_name",
+    "event_timestamp",  # legacy
+    "from_date",
+    "to_date",
+    "to_date_str",
+    "frequency",
+    "reschedule",
+    "rule_id",
+    "user_timezone",
+]
+
+# returns a ProjectionExpression and its ExpressionAttributeNames.
+# attribute names are always aliased so that reserved words are never an issue.
+def projection(fields):
+    names = {f"#p{i}": field for i, field in enumerate(fields)}
+    return ", ".join(names.keys()), names
+
+# iter_upcoming_events yields the pending events of every bucket in [from_ts_bucket, to_ts_bucket].
+# pages are fetched lazily, following LastEvaluatedKey. Raises on DynamoDB errors.
+def iter_upcoming_events(client, from_ts_bucket, to_ts_bucket):
+    projection_expr, names = projection(UPCOMING_EVENT_FIELDS)
+    decode_page = codec.EventItem.list_decoder(UPCOMING_EVENT_FIELDS)
+    for ts_bucket in range(from_ts_bucket, to_ts_bucket + 1, BUCKET_WINDOW * 60):
+        print(f"Checking ts_bucket={ts_bucket}")
+        params = {
+            "TableName": EVENTS_TABLE,
+            "IndexName": PENDING_INDEX,
+            "KeyConditionExpression": "pending_bucket = :ts",
+            "ProjectionExpression": projection_expr,
+            "ExpressionAttributeNames": names,
+            "ExpressionAttributeValues": {":ts": {"N": str(ts_bucket)}},
+        }
+        while True:
+            response = client.query(**params)
+            if response["ResponseMetadata"]["HTTPStatusCode"] != 200:
+                raise Exception(json.dumps(response["Error"]))
+            for event in decode_page(response["Items"]):
+                # legacy events only have event_timestamp.
+                event.from_date = event.from_date or event.event_timestamp
+                event.event_timestamp = event.event_timestamp or event.from_date
+                yield event
+            if "LastEvaluatedKey" not in response:
+                break
+            params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+def get_upcoming_events(client, ts_bucket=None):
     # returns list of events, error
-    now_ts = utils.utc_now_ts()
-    ts_bucket = get_ts_bucket(now_ts)
+    if ts_bucket is None:
+        ts_bucket = get_ts_bucket(utils.utc_now_ts())
+    try:
+        return list(iter_upcoming_events(client, ts_bucket, ts_bucket)), None
+    except Exception as e:
+        return [], e
 
-    print(f"Checking ts_bucket={ts_bucket}")
+# the watermark is the last bucket whose events were all sent.
+# after a missed or late invocation, check_reminders catches up from the bucket after it.
+def get_events_watermark(client):
+    # returns ts_bucket (-1 if not set), error
+    try:
+        response = client.get_item(
+            TableName=META_TABLE,
+            Key={"name": {"S": EVENTS_WATERMARK}},
+            ConsistentRead=True,
+        )
+        if response["ResponseMetadata"]["HTTPStatusCode"] != 200:
+            return -1, json.dumps(response["Error"])
+        return int(response.get("Item", {}).get("ts_bucket", {}).get("N", "-1")), None
+    except Exception as e:
+        return -1, e
 
+def set_events_watermark(client, ts_bucket):
+    try:
+        resp = client.update_item(
+            TableName=META_TABLE,
+            Key={"name": {"S": EVENTS_WATERMARK}},
+            UpdateExpression="SET ts_bucket = :ts",
+            # the watermark only moves forward.
+            ConditionExpression="attribute_not_exists(ts_bucket) OR ts_bucket < :ts",
+            ExpressionAttributeValues={":ts": {"N": str(ts_bucket)}},
+            ReturnValues="NONE",
+        )
+        if resp["ResponseMetadata"]["HTTPStatusCode"] != 200:
+            return json.dumps(resp["Error"])
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            return None
+        return e
+    except Exception as e:
+        return e
+    return None
+
+# returns the earliest from_date of the pending events in the bucket (-1 if there is none), error.
+# used by the scheduler to find the next reminder to fire.
+def get_next_pending_from_date(client, ts_bucket):
     try:
         response = client.query(
             TableName=EVENTS_TABLE,
-            KeyConditionExpression="ts_bucket = :ts",
-            FilterExpression="scheduled = :s",
-            ExpressionAttributeValues={":ts": {"N": str(ts_bucket)}, ":s": {"BOOL": False}}
+            IndexName=PENDING_INDEX,
+            KeyConditionExpression="pending_bucket = :ts",
+            ProjectionExpression="from_date",
+            ExpressionAttributeValues={":ts": {"N": str(ts_bucket)}},
+            ScanIndexForward=True,
+            Limit=1,
         )
         if response["ResponseMetadata"]["HTTPStatusCode"] != 200:
-            return [], json.dumps(response["Error"])
-        items = response["Items"]
-        events = [
-            {
-                "ts_bucket": int(item["ts_bucket"]["N"]),
-                "event_id": item["event_id"]["S"],
-                "wa_id": item["wa_id"]["S"],
-                "event_name": item["event_name"]["S"],
-                "event_timestamp_str": item.get("event_timestamp_str", {}).get("S", ""),
-                "event_timestamp": item.get("event_timestamp", {}).get("N", ""),
-                "from_date": item.get("from_date", {}).get("N", ""),
-                "from_date_str": item.get("from_date_str", {}).get("S", ""),
-                "to_date": item.get("to_date", {}).get("N", ""),
-                "to_date_str": item.get("to_date_str", {}).get("S", ""),
-                "frequency": item["frequency"]["S"],
-                "scheduled": item["scheduled"]["BOOL"],
-                "version": item.get("version", {}).get("S", ""),
-            } for item in items
-        ]
-        return events, None
+            return -1, json.dumps(response["Error"])
+        if not response["Items"]:
+            return -1, None
+        return int(response["Items"][0]["from_date"]["N"]), None
     except Exception as e:
-        return [], e
+        return -1, e
 
+# marks the event as sent and drops it from the pending index in the same write.
+# returns "already_scheduled" if another invocation got to it first:
+# the pending index is eventually consistent and can return events that were just sent.
 def mark_event_as_scheduled(client, ts_bucket: int, event_id: str):
     try:
-        resp = client.update_item(TableName="RemindersEvents", Key={'ts_bucket': {"N": str(ts_bucket)}, 'event_id': {"S": event_id}}, UpdateExpression="SET scheduled = :s", ExpressionAttributeValues={":s": {"BOOL": True}})
+        resp = client.update_item(
+            TableName=EVENTS_TABLE,
+            Key={'ts_bucket': {"N": str(ts_bucket)}, 'event_id': {"S": event_id}},
+            UpdateExpression="SET scheduled = :s REMOVE pending_bucket",
+            ConditionExpression="scheduled = :f",
+            ExpressionAttributeValues={":s": {"BOOL": True}, ":f": {"BOOL": False}},
+        )
         if resp["ResponseMetadata"]["HTTPStatusCode"] != 200:
             return json.dumps(resp["Error"])
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            return "already_scheduled"
+        print(f"mark_event_as_scheduled failed for ts_bucket={ts_bucket}, event_id={event_id} with error: {e}")
+        return e
     except Exception as e:
         print(f"mark_event_as_scheduled failed for ts_bucket={ts_bucket}, event_id={event_id} with error: {e}")
         return e
@@ -738,6 +1015,41 @@ def get_event_from_index(event_index: str, events):
 
     return events[i], ""
 
+# ----- COMPLETION CACHE -----
+def get_cached_completion(client, key):
+    # returns completion ("" if not cached), error
+    try:
+        response = client.get_item(
+            TableName=COMPLETION_CACHE_TABLE,
+            Key={"key": {"S": key}},
+            ProjectionExpression="completion, expires_ts",
+        )
+        if response["ResponseMetadata"]["HTTPStatusCode"] != 200:
+            return "", json.dumps(response["Error"])
+        item = response.get("Item", {})
+        # dynamodb deletes expired items within a few days, not right away.
+        if int(item.get("expires_ts", {}).get("N", "0")) <= utils.utc_now_ts():
+            return "", None
+        return item["completion"]["S"], None
+    except Exception as e:
+        return "", e
+
+def put_cached_completion(client, key, completion, ttl):
+    try:
+        response = client.put_item(
+            TableName=COMPLETION_CACHE_TABLE,
+            Item={
+                "key": {"S": key},
+                "completion": {"S": completion},
+                "expires_ts": {"N": str(utils.utc_now_ts() + ttl)},
+            },
+        )
+        if response["ResponseMetadata"]["HTTPStatusCode"] != 200:
+            return json.dumps(response["Error"])
+    except Exception as e:
+        return e
+    return None
+
 # ----- FEEDBACK -----
 def insert_new_feedback(client, wa_id, feedback_msg):
     try:
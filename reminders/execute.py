@@ -1,11 +1,13 @@
 import reminders.whatsapp as wa
 import reminders.dynamodb as db
-from reminders.reschedule import future_dates_from_regex
+import reminders.recurrence as recurrence
+import reminders.scheduler as scheduler
 from reminders.utils import log_msg
 
 def execute(fn, kwargs, user, events, client):
     wa_id = user["wa_id"]
     verbose = user.get("verbose", False)
+    tz = user.get("user_timezone", "") or "UTC"
     if fn == "create":
         return create(
             client=client, 
@@ -16,7 +18,7 @@ def execute(fn, kwargs, user, events, client):
             to_date=kwargs["to_date"], 
             to_date_str=kwargs["to_date_str"], 
             frequency=kwargs["frequency"],
-            stats=user["stats"],
+            tz=tz,
             verbose=verbose,
         )
     elif fn == "update":
@@ -24,7 +26,6 @@ def execute(fn, kwargs, user, events, client):
             client=client, 
             wa_id=wa_id,
             events=events, 
-            stats=user["stats"],
             from_date=kwargs["from_date"],
             from_date_str=kwargs["from_date_str"],
             to_date=kwargs["to_date"],
@@ -32,30 +33,33 @@ def execute(fn, kwargs, user, events, client):
             frequency=kwargs["frequency"],
             event_index=kwargs["event_index"],
             event_name=kwargs["event_name"],
+            legacy_events=user.get("events_v2", []),
+            tz=tz,
             verbose=verbose,
         )
     elif fn == "delete":
         event, err = db.get_event_from_index(event_index=kwargs["event_index"], events=events)
         if err:
-            log_msg(wa_id=wa_id, verbose=verbose, msg=f"Could not get event from index: {err}")
+            log_msg({"wa_id": wa_id, "verbose": verbose}, f"Could not get event from index: {err}")
             return err
         
-        log_msg(wa_id=wa_id, verbose=verbose, msg=f"Got following event from index: {event['event_name']}, ({event['from_date_str']})")
+        log_msg({"wa_id": wa_id, "verbose": verbose}, f"Got following event from index: {event['event_name']}, ({event['from_date_str']})")
+        err_rule = recurrence.delete(client, rule_id=event["event_id"])
+        if err_rule:
+            log_msg({"wa_id": wa_id, "verbose": verbose}, f"Could not delete recurrence rule: {err_rule}. Event: {event}")
+            return err_rule
         err1 = db.delete_event(client, wa_id=wa_id, ts_bucket=event["ts_bucket"], event_id=event["event_id"])
         if err1:
-            log_msg(wa_id=wa_id, verbose=verbose, msg=f"Could not delete event: {err1}. Event: {event}")
+            log_msg({"wa_id": wa_id, "verbose": verbose}, f"Could not delete event: {err1}. Event: {event}")
             return err1
-        new_events = []
-        for e in events:
-            if e["event_id"] != event.get("event_id", ""):
-                new_events.append(e)
-        err2 = db.set_user_events_v2(client, wa_id, new_events)
+        err2 = db.remove_user_event(client, wa_id, event["event_id"])
+        if not err2:
+            err2 = remove_legacy_user_event(client, wa_id, user.get("events_v2", []), event["event_id"])
         if err2:
-            log_msg(wa_id=wa_id, verbose=verbose, msg=f"Could not set user events: {err2}")
+            log_msg({"wa_id": wa_id, "verbose": verbose}, f"Could not remove user event: {err2}")
         else:
-            new_events_str =  ", ".join(f"{e['event_name']}, ({e['from_date_str']})" for e in new_events)
-            log_msg(wa_id=wa_id, verbose=verbose, msg=f"Successfully set user events to {new_events_str}")
-        err_stats = db.set_user_stats(client=client, wa_id=wa_id, stats=user["stats"], message_inc=0, reminder_inc=-1)
+            log_msg({"wa_id": wa_id, "verbose": verbose}, f"Removed user event {event['event_name']}, ({event['from_date_str']})")
+        err_stats = db.set_user_stats(client=client, wa_id=wa_id, message_inc=0, reminder_inc=-1)
         return None
     elif fn == "update_timezone":
         return update_timezone(client=client, wa_id=wa_id, timezone=kwargs["timezone"])
@@ -63,13 +67,7 @@ def execute(fn, kwargs, user, events, client):
         print(f"execute. Uknown function {fn} with arguments {kwargs}")
     return None
 
-def create(client, wa_id, event_name, from_date, from_date_str, to_date, to_date_str, frequency, stats, verbose=False):
-    future_dates, err = future_dates_from_regex(
-        frequency=frequency, 
-        from_date_ts=from_date,
-        to_date_ts=to_date,
-    )
-
+def create(client, wa_id, event_name, from_date, from_date_str, to_date, to_date_str, frequency, tz="UTC", verbose=False):
     event_id = db.get_event_id_v2(
         wa_id=wa_id, 
         event_name=event_name, 
@@ -80,96 +78,51 @@ def create(client, wa_id, event_name, from_date, from_date_str, to_date, to_date
 
     ts_bucket = db.get_ts_bucket(from_date)
 
-    children = []
-    err = "DUMMY_ERR"
-    if not err and future_dates:
-        for child_date_ts in future_dates:
-            child_event_id = db.get_event_id_v2(
-                wa_id=wa_id,
-                event_name=event_name,
-                from_date=child_date_ts,
-                to_date=-1,
-                frequency="once",
-            )
-            child_ts_bucket = db.get_ts_bucket(child_date_ts)
-            
-            child_err = db.create_event_v2(
-                client=client,
-                wa_id=wa_id,
-                ts_bucket=child_ts_bucket,
-                event_id=child_event_id,
-                event_name=event_name,
-                from_date=child_date_ts,
-                from_date_str=from_date_str,
-                to_date=to_date,
-                to_date_str=to_date_str,
-                frequency=frequency,
-                reschedule=False,
-            )
-
-            if child_err:
-                continue
-
-            children.append({
-                "ts_bucket": child_date_ts,
-                "event_id": child_event_id,
-            })
-    else:
-        err_create = db.create_event_v2(
-            client=client,
-            wa_id=wa_id,
-            ts_bucket=ts_bucket,
-            event_id=event_id,
-            event_name=event_name,
-            from_date=from_date,
-            from_date_str=from_date_str,
-            to_date=to_date,
-            to_date_str=to_date_str,
-            frequency=frequency,
-            reschedule=True,
-        )
+    # recurring reminders are stored as a rule and their next occurrences (see recurrence.py).
+    err_create = recurrence.create(
+        client=client,
+        wa_id=wa_id,
+        event_id=event_id,
+        ts_bucket=ts_bucket,
+        event_name=event_name,
+        from_date=from_date,
+        from_date_str=from_date_str,
+        to_date=to_date,
+        to_date_str=to_date_str,
+        frequency=frequency,
+        tz=tz,
+    )
 
-        if err_create:
-            err_msg = f"Could not create event: {err_create}"
-            log_msg(wa_id=wa_id, verbose=verbose, msg=err_msg)
-            return err_msg
+    if err_create:
+        err_msg = f"Could not create event: {err_create}"
+        log_msg({"wa_id": wa_id, "verbose": verbose}, err_msg)
+        return err_msg
     
-    tim_msg_list = []
-    if children:
-        tim_msg_list.append(f"Created {len(children)} children events.")
+    # make sure the reminders check fires in time for the new reminder.
+    err_arm = scheduler.arm_if_earlier(from_date)
+    if err_arm:
+        log_msg({"wa_id": wa_id, "verbose": verbose}, f"Could not arm scheduler. Error: {err_arm}")
 
-    err_update = db.update_user_events_v2(
+    err_update = db.put_user_event(
         client=client, 
         wa_id=wa_id, 
-        events=[
-            { 
-                "event_id": event_id,
-                "event_name": event_name,
-                "from_date": from_date,
-                "from_date_str": from_date_str,
-                "to_date": to_date,
-                "to_date_str": to_date_str,
-                "frequency": frequency,
-                "children": children,
-                "ts_bucket": ts_bucket,  # legacy
-            }
-        ]
+        event=db.user_event(event_id, ts_bucket, event_name, from_date, from_date_str, to_date, to_date_str, frequency),
     )  # err_update not critical
 
     if err_update:
-        log_msg(wa_id=wa_id, verbose=verbose, msg=f"Could not update user events. Error: {err_update}")
+        log_msg({"wa_id": wa_id, "verbose": verbose}, f"Could not update user events. Error: {err_update}")
     else:
-        log_msg(wa_id=wa_id, verbose=verbose, msg="Updated user events.")
+        log_msg({"wa_id": wa_id, "verbose": verbose}, "Updated user events.")
 
-    err_stats = db.set_user_stats(client=client, wa_id=wa_id, stats=stats, message_inc=0, reminder_inc=1)
+    err_stats = db.set_user_stats(client=client, wa_id=wa_id, message_inc=0, reminder_inc=1)
     if err_stats:
-        log_msg(wa_id=wa_id, verbose=verbose, msg=f"Could not update user stats. Error: {err_stats}")
+        log_msg({"wa_id": wa_id, "verbose": verbose}, f"Could not update user stats. Error: {err_stats}")
     else:
-        log_msg(wa_id=wa_id, verbose=verbose, msg="Updated user stats.")
+        log_msg({"wa_id": wa_id, "verbose": verbose}, "Updated user stats.")
 
     return None
 
-def update(client, wa_id, from_date, from_date_str, to_date, to_date_str, frequency, event_name, event_index, events, stats, verbose=False):
+def update(client, wa_id, from_date, from_date_str, to_date, to_date_str, frequency, event_name, event_index, events, legacy_events=(), tz="UTC", verbose=False):
     ts_bucket = db.get_ts_bucket(from_date)
     event_id = db.get_event_id_v2(
         wa_id=wa_id,
@@ -180,7 +133,7 @@ def update(client, wa_id, from_date, from_date_str, to_date, to_date_str, freque
     )
     event, err = db.get_event_from_index(event_index=event_index, events=events)
     if err:
-        log_msg(wa_id=wa_id, verbose=verbose, msg=f"Could not get event from index: {err}. Falling back to `create`")
+        log_msg({"wa_id": wa_id, "verbose": verbose}, f"Could not get event from index: {err}. Falling back to `create`")
         # fallback to `create`
         return create(
             client=client, 
@@ -191,15 +144,18 @@ def update(client, wa_id, from_date, from_date_str, to_date, to_date_str, freque
             to_date=to_date, 
             to_date_str=to_date_str, 
             frequency=frequency,
-            stats=stats,
+            tz=tz,
             verbose=verbose,
         )
     
-    log_msg(wa_id=wa_id, verbose=verbose, msg=f"Extracted event using index: {event}.")
+    log_msg({"wa_id": wa_id, "verbose": verbose}, f"Extracted event using index: {event}.")
+    err_rule = recurrence.delete(client, rule_id=event["event_id"])
+    if err_rule:
+        log_msg({"wa_id": wa_id, "verbose": verbose}, f"Could not delete recurrence rule: {err_rule}. Event: {event}")
     err1 = db.delete_event(client=client, wa_id=wa_id, ts_bucket=event["ts_bucket"], event_id=event["event_id"])
     if err1:
-        log_msg(wa_id=wa_id, verbose=verbose, msg=f"Could not delete event: {err1}. Event: {event}")
-    err2 = db.create_event_v2(
+        log_msg({"wa_id": wa_id, "verbose": verbose}, f"Could not delete event: {err1}. Event: {event}")
+    err2 = recurrence.create(
         client=client,
         wa_id=wa_id,
         ts_bucket=ts_bucket,
@@ -210,15 +166,36 @@ def update(client, wa_id, from_date, from_date_str, to_date, to_date_str, freque
         to_date=to_date,
         to_date_str=to_date_str,
         frequency=frequency,
+        tz=tz,
     )
 
     if err2:
-        log_msg(wa_id=wa_id, verbose=verbose, msg=f"Could not update event: {err2}.")
+        log_msg({"wa_id": wa_id, "verbose": verbose}, f"Could not update event: {err2}.")
         return err2
-    
-    err3 = db.update_user_events(client, wa_id, [{"ts_bucket": ts_bucket, "event_id": event_id}])
+
+    err_arm = scheduler.arm_if_earlier(from_date)
+    if err_arm:
+        log_msg({"wa_id": wa_id, "verbose": verbose}, f"Could not arm scheduler. Error: {err_arm}")
+
+    err3 = db.put_user_event(
+        client=client,
+        wa_id=wa_id,
+        event=db.user_event(event_id, ts_bucket, event_name, from_date, from_date_str, to_date, to_date_str, frequency),
+        remove_id=event["event_id"],
+    )
+    if not err3:
+        err3 = remove_legacy_user_event(client, wa_id, legacy_events, event["event_id"])
+    if err3:
+        log_msg({"wa_id": wa_id, "verbose": verbose}, f"Could not update user events. Error: {err3}")
     return None
 
+# users that were not migrated yet (see migrations.index_user_events) have their reminders in the legacy
+# events_v2 list: removing one rewrites the list. Returns error.
+def remove_legacy_user_event(client, wa_id, legacy_events, event_id):
+    if not any(e["event_id"] == event_id for e in legacy_events):
+        return None
+    return db.set_user_events_v2(client, wa_id, [e for e in legacy_events if e["event_id"] != event_id])
+
 def update_timezone(client, wa_id, timezone):
    err = db.update_user_timezone(client=client, wa_id=wa_id, timezone=timezone)
    return err
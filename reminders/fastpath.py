@@ -0,0 +1,194 @@
+import re
+
+import reminders.parser as parser
+import reminders.recurrence as recurrence
+import reminders.utils as utils
+
+# rule-based extractor for simple reminder requests, e.g.:
+# - "remind me to call mom at 5pm tomorrow"
+# - "remind me at 9:30 to take my pills"
+# - "remind me to drink water every 2 hours"
+# - "remind me to go to the gym every monday at 7am"
+# when the whole message matches, handler_v2 creates the reminder without any LLM call.
+# anything else (other languages, several reminders, vague times...) returns no params and goes to the LLM.
+# frequencies are written so that recurrence.parse understands them: anything it rejects goes to the LLM.
+# so does anything ambiguous (e.g. "at 5" without am/pm) or in the past: the fast path never guesses.
+
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+NUMBERS = {"a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+           "seven": 7, "eight": 8, "nine": 9, "ten": 10, "eleven": 11, "twelve": 12}
+UNITS = {"min": "minute", "mins": "minute", "minute": "minute", "minutes": "minute",
+         "hour": "hour", "hours": "hour", "day": "day", "days": "day", "week": "week", "weeks": "week"}
+MAX_EVENT_NAME_LEN = 100
+
+NUMBER = r"\d{1,3}|" + "|".join(NUMBERS.keys())
+UNIT = "|".join(UNITS.keys())
+TIME = r"(?P<hour>\d{1,2})(?::(?P<minute>\d{2}))? ?(?P<ampm>am|pm)?|(?P<named>noon|midnight)"
+WEEKDAY = "|".join(WEEKDAYS)
+
+RELATIVE_RE = re.compile(rf"in (?P<n>{NUMBER}) (?P<unit>{UNIT})")
+AT_RE = re.compile(rf"(?:(?P<pre>.+) )?at (?:{TIME})(?: (?P<post>.+))?")
+DAY_RE = re.compile(rf"today|tonight|tomorrow|(?:on )?(?:next )?(?P<weekday>{WEEKDAY})")
+RECURRENCE_RE = re.compile(rf"every day|daily|every week|weekly|hourly|every (?P<weekday>{WEEKDAY})|every (?:(?P<n>{NUMBER}) )?(?P<unit>{UNIT})")
+# a task that still contains a date or time means we did not understand the request.
+TASK_REJECT_RE = re.compile(rf"\b(?:at \d|in (?:{NUMBER}) (?:{UNIT})\b|today|tonight|tomorrow|every|daily|weekly|hourly|noon|midnight|{WEEKDAY})\b|\d{{1,2}} ?(?:am|pm)\b|\d:\d\d")
+
+# run returns params in the format of parser.run and a confirmation message for the user.
+# params is empty if the request is not simple enough to be handled without the LLM.
+def run(msg, timestamp, user):
+    tz = user.get("user_timezone", "")
+    if not tz:
+        return [], ""
+    # the event name keeps the user's case, everything else is matched in lower case.
+    words = msg.strip(" .!").split()
+    if len(words) < 4 or [w.lower() for w in words[:2]] != ["remind", "me"]:
+        return [], ""
+    now = utils.from_timestamp(timestamp, tz)
+    task_start, task_end, dt, frequency = split_request([w.lower() for w in words[2:]], now)
+    if dt is None:
+        return [], ""
+
+    task = " ".join(words[2 + task_start:2 + task_end])
+    event_name = task[0].upper() + task[1:]
+    if quote(event_name) is None:
+        return [], ""
+    from_date_str = dt.format(utils.TIME_FORMAT)
+    params, err = parser.transform("create", [event_name, from_date_str, "none", frequency], user)
+    if err:
+        return [], ""
+    when_str = dt.format("dddd, MMMM D [at] HH:mm")
+    if frequency != "once":
+        when_str += f", {frequency}"
+    return [("create", params)], f"Done! I'll remind you on {when_str}: {event_name} 😊"
+
+# split_request finds the task and the time in the words following "remind me".
+# the time can come after the task ("to <task> <when>") or before it ("<when> to <task>").
+# returns task start and end indexes in `words`, first occurrence, frequency.
+# the occurrence is None if no split is understood.
+def split_request(words, now):
+    candidates = []  # (task start, task end, when start, when end)
+    if words[0] in ("to", "about"):
+        candidates += [(1, i, i, len(words)) for i in range(2, len(words))]
+    candidates += [(i + 1, len(words), 0, i) for i in range(1, len(words) - 1) if words[i] in ("to", "about")]
+    for task_start, task_end, when_start, when_end in candidates:
+        task = " ".join(words[task_start:task_end])
+        if len(task) > MAX_EVENT_NAME_LEN or TASK_REJECT_RE.search(task):
+            continue
+        dt, frequency = parse_when(" ".join(words[when_start:when_end]), now)
+        if dt is not None:
+            return task_start, task_end, dt, frequency
+    return 0, 0, None, ""
+
+# returns the params in the command format of MINDY_PROGRAMMING_PROMPT.
+def to_commands(params):
+    return "\n".join(
+        f'create({quote(kwargs["event_name"])}, "{kwargs["from_date_str"]}", "{kwargs["to_date_str"]}", "{kwargs["frequency"]}")'
+        for fn, kwargs in params if fn == "create"
+    )
+
+# quote returns `s` between quotes that parser.parse reads back, or None if it can't:
+# the parser has no escapes, stops at the first closing parenthesis and strips quotes around arguments.
+def quote(s):
+    if ")" in s or "\n" in s or s != s.strip(" \"'"):
+        return None
+    if '"' not in s:
+        return f'"{s}"'
+    if "'" not in s:
+        return f"'{s}'"
+    return None
+
+# parse_when returns the first occurrence (a pendulum datetime in the user's timezone, strictly after now)
+# and the frequency, or None, "" if `when` is not understood.
+def parse_when(when, now):
+    dt, freq = parse_when_(when, now)
+    if dt is None or dt <= now:
+        return None, ""
+    # e.g. "every 0 minutes", or more frequent than recurrence.MIN_INTERVAL.
+    if freq != "once" and recurrence.parse(freq)[1]:
+        return None, ""
+    return dt, freq
+
+def parse_when_(when, now):
+    m = RELATIVE_RE.fullmatch(when)
+    if m:
+        n = to_number(m.group("n"))
+        if n == 0:
+            return None, ""
+        return now.add(**{f"{UNITS[m.group('unit')]}s": n}).replace(second=0, microsecond=0), "once"
+
+    m = RECURRENCE_RE.fullmatch(when)
+    if m:
+        # intervals without a time start one interval from now, e.g. "every 2 hours".
+        unit = UNITS.get(m.group("unit") or "", "hour" if when == "hourly" else "")
+        if unit not in ("minute", "hour"):
+            return None, ""
+        n = to_number(m.group("n")) if m.group("n") else 1
+        if n == 0:
+            return None, ""
+        return now.add(**{f"{unit}s": n}).replace(second=0, microsecond=0), frequency(m)
+
+    m = AT_RE.fullmatch(when)
+    if not m or (m.group("pre") and m.group("post")):
+        return None, ""
+    rest = m.group("pre") or m.group("post") or ""
+    day = DAY_RE.fullmatch(rest) if rest else None
+    repeat = RECURRENCE_RE.fullmatch(rest) if rest and not day else None
+    if rest and not day and not repeat:
+        return None, ""
+
+    hour, minute = to_time(m, tonight=rest == "tonight")
+    if hour is None:
+        return None, ""
+    dt = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+
+    weekday = (day or repeat).group("weekday") if (day or repeat) else None
+    if weekday:
+        # pendulum weekdays start on monday = 0.
+        dt = dt.add(days=(WEEKDAYS.index(weekday) - dt.weekday()) % 7)
+        if dt <= now:
+            dt = dt.add(days=7)
+    elif rest == "tomorrow":
+        dt = dt.add(days=1)
+    elif rest in ("today", "tonight"):
+        if dt <= now:
+            return None, ""
+    elif dt <= now:
+        dt = dt.add(days=1)
+    return dt, frequency(repeat) if repeat else "once"
+
+# frequency returns the frequency string of a RECURRENCE_RE match.
+def frequency(m):
+    text = m.group(0)
+    if text in ("every day", "daily"):
+        return "every day"
+    if text in ("every week", "weekly") or m.group("weekday"):
+        return "every week"
+    if text == "hourly":
+        return "every hour"
+    n = to_number(m.group("n")) if m.group("n") else 1
+    unit = UNITS[m.group("unit")]
+    return f"every {unit}" if n == 1 else f"every {n} {unit}s"
+
+def to_number(s):
+    return NUMBERS[s] if s in NUMBERS else int(s)
+
+# to_time returns the hour and minute of an AT_RE match, or None, None if it's not a valid time.
+# hours without am/pm are on 24 hours, except "tonight at 10". An hour from 1 to 12 without a
+# leading zero ("at 5", "at 5:30") could be am or pm: it is left to the LLM.
+def to_time(m, tonight=False):
+    if m.group("named"):
+        return (12, 0) if m.group("named") == "noon" else (0, 0)
+    hour = int(m.group("hour"))
+    minute = int(m.group("minute") or 0)
+    ampm = m.group("ampm")
+    if ampm:
+        if hour < 1 or hour > 12:
+            return None, None
+        hour = hour % 12 + (12 if ampm == "pm" else 0)
+    elif tonight and hour < 12:
+        hour += 12
+    elif 1 <= hour <= 12 and not m.group("hour").startswith("0"):
+        return None, None
+    if hour > 23 or minute > 59:
+        return None, None
+    return hour, minute
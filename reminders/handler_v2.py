@@ -5,9 +5,13 @@ import reminders.parser as parser
 import reminders.dynamodb as db
 import reminders.whatsapp as wa
 import reminders.execute as execute
+import reminders.fastpath as fastpath
 import reminders.commands as commands
+import reminders.metrics as metrics
+import reminders.prompt_builder as prompt_builder
 
 import logging
+import time
 
 logging.basicConfig(level = logging.INFO)
 
@@ -20,9 +24,11 @@ logger.setLevel(logging.DEBUG)
 # logger.addHandler(console_handler)
 
 FAILURE_MESSAGE = "Sorry there was an error 😔 let's try again later"
+# token budget of a prompt: the context of the model minus the room left for the completion.
+PROMPT_BUDGET = prompt_builder.CONTEXT_LIMIT - prompt_builder.COMPLETION_TOKENS
 
 # takes user dict and turn past conversation into OpenAI ingestable messages.
-# we start with prompt and only include the last X messages.
+# we start with prompt and only include the last X messages, within prompt_builder.HIST_BUDGET tokens.
 def construct_hist_from_conversation(user):
     # conversation = [{"text": <string>, "timestamp": <int (ms)>, "role": <string: user or assistant>}]
     conv_len = len(user["conversation"])
@@ -40,9 +46,18 @@ def construct_hist_from_conversation(user):
 
         if i - start % 4 == 0 and i > start:
             hist.append({"role": "user", "content": prompts.MINDY_REPEAT_PROMPT, "exclude": True})
-    return hist
+    return prompt_builder.fit(hist, prompt_builder.HIST_BUDGET)
 
+# run logs the duration of each stage (handler.* metrics) once the request is handled.
 def run(msg, msg_id, user, timestamp, events, client):
+    metrics.reset()
+    try:
+        with metrics.timer("handler.total"):
+            return pipeline(msg, msg_id, user, timestamp, events, client)
+    finally:
+        metrics.log("handler_v2")
+
+def pipeline(msg, msg_id, user, timestamp, events, client):
     logger.debug(f"User says: {msg}")
     # msg: comes from user
     hist = construct_hist_from_conversation(user)
@@ -60,20 +75,36 @@ def run(msg, msg_id, user, timestamp, events, client):
     if ok:
         return
 
-    # 1. Fetch response from Mindy
     now = utils.utc_to_usr_local_str(timestamp, tz=user["user_timezone"])
     user_message_formatted = (
         f"{msg}\n"
         f"# Sent on: {now}\n"
     )
     hist.append({"role": "user", "content": user_message_formatted, "timestamp": timestamp, "id": msg_id})
+
+    # simple requests such as "remind me to call mom at 5pm" are handled without the LLM.
+    params, confirmation_message = fastpath.run(msg, timestamp, user)
+    if params:
+        metrics.incr("handler.fastpath")
+        logger.debug(f"Fast path params: {params}")
+        # the commands are added to the history like programming mindy's, so that she doesn't create the reminder again.
+        hist.append({"role": "assistant", "content": fastpath.to_commands(params), "type": "command", "timestamp": utils.utc_now_ts()})
+        with metrics.timer("handler.execute"):
+            err = execute_params(params, user, [], client)
+        if err:
+            utils.log_msg(user, f"execution error: {err}")
+            return wa.send(FAILURE_MESSAGE, user=user, client=client, hist=hist, type_="error")
+        return wa.send(confirmation_message, user=user, client=client, hist=hist)
+
+    # 1. Fetch response from Mindy
     filtered_types = ["command"]  # not filter out `request`type? `command` is the command that programming mindy writes, not a user command like /reminders.
-    out_1 = chat.get_openai_completion(
-        [
-            {"role": m["role"], "content": m["content"]} \
-            for m in hist if m.get("type", "") not in filtered_types
-        ]
-    )
+    with metrics.timer("handler.reply"):
+        out_1 = get_reply(
+            [
+                {"role": m["role"], "content": m["content"]} \
+                for m in hist if m.get("type", "") not in filtered_types
+            ]
+        )
     if not out_1:
         utils.log_msg(user, "OpenAI empty response.")
         wa.send(FAILURE_MESSAGE, user=user, client=client, hist=hist, type_="error")
@@ -109,8 +140,13 @@ def run(msg, msg_id, user, timestamp, events, client):
         programming_msg += f"\n\nIf you need to update or delete a reminder, here are {user['user_name']}'s upcoming reminders:\n{reminders_str}"
     programming_msg += f"\n\nWrite the commands to fulfill the request below:\n{formatted_request}"
 
-    programming_hist = [{"role": m["role"], "content": m["content"]} for m in hist] + [{"role": "user", "content": programming_msg}]
-    out_4 = chat.get_openai_completion(programming_hist)
+    # the list of reminders can be long: older turns make room for it.
+    programming_hist = prompt_builder.fit(
+        [{"role": m["role"], "content": m["content"]} for m in hist] + [{"role": "user", "content": programming_msg}],
+        PROMPT_BUDGET,
+    )
+    with metrics.timer("handler.programming"):
+        out_4 = chat.get_openai_completion(programming_hist, stage="programming")
 
     utils.log_msg(user, f"Manager request: {formatted_request}.\nReminders: {reminders_str}\nResponse: {out_4}")
     if not out_4:
@@ -130,7 +166,9 @@ def run(msg, msg_id, user, timestamp, events, client):
         retry_msg = f"@manager:\nThe commands you generated resulted in the following error: {err}. Please write a corrected version of the commands you sent."
         programming_hist.append({"role": "user", "content": retry_msg})
 
-        out_4 = chat.get_openai_completion(programming_hist)
+        programming_hist = prompt_builder.fit(programming_hist, PROMPT_BUDGET, keep_last=3)
+        with metrics.timer("handler.programming_retry"):
+            out_4 = chat.get_openai_completion(programming_hist, stage="programming_retry")
         if not out_4:
             utils.log_msg(user, "OpenAI empty response.")
             return wa.send(FAILURE_MESSAGE, user=user, client=client, hist=hist, type_="error")
@@ -148,30 +186,42 @@ def run(msg, msg_id, user, timestamp, events, client):
     # we add it to the history to give it back to programming mindy. Otherwise she will create reminders that were already created before.
     hist.append({"role": "assistant", "content": out_4, "type": "command", "timestamp": utils.utc_now_ts()})
 
-    # 7. Execute commands
-    for fn, kwargs in params:
-        if fn == "fetch":
-            if future_events:
-                reminders_str = "\n".join(f"- name:{v['event_name']}, time:{v['from_date_str']}, frequency: {v['frequency']}" for v in future_events)
-                fetch_resp = f"Here are your upcoming reminders:\n{reminders_str}\n\nYou can also type /reminders to access your future reminders."
-            else:
-                fetch_resp = "You have no upcoming reminders 🥲\nIn the future, you can also type /reminders to access your reminders."
-            return wa.send(fetch_resp, user=user, client=client, hist=hist)
+    # Request the confirmation message (step 8) now, so that it runs while the commands are executed.
+    # it only depends on the conversation up to the manager request (commands are filtered out).
+    # a fetch is answered with the list of reminders: no confirmation is requested.
+    confirmation = None
+    if all(fn != "fetch" for fn, _ in params):
+        confirmation = chat.submit_completion(
+            [{"role": m["role"], "content": m["content"]} for m in hist if m.get("type", "") != "command"] +\
+            [{"role": "user", "content": prompts.CONFIRMATION_PROMPT}],
+            stage="confirmation",
+        )
 
-        err = execute.execute(fn, kwargs, user, future_events, client)
-        if not err:
-            continue
+    # 7. Execute commands
+    with metrics.timer("handler.execute"):
+        err = execute_params(params, user, future_events, client)
+    if err == "fetch":
+        if future_events:
+            reminders_str = "\n".join(f"- name:{v['event_name']}, time:{v['from_date_str']}, frequency: {v['frequency']}" for v in future_events)
+            fetch_resp = f"Here are your upcoming reminders:\n{reminders_str}\n\nYou can also type /reminders to access your future reminders."
+        else:
+            fetch_resp = "You have no upcoming reminders 🥲\nIn the future, you can also type /reminders to access your reminders."
+        return wa.send(fetch_resp, user=user, client=client, hist=hist)
+    if err:
         # handle error.
         # todo: make it more interpretable? Maybe not all commands failed. Can result in surprising results for the user.
         utils.log_msg(user, f"execution error: {err}")
+        # not needed anymore: only cancelled if it hasn't started yet.
+        # there is none if a fetch follows the command that failed.
+        if confirmation is not None:
+            confirmation.cancel()
         return wa.send(FAILURE_MESSAGE, user=user, client=client, hist=hist, type_="error")
 
     # 8. send confirmation message.
     # also all my reminders got canceled due to retry :((
-    out_8 = chat.get_openai_completion([
-        {"role": m["role"], "content": m["content"]} for m in hist if m.get("type", "") != "command"] +\
-        [{"role": "user", "content": prompts.CONFIRMATION_PROMPT}]
-    )
+    # only the time left after executing the commands is spent waiting.
+    with metrics.timer("handler.confirmation_wait"):
+        out_8 = confirmation.result()
 
     if (not out_8) or ("@user" not in out_8.lower()): # fallback to boilerplate message
         logger.debug("8. Empty confirmation. Return boilerplate message.")
@@ -180,6 +230,57 @@ def run(msg, msg_id, user, timestamp, events, client):
     confirmation_message = out_8.split("@user")[-1].strip(",: ")
     return wa.send(confirmation_message, user=user, client=client, hist=hist)
 
+# get_reply streams Mindy's response to the user's message.
+# once the @manager request is complete, the rest of the response is not needed:
+# the stream is closed so that the request is handled right away.
+# returns "" on error, including a stream that broke halfway.
+def get_reply(messages):
+    start = time.perf_counter()
+    stream = chat.stream_completion(messages, stage="reply")
+    for i, _ in enumerate(stream):
+        if i == 0:
+            metrics.observe("handler.reply_first_token", time.perf_counter() - start)
+        end = manager_request_end(stream.text)
+        if end != -1:
+            stream.close()
+            metrics.incr("handler.reply_stopped_early")
+            return stream.text[:end]
+    if stream.error:
+        print(f"get_reply stream error: {stream.error}")
+        return ""
+    return stream.text
+
+# manager_request_end returns the index of the end of the @manager request, -1 if it isn't complete yet.
+# the request runs until a blank line: it can start on the line of @manager or on the next one and
+# span several lines. Without a blank line, it runs until the end of the stream.
+def manager_request_end(text):
+    i = text.lower().find("@manager")
+    if i == -1:
+        return -1
+    start = i + len("@manager")
+    request = False
+    while True:
+        end = text.find("\n", start)
+        if end == -1:
+            return -1
+        line = text[start:end].strip(":, ")
+        if line.strip():
+            request = True
+        elif request:
+            return start - 1
+        start = end + 1
+
+# executes the commands extracted by the parser, in order.
+# returns error. Error is "fetch" if the user asked for their reminders: the commands after it are not run.
+def execute_params(params, user, future_events, client):
+    for fn, kwargs in params:
+        if fn == "fetch":
+            return "fetch"
+        err = execute.execute(fn, kwargs, user, future_events, client)
+        if err:
+            return err
+    return None
+
 def hallucinations_safeguard(user, out, hist):
     hallucinations = [
         "i'll set up",
@@ -213,13 +314,15 @@ def hallucinations_safeguard(user, out, hist):
     utils.log_msg(user, f"Hallucination: {out}")
     filtered_types = ["command", "reminder"]
     clean_hist = [{"role": m["role"], "content": m["content"]} for m in hist if m.get("type", "") not in filtered_types]
-    out_new = chat.get_openai_completion(
-        clean_hist +\
-        [
-            {"role": "assistant", "content": out},
-            {"role": "user", "content": "Looks like you sent a confirmation, please rewrite this as a request to @manager. If you don't have all the information yet, just go on with the conversation."},
-        ]
-    )
+    with metrics.timer("handler.hallucination"):
+        out_new = chat.get_openai_completion(
+            clean_hist +\
+            [
+                {"role": "assistant", "content": out},
+                {"role": "user", "content": "Looks like you sent a confirmation, please rewrite this as a request to @manager. If you don't have all the information yet, just go on with the conversation."},
+            ],
+            stage="hallucination",
+        )
     utils.log_msg(user, f"Hallucination, 2nd response: {out_new}")
     if "@manager" in out_new.lower():
         return out_new
@@ -0,0 +1,106 @@
+import json
+import random
+import time
+
+from botocore.exceptions import ClientError
+
+import reminders.dynamodb as db
+import reminders.utils as utils
+
+# lease lock on a user, to prevent concurrent updates while we process a user's message.
+# acquire returns a fencing token: release only succeeds for the current holder.
+# handle_message acquires the lease through db.begin_request, which also does the request bookkeeping.
+
+MAX_WAIT = 60  # in seconds.
+BACKOFF_BASE = 0.25  # in seconds.
+BACKOFF_CAP = 5  # in seconds.
+
+# returns lock token, error. Error is "locked" if someone else holds the lease.
+def acquire(client, wa_id, ttl=db.LEASE_TTL):
+    resp, err = db.update_user_item(client, {
+        "Key": {"wa_id": {"S": wa_id}},
+        "UpdateExpression": "SET locked = :l, locked_ts = :now, lock_expires_ts = :exp ADD lock_token :one",
+        "ConditionExpression": db.LEASE_FREE_CONDITION,
+        "ExpressionAttributeValues": db.lease_values(utils.utc_now_ts(), ttl),
+        "ReturnValues": "UPDATED_NEW",
+    })
+    if isinstance(err, ClientError) and err.response["Error"]["Code"] == "ConditionalCheckFailedException":
+        return -1, "locked"
+    if err:
+        return -1, err
+    return int(resp["Attributes"]["lock_token"]["N"]), None
+
+# releases the lease if `token` is still the current one.
+# returns error. Error is "not_holder" if the lease expired and was taken by someone else.
+def release(client, wa_id, token):
+    # the lease was never acquired.
+    if token < 0:
+        return None
+    try:
+        resp = client.update_item(
+            TableName=db.USERS_TABLE,
+            Key={"wa_id": {"S": wa_id}},
+            UpdateExpression="SET locked = :f REMOVE lock_expires_ts",
+            ConditionExpression="lock_token = :t",
+            ExpressionAttributeValues={":f": {"BOOL": False}, ":t": {"N": str(token)}},
+            ReturnValues="NONE",
+        )
+        if resp["ResponseMetadata"]["HTTPStatusCode"] != 200:
+            return json.dumps(resp["Error"])
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            return "not_holder"
+        return e
+    except Exception as e:
+        return e
+    return None
+
+# reads only the lock attributes of the user.
+# returns {"locked": bool, "lock_expires_ts": int, "lock_token": int}, error
+def get_state(client, wa_id):
+    projection_expr, names = db.projection(db.LOCK_FIELDS)
+    try:
+        resp = client.get_item(
+            TableName=db.USERS_TABLE,
+            Key={"wa_id": {"S": wa_id}},
+            ProjectionExpression=projection_expr,
+            ExpressionAttributeNames=names,
+            ConsistentRead=True,
+        )
+        if resp["ResponseMetadata"]["HTTPStatusCode"] != 200:
+            return {}, json.dumps(resp["Error"])
+        item = resp.get("Item", {})
+        return {
+            "locked": item.get("locked", {}).get("BOOL", False),
+            "lock_expires_ts": int(item.get("lock_expires_ts", {}).get("N", "0")),
+            "lock_token": int(item.get("lock_token", {}).get("N", "0")),
+        }, None
+    except Exception as e:
+        return {}, e
+
+def is_free(state, now_ts):
+    return not state.get("locked", False) or state.get("lock_expires_ts", 0) < now_ts
+
+# exponential backoff with full jitter.
+def backoff(attempt):
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+# waits until the lease is free or `deadline` (a timestamp) is reached.
+# returns True if the lease is free, False otherwise.
+def wait_for_release(client, wa_id, deadline, sleep=time.sleep):
+    attempt = 0
+    while True:
+        now_ts = utils.utc_now_ts()
+        state, err = get_state(client, wa_id)
+        if err:
+            print(f"lock.get_state error: {err}")
+        elif is_free(state, now_ts):
+            return True
+        if now_ts >= deadline:
+            return False
+        t = backoff(attempt)
+        if state:
+            # no need to wait past the lease expiry.
+            t = min(t, max(0, state["lock_expires_ts"] - now_ts + 1))
+        sleep(min(t, max(0, deadline - now_ts)))
+        attempt += 1
@@ -0,0 +1,117 @@
+import json
+import os
+
+# in queue mode (INGEST_MODE=queue), the lambda function acknowledges whatsapp messages as soon as
+# they are queued, and a worker invocation runs handle_message (see lambda_function.py).
+# whatsapp redelivers messages that are not acknowledged fast enough: with the LLM calls out of the
+# webhook, this stops most duplicate deliveries.
+#
+# the queue is an SQS FIFO queue (MESSAGES_QUEUE_URL):
+# - messages of a user are grouped by wa_id, so they are handled one at a time and in order.
+# - the whatsapp message id is the deduplication id, so redeliveries within 5 minutes are dropped by SQS.
+#   later redeliveries are caught by the message_ids check of handle_message.
+# the worker is the SQS event source mapping of the lambda function, with ReportBatchItemFailures enabled.
+
+QUEUE_MODE = "queue"
+
+def is_enabled():
+    return os.environ.get("INGEST_MODE", "") == QUEUE_MODE
+
+
+# SQSBackend sends to the SQS FIFO queue set in MESSAGES_QUEUE_URL.
+class SQSBackend:
+    def __init__(self, client=None, queue_url=None):
+        import reminders.connections as connections
+        self.client = client or connections.get_client("sqs")
+        self.queue_url = queue_url or os.environ["MESSAGES_QUEUE_URL"]
+
+    def send(self, body, group_id, dedup_id):
+        self.client.send_message(
+            QueueUrl=self.queue_url,
+            MessageBody=body,
+            MessageGroupId=group_id,
+            MessageDeduplicationId=dedup_id,
+        )
+
+
+# InMemoryBackend is an in-process stand-in for the SQS queue, used in tests.
+# `drain` hands the queued messages to the worker as an SQS event, like the event source mapping would.
+class InMemoryBackend:
+    def __init__(self):
+        self.messages = []
+        self.dedup_ids = set()
+        self.sent = 0
+
+    def send(self, body, group_id, dedup_id):
+        if dedup_id in self.dedup_ids:
+            return
+        self.dedup_ids.add(dedup_id)
+        self.sent += 1
+        self.messages.append({
+            "messageId": str(self.sent),
+            "body": body,
+            "attributes": {"MessageGroupId": group_id},
+            "eventSource": "aws:sqs",
+        })
+
+    # returns the worker's response. Failed messages stay in the queue.
+    def drain(self, handler):
+        records, self.messages = self.messages, []
+        resp = work({"Records": records}, handler)
+        failed = {f["itemIdentifier"] for f in resp["batchItemFailures"]}
+        self.messages = [r for r in records if r["messageId"] in failed] + self.messages
+        return resp
+
+
+_backend = None
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = SQSBackend()
+    return _backend
+
+def set_backend(backend):
+    global _backend
+    _backend = backend
+
+# ingest validates the webhook request and queues the message.
+# returns the response of the lambda function URL: anything but a 200 makes whatsapp redeliver.
+def ingest(event):
+    try:
+        body = json.loads(event.get("body"))
+        value = body["entry"][0]["changes"][0]["value"]
+    except Exception as e:
+        print(f"ingest: could not parse body: {e}")
+        return {"statusCode": 400}
+
+    if ("contacts" not in value) or ("messages" not in value):
+        # status callbacks (sent, delivered, read...) are not handled.
+        return {"statusCode": 200}
+
+    wa_id = value["contacts"][0]["wa_id"]
+    msg_id = value["messages"][0]["id"]
+    try:
+        get_backend().send(event["body"], group_id=wa_id, dedup_id=msg_id)
+    except Exception as e:
+        print(f"ingest: could not queue message {msg_id}: {e}")
+        return {"statusCode": 500}
+    return {"statusCode": 200}
+
+# is_queue_event returns True if the lambda function was invoked by the SQS event source mapping.
+def is_queue_event(event):
+    records = event.get("Records", [])
+    return bool(records) and records[0].get("eventSource", "") == "aws:sqs"
+
+# work runs `handler` (handle_message) on every message of an SQS batch.
+# messages of a group must be handled in order: after a failure, the rest of the batch is
+# reported as failed and redelivered, instead of being handled out of order.
+def work(event, handler):
+    records = event.get("Records", [])
+    for i, record in enumerate(records):
+        try:
+            handler({"body": record["body"]})
+        except Exception as e:
+            print(f"message_queue.work: message {record['messageId']} failed: {e}")
+            return {"batchItemFailures": [{"itemIdentifier": r["messageId"]} for r in records[i:]]}
+    return {"batchItemFailures": []}
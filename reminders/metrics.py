@@ -0,0 +1,54 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# minimal in-process metrics, shared by all threads of the lambda container.
+# `log` prints a single json line so values can be pulled from CloudWatch logs.
+
+_lock = threading.Lock()
+_counters = {}
+_observations = {}
+
+def incr(name, value=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+def observe(name, value):
+    with _lock:
+        _observations.setdefault(name, []).append(value)
+
+# timer observes the duration of the block in seconds.
+@contextmanager
+def timer(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+def summary():
+    with _lock:
+        out = dict(_counters)
+        for name, values in _observations.items():
+            out[name] = {
+                "count": len(values),
+                "p50": round(percentile(values, 0.5), 3),
+                "p95": round(percentile(values, 0.95), 3),
+                "max": round(max(values), 3),
+            }
+    return out
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _observations.clear()
+
+def log(prefix):
+    print(f"{prefix} metrics: {json.dumps(summary())}")
@@ -0,0 +1,301 @@
+import sys
+import time
+
+import reminders.dynamodb as db
+
+# one-off data migrations. Each migration is idempotent and can be re-run safely.
+# to run a migration: python -m reminders.migrations <name>
+
+# ----- PENDING INDEX -----
+# creates the sparse pending index on RemindersEvents and tags existing pending events with `pending_bucket`.
+def add_pending_index(client):
+    create_pending_index(client)
+
+    tagged = 0
+    params = {
+        "TableName": db.EVENTS_TABLE,
+        "FilterExpression": "scheduled = :f AND attribute_not_exists(pending_bucket)",
+        "ProjectionExpression": "ts_bucket, event_id",
+        "ExpressionAttributeValues": {":f": {"BOOL": False}},
+    }
+    for item in scan(client, params):
+        try:
+            client.update_item(
+                TableName=db.EVENTS_TABLE,
+                Key={"ts_bucket": item["ts_bucket"], "event_id": item["event_id"]},
+                # legacy events only have event_timestamp, and the index needs from_date as sort key.
+                UpdateExpression="SET pending_bucket = ts_bucket, from_date = if_not_exists(from_date, event_timestamp)",
+                # the event may have been sent since the scan.
+                ConditionExpression="scheduled = :f",
+                ExpressionAttributeValues={":f": {"BOOL": False}},
+            )
+            tagged += 1
+        except client.exceptions.ConditionalCheckFailedException:
+            continue
+    print(f"add_pending_index: tagged {tagged} pending events.")
+
+def create_pending_index(client):
+    index = pending_index(client)
+    if index:
+        missing = missing_projection(index)
+        if missing:
+            print(f"create_pending_index: {db.PENDING_INDEX} doesn't project {missing}. Run the pending_index_projection migration.")
+        else:
+            print(f"create_pending_index: {db.PENDING_INDEX} already exists.")
+        return
+    client.update_table(
+        TableName=db.EVENTS_TABLE,
+        AttributeDefinitions=[
+            {"AttributeName": "pending_bucket", "AttributeType": "N"},
+            {"AttributeName": "from_date", "AttributeType": "N"},
+        ],
+        GlobalSecondaryIndexUpdates=[{
+            "Create": {
+                "IndexName": db.PENDING_INDEX,
+                "KeySchema": [
+                    {"AttributeName": "pending_bucket", "KeyType": "HASH"},
+                    {"AttributeName": "from_date", "KeyType": "RANGE"},
+                ],
+                # all attributes: fields added to db.UPCOMING_EVENT_FIELDS don't need a new index.
+                "Projection": {"ProjectionType": "ALL"},
+            },
+        }],
+    )
+    print(f"create_pending_index: creating {db.PENDING_INDEX}. Wait for it to be ACTIVE before deploying.")
+
+# returns the description of the pending index, None if it doesn't exist.
+def pending_index(client):
+    table = client.describe_table(TableName=db.EVENTS_TABLE)["Table"]
+    for index in table.get("GlobalSecondaryIndexes", []):
+        if index["IndexName"] == db.PENDING_INDEX:
+            return index
+    return None
+
+# returns the fields of db.UPCOMING_EVENT_FIELDS that the index doesn't project.
+def missing_projection(index):
+    projection = index["Projection"]
+    if projection["ProjectionType"] == "ALL":
+        return []
+    projected = {"ts_bucket", "event_id", "pending_bucket", "from_date"} | set(projection.get("NonKeyAttributes", []))
+    return [f for f in db.UPCOMING_EVENT_FIELDS if f not in projected]
+
+# ----- PENDING INDEX PROJECTION -----
+# the pending index was first created with only the fields read at the time (INCLUDE projection):
+# querying it for rule_id and user_timezone fails. A projection can't be changed in place, so the index
+# is deleted and created again with all attributes. Pending events keep their pending_bucket and are
+# indexed again by dynamodb. check_reminders fails until the new index is ACTIVE, then the events
+# watermark catches up on the missed buckets (up to a day): run it before deploying the code that reads rules.
+def recreate_pending_index(client, poll=15):
+    index = pending_index(client)
+    if index and not missing_projection(index):
+        print(f"recreate_pending_index: {db.PENDING_INDEX} projects every field.")
+        return
+    if index:
+        client.update_table(
+            TableName=db.EVENTS_TABLE,
+            GlobalSecondaryIndexUpdates=[{"Delete": {"IndexName": db.PENDING_INDEX}}],
+        )
+        print(f"recreate_pending_index: deleting {db.PENDING_INDEX}...")
+        while pending_index(client) is not None:
+            time.sleep(poll)
+    create_pending_index(client)
+
+# ----- MESSAGES TABLE -----
+# copies the `conversation` list of every user item to RemindersMessages, then removes it from the user item.
+# deploy the code that reads RemindersMessages before running it.
+def split_conversations(client):
+    params = {
+        "TableName": db.USERS_TABLE,
+        "FilterExpression": "attribute_exists(conversation)",
+        "ProjectionExpression": "wa_id",
+    }
+    migrated = 0
+    for item in scan(client, params):
+        wa_id = item["wa_id"]["S"]
+        resp = client.get_item(
+            TableName=db.USERS_TABLE,
+            Key={"wa_id": {"S": wa_id}},
+            ProjectionExpression="conversation",
+            ConsistentRead=True,
+        )
+        conversation = resp.get("Item", {}).get("conversation", {}).get("L", [])
+        requests = []
+        for i, msg in enumerate(conversation):
+            m = msg.get("M", {})
+            timestamp = int(float(m.get("timestamp", {}).get("N", "0") or "0"))
+            # deterministic key so that re-running the migration overwrites instead of duplicating.
+            m = dict(m, wa_id={"S": wa_id}, msg_key={"S": db.message_key(timestamp, f"legacy#{i:06d}")})
+            requests.append({"PutRequest": {"Item": m}})
+        err = db.batch_write(client, db.MESSAGES_TABLE, requests)
+        if err:
+            print(f"split_conversations: could not copy conversation of {wa_id}: {err}")
+            continue
+        client.update_item(
+            TableName=db.USERS_TABLE,
+            Key={"wa_id": {"S": wa_id}},
+            UpdateExpression="REMOVE conversation",
+        )
+        migrated += 1
+    print(f"split_conversations: migrated {migrated} users.")
+
+# ----- STATS COUNTERS -----
+# sets stats.chat_messages and stats.creation_ts from RemindersMessages, once per user.
+# run after `messages_table`. Messages received while a user is being backfilled may be missed.
+def backfill_stats(client):
+    params = {
+        "TableName": db.USERS_TABLE,
+        "FilterExpression": "attribute_not_exists(stats.backfilled)",
+        "ProjectionExpression": "wa_id, stats.creation_ts",
+    }
+    backfilled = 0
+    for item in scan(client, params):
+        wa_id = item["wa_id"]["S"]
+        chat_messages, err = db.count_messages(client, wa_id, exclude_types=db.NON_CHAT_MESSAGE_TYPES)
+        if err:
+            print(f"backfill_stats: could not count messages of {wa_id}: {err}")
+            continue
+        # the count includes messages received since the deploy, so it replaces the live counter.
+        update_expression = "SET stats.chat_messages = :c, stats.backfilled = :t"
+        values = {":c": {"N": str(chat_messages)}, ":t": {"BOOL": True}}
+        creation_ts = int(item.get("stats", {}).get("M", {}).get("creation_ts", {}).get("N", "0"))
+        if creation_ts == 0:
+            creation_ts = first_user_message_ts(client, wa_id)
+            if creation_ts:
+                update_expression += ", stats.creation_ts = :ts"
+                values[":ts"] = {"N": str(creation_ts)}
+        err = db.update_user_stats(client, wa_id, update_expression, values)
+        if err:
+            print(f"backfill_stats: could not update stats of {wa_id}: {err}")
+            continue
+        backfilled += 1
+    print(f"backfill_stats: backfilled {backfilled} users.")
+
+def first_user_message_ts(client, wa_id):
+    params = {
+        "TableName": db.MESSAGES_TABLE,
+        "KeyConditionExpression": "wa_id = :w",
+        "FilterExpression": "#r = :u",
+        "ProjectionExpression": "#ts",
+        "ExpressionAttributeNames": {"#r": "role", "#ts": "timestamp"},
+        "ExpressionAttributeValues": {":w": {"S": wa_id}, ":u": {"S": "user"}},
+    }
+    while True:
+        response = client.query(**params)
+        for item in response["Items"]:
+            return int(item["timestamp"]["N"])
+        if "LastEvaluatedKey" not in response:
+            return 0
+        params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+# ----- COMPLETION CACHE -----
+# creates the completion cache table, with dynamodb TTL on `expires_ts` (see chat.get_openai_completion).
+def create_completion_cache_table(client):
+    if db.COMPLETION_CACHE_TABLE in client.list_tables()["TableNames"]:
+        print(f"create_completion_cache_table: {db.COMPLETION_CACHE_TABLE} already exists.")
+    else:
+        client.create_table(
+            TableName=db.COMPLETION_CACHE_TABLE,
+            KeySchema=[{"AttributeName": "key", "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": "key", "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        client.get_waiter("table_exists").wait(TableName=db.COMPLETION_CACHE_TABLE)
+    enable_ttl(client, db.COMPLETION_CACHE_TABLE, "expires_ts")
+
+def enable_ttl(client, table, attribute):
+    ttl = client.describe_time_to_live(TableName=table)["TimeToLiveDescription"]
+    if ttl["TimeToLiveStatus"] in ("ENABLED", "ENABLING"):
+        print(f"enable_ttl: TTL already enabled on {table}.")
+        return
+    client.update_time_to_live(
+        TableName=table,
+        TimeToLiveSpecification={"Enabled": True, "AttributeName": attribute},
+    )
+    print(f"enable_ttl: enabled TTL on {table}.{attribute}.")
+
+# ----- RECURRENCE RULES -----
+# creates the rules table of recurring reminders, and enables dynamodb TTL on the events table
+# so that sent occurrences expire (see recurrence.py).
+def create_rules_table(client):
+    if db.RULES_TABLE in client.list_tables()["TableNames"]:
+        print(f"create_rules_table: {db.RULES_TABLE} already exists.")
+    else:
+        client.create_table(
+            TableName=db.RULES_TABLE,
+            KeySchema=[{"AttributeName": "rule_id", "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": "rule_id", "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        client.get_waiter("table_exists").wait(TableName=db.RULES_TABLE)
+    enable_ttl(client, db.EVENTS_TABLE, "expires_ts")
+
+# ----- USER EVENTS INDEX -----
+# moves the `events_v2` list of every user item to the `events_by_id` map (see db.put_user_event).
+# deploy the code that reads events_by_id before running it. The map is only replaced if no reminder
+# was added or removed since it was read, otherwise the user is read again.
+def index_user_events(client):
+    params = {
+        "TableName": db.USERS_TABLE,
+        "FilterExpression": "attribute_exists(events_v2)",
+        "ProjectionExpression": "wa_id",
+    }
+    migrated = 0
+    for item in scan(client, params):
+        wa_id = item["wa_id"]["S"]
+        for _ in range(3):
+            resp = client.get_item(
+                TableName=db.USERS_TABLE,
+                Key={"wa_id": {"S": wa_id}},
+                ProjectionExpression="events_v2, events_by_id",
+                ConsistentRead=True,
+            )
+            events = resp.get("Item", {}).get("events_v2", {}).get("L", [])
+            events_by_id = resp.get("Item", {}).get("events_by_id", {}).get("M", {})
+            indexed = {e["M"]["event_id"]["S"]: e for e in events if "event_id" in e.get("M", {})}
+            indexed.update(events_by_id)
+            try:
+                client.update_item(
+                    TableName=db.USERS_TABLE,
+                    Key={"wa_id": {"S": wa_id}},
+                    UpdateExpression="SET events_by_id = :m REMOVE events_v2",
+                    ConditionExpression="size(events_v2) = :n AND (attribute_not_exists(events_by_id) OR size(events_by_id) = :k)",
+                    ExpressionAttributeValues={
+                        ":m": {"M": indexed},
+                        ":n": {"N": str(len(events))},
+                        ":k": {"N": str(len(events_by_id))},
+                    },
+                )
+                migrated += 1
+                break
+            except client.exceptions.ConditionalCheckFailedException:
+                continue
+        else:
+            print(f"index_user_events: could not migrate {wa_id}, run the migration again.")
+    print(f"index_user_events: migrated {migrated} users.")
+
+def scan(client, params):
+    params = dict(params)
+    while True:
+        response = client.scan(**params)
+        for item in response["Items"]:
+            yield item
+        if "LastEvaluatedKey" not in response:
+            return
+        params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+MIGRATIONS = {
+    "pending_index": add_pending_index,
+    "pending_index_projection": recreate_pending_index,
+    "messages_table": split_conversations,
+    "stats_counters": backfill_stats,
+    "completion_cache": create_completion_cache_table,
+    "recurrence_rules": create_rules_table,
+    "user_events_index": index_user_events,
+}
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] not in MIGRATIONS:
+        print(f"usage: python -m reminders.migrations <{'|'.join(MIGRATIONS.keys())}>")
+        sys.exit(1)
+    MIGRATIONS[sys.argv[1]](db.get_client())
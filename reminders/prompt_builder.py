@@ -0,0 +1,76 @@
+import reminders.metrics as metrics
+
+# counts tokens locally and trims the conversation so that prompts fit a token budget.
+# tiktoken is optional: without it, tokens are estimated from the number of characters.
+
+CONTEXT_LIMIT = 4096  # gpt-3.5-turbo.
+COMPLETION_TOKENS = 500  # max_tokens of chat.get_openai_completion.
+# budget of the conversation sent with each prompt: the stages add their own instructions on top of it.
+HIST_BUDGET = 2500
+# a single message longer than this is cut (e.g. a long text pasted by the user).
+MESSAGE_BUDGET = 400
+CHARS_PER_TOKEN = 4
+# per message overhead of the chat format (role, separators), and priming of the reply.
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+ENCODING = "cl100k_base"
+
+_encoding = None
+
+def get_encoding():
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(ENCODING)
+        except Exception:
+            # tiktoken is not installed, or can't download its encoding files.
+            _encoding = False
+    return _encoding
+
+def count_tokens(text):
+    encoding = get_encoding()
+    if encoding:
+        return len(encoding.encode(text))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def count_message_tokens(messages):
+    return TOKENS_PER_REPLY + sum(TOKENS_PER_MESSAGE + count_tokens(m["content"]) for m in messages)
+
+# truncate cuts `text` to about `budget` tokens.
+def truncate(text, budget):
+    if count_tokens(text) <= budget:
+        return text
+    encoding = get_encoding()
+    if encoding:
+        return encoding.decode(encoding.encode(text)[:budget]) + "..."
+    return text[:budget * CHARS_PER_TOKEN] + "..."
+
+# fit returns the messages without the oldest conversation turns, so that they fit in `budget` tokens.
+# system messages and the last `keep_last` messages are kept as is. Older messages are cut to MESSAGE_BUDGET.
+# messages are dicts with at least "role" and "content"; other keys are kept.
+def fit(messages, budget, keep_last=1):
+    n_old = max(0, len(messages) - keep_last)
+    messages = [
+        dict(m, content=truncate(m["content"], MESSAGE_BUDGET)) if i < n_old and m["role"] != "system" else m
+        for i, m in enumerate(messages)
+    ]
+    total = count_message_tokens(messages)
+    kept = [True] * len(messages)
+    # drop the oldest messages first.
+    for i in range(n_old):
+        if total <= budget:
+            break
+        if messages[i]["role"] == "system":
+            continue
+        kept[i] = False
+        total -= TOKENS_PER_MESSAGE + count_tokens(messages[i]["content"])
+    dropped = kept.count(False)
+    if dropped:
+        metrics.incr("prompt.dropped_messages", dropped)
+    return [m for m, k in zip(messages, kept) if k]
+
+# record_usage adds the tokens used by a completion to the metrics of its stage.
+def record_usage(stage, prompt_tokens, completion_tokens):
+    metrics.incr(f"tokens.{stage}.prompt", prompt_tokens)
+    metrics.incr(f"tokens.{stage}.completion", completion_tokens)
@@ -0,0 +1,247 @@
+import calendar
+import datetime
+import itertools
+import re
+
+import reminders.dynamodb as db
+import reminders.utils as utils
+
+# a recurring reminder is stored as one rule (db.RULES_TABLE) and only its next LOOKAHEAD occurrences
+# are written to the events table, each with the rule_id.
+# when an occurrence fires, roll_forward writes the next ones: the number of items of a reminder stays
+# the same whatever its frequency and end date. Sent occurrences expire with dynamodb TTL (expires_ts).
+# frequencies that `parse` doesn't understand are stored as a single event, rescheduled when it fires
+# by reschedule.reschedule_reminder_v2.
+#
+# occurrences are computed from the first date of the reminder (the anchor), never from the previous
+# occurrence: the k-th occurrence is anchor + k * interval, or k * n months later for months and years.
+# monthly reminders on the 31st fall on the last day of shorter months, and don't drift to the 28th.
+# dates are computed in UTC.
+
+LOOKAHEAD = 3  # occurrences written ahead: a failed roll forward doesn't stop the reminder.
+FIRED_RETENTION = 7 * 24 * 60 * 60  # in seconds. Occurrences are deleted this long after they are due.
+
+FREQUENCY_RE = re.compile(r"^every\s?(\d*)\s(minutes?|hours?|days?|weeks?|months?|years?)$")
+UNIT_SECONDS = {"minute": 60, "hour": 60 * 60, "day": 24 * 60 * 60, "week": 7 * 24 * 60 * 60}
+UNIT_MONTHS = {"month": 1, "year": 12}
+MIN_INTERVAL = 5 * 60  # in seconds. More frequent reminders are not rescheduled.
+
+def normalize(frequency):
+    return frequency.lower().strip()
+
+# parse returns the interval of `frequency` as (seconds, months), exactly one of them not 0, error.
+def parse(frequency):
+    m = FREQUENCY_RE.match(normalize(frequency))
+    if not m:
+        return (0, 0), f"could not parse frequency: {frequency}"
+    value_, unit = m.groups()
+    value = int(value_) if value_ else 1
+    if value < 1:
+        return (0, 0), f"could not parse value: {value_}"
+    unit = unit.rstrip("s")
+    if unit in UNIT_MONTHS:
+        return (0, value * UNIT_MONTHS[unit]), None
+    seconds = value * UNIT_SECONDS[unit]
+    if seconds < MIN_INTERVAL:
+        return (0, 0), "too_frequent"
+    return (seconds, 0), None
+
+def is_recurring(frequency):
+    _, err = parse(frequency)
+    return not err
+
+# add_months returns the timestamp `months` months after `ts`, on the same day or the last day of the month.
+def add_months(ts, months):
+    dt = datetime.datetime.fromtimestamp(ts, datetime.timezone.utc)
+    year, month = divmod(dt.year * 12 + dt.month - 1 + months, 12)
+    day = min(dt.day, calendar.monthrange(year, month + 1)[1])
+    return int(dt.replace(year=year, month=month + 1, day=day).timestamp())
+
+# occurrences returns the dates of the occurrences of a reminder anchored at `from_ts`, after `after_ts`
+# (default: from_ts) and until `to_ts` included (-1: no end date), as an iterator of timestamps, error.
+# fixed intervals are a range (or an infinite count): nothing is computed before it is iterated.
+def occurrences(frequency, from_ts, after_ts=None, to_ts=-1):
+    (seconds, months), err = parse(frequency)
+    if err:
+        return iter(()), err
+    from_ts = int(from_ts)
+    after_ts = from_ts if after_ts is None else max(int(after_ts), from_ts)
+    to_ts = int(to_ts)
+
+    if seconds:
+        first = from_ts + ((after_ts - from_ts) // seconds + 1) * seconds
+        if to_ts == -1:
+            return itertools.count(first, seconds), None
+        return iter(range(first, to_ts + 1, seconds)), None
+    return month_occurrences(months, from_ts, after_ts, to_ts), None
+
+def month_occurrences(months, from_ts, after_ts, to_ts):
+    anchor = datetime.datetime.fromtimestamp(from_ts, datetime.timezone.utc)
+    after = datetime.datetime.fromtimestamp(after_ts, datetime.timezone.utc)
+    # first k such that the k-th occurrence is after `after_ts`: at most one step past the month difference.
+    k = max(1, ((after.year - anchor.year) * 12 + after.month - anchor.month) // months)
+    while True:
+        ts = add_months(from_ts, k * months)
+        if ts > after_ts:
+            if to_ts != -1 and ts > to_ts:
+                return
+            yield ts
+        k += 1
+
+# next_occurrences returns the dates of up to `n` occurrences after `after_ts`, until `to_date` (-1: no end date),
+# of the reminder starting at `from_date`.
+def next_occurrences(frequency, from_date, after_ts, to_date, n):
+    dates, err = occurrences(frequency, from_date, after_ts=after_ts, to_ts=to_date)
+    if err:
+        return [], err
+    return list(itertools.islice(dates, n)), None
+
+# returns the event of the rule's occurrence at `ts`, in the format of db.create_events_v2_batch.
+def occurrence(rule, ts, tz):
+    return {
+        "ts_bucket": db.get_ts_bucket(ts),
+        "event_id": db.get_event_id_v2(
+            wa_id=rule["wa_id"],
+            event_name=rule["event_name"],
+            from_date=ts,
+            to_date=rule["to_date"],
+            frequency=rule["frequency"],
+        ),
+        "event_name": rule["event_name"],
+        "from_date": ts,
+        "from_date_str": utils.utc_to_usr_local_str(ts, tz=tz),
+        "to_date": rule["to_date"],
+        "to_date_str": rule["to_date_str"],
+        "frequency": rule["frequency"],
+        "reschedule": False,
+        "rule_id": rule["rule_id"],
+        "expires_ts": ts + FIRED_RETENTION,
+        "user_timezone": tz,
+    }
+
+def occurrence_key(event):
+    return {"ts_bucket": event["ts_bucket"], "event_id": event["event_id"], "from_date": event["from_date"]}
+
+# create writes a new reminder: a rule and its first occurrences if it is recurring, a single event otherwise.
+# the first occurrence has the reminder's event_id and ts_bucket, and the rule_id is the reminder's event_id.
+# returns error.
+def create(client, wa_id, event_id, ts_bucket, event_name, from_date, from_date_str, to_date, to_date_str, frequency, tz):
+    if not is_recurring(frequency):
+        return db.create_event_v2(
+            client=client,
+            wa_id=wa_id,
+            ts_bucket=ts_bucket,
+            event_id=event_id,
+            event_name=event_name,
+            from_date=from_date,
+            from_date_str=from_date_str,
+            to_date=to_date,
+            to_date_str=to_date_str,
+            frequency=frequency,
+            reschedule=True,
+            user_timezone=tz,
+        )
+
+    rule = {
+        "rule_id": event_id,
+        "wa_id": wa_id,
+        "event_name": event_name,
+        "frequency": frequency,
+        "from_date": int(from_date),
+        "to_date": int(to_date),
+        "to_date_str": to_date_str,
+    }
+    first = occurrence(rule, rule["from_date"], tz)
+    first.update(event_id=event_id, ts_bucket=ts_bucket, from_date_str=from_date_str)
+    dates, err = next_occurrences(frequency, rule["from_date"], rule["from_date"], rule["to_date"], LOOKAHEAD - 1)
+    if err:
+        return err
+    events = [first] + [occurrence(rule, ts, tz) for ts in dates]
+    rule["cursor"] = events[-1]["from_date"]
+    rule["occurrences"] = [occurrence_key(e) for e in events]
+
+    # the rule is written first: an occurrence without its rule would not roll forward.
+    err = db.put_rule(client, rule)
+    if err:
+        return err
+    return db.create_events_v2_batch(client, wa_id=wa_id, events=events)
+
+# roll_forward runs when an occurrence of a rule fires: it writes the occurrences that keep
+# LOOKAHEAD of them pending, and deletes the rule after its last occurrence.
+# the user's entry of the reminder (see db.put_user_event) moves to the next occurrence: it is how
+# the reminder is listed, updated and deleted once its first date is past.
+# like reschedule.reschedule_reminder_v2, returns an error message for the user.
+def roll_forward(client, event):
+    rule_id = event["rule_id"]
+    rule, err = db.get_rule(client, rule_id)
+    if err:
+        print(f"roll_forward: could not get rule {rule_id}: {err}")
+        return
+    if not rule:
+        # the reminder was deleted.
+        return
+
+    fired_ts = int(event["from_date"])
+    pending = [o for o in rule["occurrences"] if o["from_date"] > fired_ts]
+    dates, err = next_occurrences(rule["frequency"], rule["from_date"], rule["cursor"], rule["to_date"], LOOKAHEAD - len(pending))
+    if err:
+        print(f"roll_forward: rule {rule_id}: {err}")
+        return
+    if not dates and not pending:
+        err = db.delete_rule(client, rule_id)
+        if err:
+            print(f"roll_forward: could not delete rule {rule_id}: {err}")
+        return
+
+    tz = user_timezone(client, rule["wa_id"], event)
+    events = []
+    if dates:
+        events = [occurrence(rule, ts, tz) for ts in dates]
+        # occurrences are written before the cursor moves: if two invocations roll the same rule,
+        # they write the same items and only one of them moves the cursor.
+        err = db.create_events_v2_batch(client, wa_id=rule["wa_id"], events=events)
+        if err:
+            print(f"roll_forward: could not write occurrences of rule {rule_id}: {err}")
+            return "I ran into an issue while trying to reschedule this reminder..."
+
+    cursor = dates[-1] if dates else rule["cursor"]
+    occurrences = pending + [occurrence_key(e) for e in events]
+    err = db.advance_rule(client, rule_id, rule["cursor"], cursor, occurrences)
+    if err == "conflict":
+        # another invocation rolled the rule forward, and refreshed the user's entry.
+        return
+    if err:
+        print(f"roll_forward: could not advance rule {rule_id}: {err}")
+
+    next_ts = min(o["from_date"] for o in occurrences)
+    err = db.put_user_event(client, rule["wa_id"], db.user_event(
+        event_id=rule_id,
+        ts_bucket=db.get_ts_bucket(rule["from_date"]),
+        event_name=rule["event_name"],
+        from_date=next_ts,
+        from_date_str=utils.utc_to_usr_local_str(next_ts, tz=tz),
+        to_date=rule["to_date"],
+        to_date_str=rule["to_date_str"],
+        frequency=rule["frequency"],
+    ))
+    if err:
+        print(f"roll_forward: could not update the user's entry of rule {rule_id}: {err}")
+
+# user_timezone returns the current timezone of the user (see db.get_user_settings),
+# or the one written on `event` if it can't be read.
+def user_timezone(client, wa_id, event):
+    settings, err = db.get_user_settings(client, wa_id)
+    if err:
+        print(f"user_timezone: could not get settings of {wa_id}: {err}")
+    return settings.get("user_timezone", "") or event.get("user_timezone", "") or "UTC"
+
+# delete removes the rule `rule_id` and its pending occurrences. Does nothing if there is no such rule.
+# returns error.
+def delete(client, rule_id):
+    rule, err = db.get_rule(client, rule_id)
+    if err or not rule:
+        return err
+    err = db.delete_rule(client, rule_id)
+    if err:
+        return err
+    return db.delete_events(client, rule["occurrences"])
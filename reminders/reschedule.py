@@ -1,9 +1,7 @@
-import re
-import datetime
-
 import reminders.chat as chat
 import reminders.dynamodb as db
 import reminders.prompts_v2 as prompts_v2
+import reminders.recurrence as recurrence
 import reminders.utils as utils
 
 # writes new reminder to dynamodb and returns an error message to be sent to the user.
@@ -12,11 +10,7 @@ def reschedule_reminder_v2(client, event):
         return
     
     wa_id = event["wa_id"]
-    user, err = db.get_user(client, wa_id)
-    if err or not user.get("user_timezone"):
-        tz = "UTC"
-    else:
-        tz = user["user_timezone"]
+    tz = recurrence.user_timezone(client, wa_id, event)
 
     frequency = event["frequency"].lower().strip()
     curr_ts = int(event["from_date"])
@@ -60,6 +54,7 @@ def reschedule_reminder_v2(client, event):
         to_date=event["to_date"],
         to_date_str=event["to_date_str"],
         frequency=event["frequency"],
+        user_timezone=tz,
     )
     if err:
         return "I ran into an issue while trying to reschedule this reminder..."
@@ -70,7 +65,7 @@ def next_timestamp_from_language_model(frequency, from_date, tz):
     from_date = utils.utc_to_usr_local_str(from_date, tz)
 
     msg = prompts_v2.GET_NEXT_DATE.format(date=from_date, frequency=frequency, time_format=utils.TIME_FORMAT)
-    out = chat.get_openai_completion([{"role": "system", "content": msg}])
+    out = chat.get_openai_completion([{"role": "system", "content": msg}], cache=True, stage="next_date")
 
     if not out:
         return -1, "empty OpenAI response"
@@ -90,17 +85,14 @@ def next_timestamp_from_language_model(frequency, from_date, tz):
     except Exception as _:
         return -1, f"could not parse date: {next_date}"
 
+# returns every date after `from_date_ts` until `to_date_ts` included, error.
 def get_future_dates_from_regex(frequency, from_date_ts, to_date_ts):
-    curr_ts = from_date_ts
-    next_ts = -1
-    future_ts = []
-    # todo: can this grow out of hand?
-    while next_ts < to_date_ts:
-        next_ts, err = next_timestamp_from_regex(frequency=frequency, from_date_ts=from_date_ts)
-        if err:
-            return [], err
-        future_ts.append(next_ts)
-    return future_ts, None
+    if to_date_ts == -1:
+        return [], "no end date"
+    dates, err = recurrence.occurrences(frequency, from_date_ts, to_ts=to_date_ts)
+    if err:
+        return [], err
+    return list(dates), None
 
 # return next date as a timestamp, error
 def next_timestamp_from_regex(frequency, from_date_ts):
@@ -112,79 +104,12 @@ def next_timestamp_from_regex(frequency, from_date_ts):
     next_date_ts = future_dates[0]
     return next_date_ts, None
 
-# future_dates_from_regex returns a list of future dates as timestamps.
+# future_dates_from_regex returns a list of future dates as timestamps (see recurrence.occurrences).
 # if to_date_ts == -1, it just returns the next date (wrapped in a list).
 def future_dates_from_regex(frequency, from_date_ts, to_date_ts=-1):
-    m = re.match(r'^every\s?(\d*)\s(minutes?|hours?|days?|weeks?|months?|years?)$', frequency)
-
-    if not m:
-        return None, f"could not parse frequency: {frequency}"
-
-    value_, unit = m.groups()
-    value = 1
-    if value_:
-        try:
-            value = int(value_)
-        except Exception as _:
-            return None, f"could not parse value: {value_}"
-
-    if value < 5 and unit == "minutes":
-        return None, "too_frequent"
-    
-    from_date = utils.from_timestamp(from_date_ts, "UTC")
-    to_date = utils.from_timestamp(to_date_ts, "UTC")
-    
-    if (unit == "minutes") or (unit == "minute"):
-        delta = datetime.timedelta(minutes=value)
-        if to_date_ts == -1:
-            next_date = from_date + delta
-            return [int(next_date.timestamp())], None
-        intervals = (to_date_ts - from_date_ts) // (value * 60)
-        all_dates = [from_date + i*delta for i in range(1, intervals)]
-        # convert to timestamps
-        return [int(d.timestamp()) for d in all_dates], None
-    elif (unit == "hours") or (unit == "hour"):
-        delta = datetime.timedelta(hours=value)
-        if to_date_ts == -1:
-            next_date = from_date + delta
-            return [int(next_date.timestamp())], None
-        intervals = (to_date_ts - from_date_ts) // (value * 60 * 60)
-        all_dates = [from_date + i*delta for i in range(1, intervals)]
-        return [int(d.timestamp()) for d in all_dates], None
-    elif (unit == "days") or (unit == "day"):
-        delta = datetime.timedelta(days=value)
-        if to_date_ts == -1:
-            next_date = from_date + delta
-            return [int(next_date.timestamp())], None
-        intervals = (to_date_ts - from_date_ts) // (value * 60 * 60 * 24)
-        all_dates = [from_date + i*delta for i in range(1, intervals)]
-        return [int(d.timestamp()) for d in all_dates], None
-    elif (unit == "weeks") or (unit == "week"):
-        delta = datetime.timedelta(weeks=value)
-        if to_date_ts == -1:
-            next_date = from_date + delta
-            return [int(next_date.timestamp())], None
-        intervals = (to_date_ts - from_date_ts) // (value * 60 * 60 * 24 * 7)
-        all_dates = [from_date + i*delta for i in range(1, intervals)]
-        return [int(d.timestamp()) for d in all_dates], None
-    elif (unit == "months") or (unit == "month"):
-        # here we have to replace the month value because not all months have the same number 
-        # of days.
-        if to_date_ts == -1:
-            next_date = from_date.replace(month=(from_date.month + value - 1)%12 + 1)
-            return [int(next_date.timestamp())], None
-        all_dates = []
-        next_date = from_date
-        while next_date < to_date:
-            next_date = next_date.replace(month=(next_date.month + value - 1)%12 + 1)
-            all_dates.append(next_date)
-        return [int(d.timestamp()) for d in all_dates], None
-    elif (unit == "years") or (unit == "year"):
-        if to_date_ts == -1:
-            next_date = from_date.replace(year=from_date.year + value)
-            return [int(next_date.timestamp())], None
-        all_dates = [from_date.replace(year=year) for year in range(from_date.year + value, to_date.year, value)]
-        return [int(d.timestamp()) for d in all_dates]
-    
-    # should not reach here
-    return [], f"unknown unit: {unit}"
+    dates, err = recurrence.occurrences(frequency, from_date_ts, to_ts=to_date_ts)
+    if err:
+        return None, err
+    if to_date_ts == -1:
+        return [next(dates)], None
+    return list(dates), None
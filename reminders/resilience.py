@@ -0,0 +1,109 @@
+import contextvars
+import email.utils
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# building blocks to call an upstream API (openai) without piling up latency during an outage:
+# - a deadline: the time budget of the user request, shared by all the calls it makes.
+# - backoff with full jitter, or the delay the server asks for with Retry-After.
+# - a circuit breaker: after repeated failures, calls fail fast until the upstream recovers.
+
+REQUEST_BUDGET = 40  # in seconds. Time budget of the LLM calls made for one whatsapp message.
+
+# the deadline is a context variable: it follows the request into the threads that copy its context
+# (see chat.submit_completion).
+_deadline = contextvars.ContextVar("deadline", default=0)
+
+# deadline sets the time budget of the calls made inside the block.
+# nested deadlines can only shorten the budget.
+@contextmanager
+def deadline(seconds, clock=time.monotonic):
+    ts = clock() + seconds
+    current = _deadline.get()
+    token = _deadline.set(min(ts, current) if current else ts)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+# remaining returns the seconds left before the deadline, or `default` if there is no deadline.
+def remaining(default, clock=time.monotonic):
+    ts = _deadline.get()
+    if not ts:
+        return default
+    return max(0, ts - clock())
+
+# exponential backoff with full jitter.
+def backoff(attempt, base, cap):
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+# retry_after returns the delay in seconds asked by the server, or -1 if there is none.
+# supports `retry-after-ms` (openai), and `Retry-After` in seconds or as an HTTP date.
+def retry_after(headers, now_ts=None):
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(0, float(value) / 1000)
+        except ValueError:
+            pass
+    value = headers.get("Retry-After")
+    if not value:
+        return -1
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+    try:
+        dt = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return -1
+    if now_ts is None:
+        now_ts = time.time()
+    return max(0, dt.timestamp() - now_ts)
+
+
+# CircuitBreaker opens after `failure_threshold` consecutive failures and rejects calls for `reset_timeout`
+# seconds. Then it lets a single trial call through (half open): it closes on success and opens again on failure.
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_ts = 0
+        self.trial_running = False
+
+    # allow returns True if the call can go through.
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and self.clock() - self.opened_ts >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self.trial_running = False
+            if self.state == self.HALF_OPEN and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_ts = self.clock()
+                self.trial_running = False
@@ -0,0 +1,144 @@
+import json
+import os
+
+import reminders.connections as connections
+import reminders.dynamodb as db
+import reminders.utils as utils
+
+# this file keeps a single one-time EventBridge Scheduler schedule armed for the earliest
+# pending reminder, instead of polling RemindersEvents every 5 minutes.
+# the schedule invokes the lambda with {"message": "check_for_reminders"} (see lambda_function.py).
+
+SCHEDULE_NAME = "mindy-check-reminders"
+SCHEDULE_FORMAT = "YYYY-MM-DDTHH:mm:ss"
+CHECK_PAYLOAD = {"message": "check_for_reminders"}
+
+# EventBridge Scheduler fires at minute granularity, so we arm at the start of the minute
+# and check_reminders sleeps the remaining seconds before sending.
+FIRE_WINDOW = 60  # in seconds.
+# if nothing is pending within the lookahead, we still wake up once per heartbeat.
+# new reminders re-arm the schedule when they are created (see arm_if_earlier).
+HEARTBEAT = 60 * 60  # in seconds.
+# if the pending reminders can't be read, we try again after one bucket window.
+RETRY = db.BUCKET_WINDOW * 60  # in seconds.
+LOOKAHEAD_BUCKETS = HEARTBEAT // (db.BUCKET_WINDOW * 60) + 1
+
+
+# EventBridgeBackend arms the real EventBridge Scheduler schedule.
+class EventBridgeBackend:
+    def __init__(self, client=None, name=SCHEDULE_NAME):
+        self.client = client or connections.get_client("scheduler")
+        self.name = name
+
+    # returns the armed timestamp or -1 if the schedule does not exist.
+    def get(self):
+        try:
+            resp = self.client.get_schedule(Name=self.name)
+        except self.client.exceptions.ResourceNotFoundException:
+            return -1
+        expr = resp.get("ScheduleExpression", "")
+        if not expr.startswith("at("):
+            return -1
+        return utils.usr_local_str_to_utc(expr[len("at("):-1], "UTC", fmt=SCHEDULE_FORMAT)
+
+    def arm(self, ts):
+        params = {
+            "Name": self.name,
+            "ScheduleExpression": f"at({utils.utc_to_usr_local_str(ts, 'UTC', fmt=SCHEDULE_FORMAT)})",
+            "ScheduleExpressionTimezone": "UTC",
+            "FlexibleTimeWindow": {"Mode": "OFF"},
+            "Target": {
+                "Arn": os.environ["REMINDERS_LAMBDA_ARN"],
+                "RoleArn": os.environ["SCHEDULER_ROLE_ARN"],
+                "Input": json.dumps(CHECK_PAYLOAD),
+            },
+        }
+        try:
+            self.client.update_schedule(**params)
+        except self.client.exceptions.ResourceNotFoundException:
+            self.client.create_schedule(**params)
+
+
+# FakeBackend is an in-process stand-in for EventBridge Scheduler, used in tests.
+# `fire` runs the handler if the schedule is due, like EventBridge would.
+class FakeBackend:
+    def __init__(self):
+        self.armed_ts = -1
+        self.history = []
+
+    def get(self):
+        return self.armed_ts
+
+    def arm(self, ts):
+        self.armed_ts = ts
+        self.history.append(ts)
+
+    def fire(self, handler, now_ts):
+        if self.armed_ts == -1 or self.armed_ts > now_ts:
+            return False
+        self.armed_ts = -1
+        handler()
+        return True
+
+
+_backend = None
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = EventBridgeBackend()
+    return _backend
+
+def set_backend(backend):
+    global _backend
+    _backend = backend
+
+# returns the earliest from_date of pending events in the lookahead, or -1 if there is none, and error.
+def next_fire_ts(client, now_ts):
+    first_bucket = db.get_ts_bucket(now_ts)
+    for i in range(LOOKAHEAD_BUCKETS):
+        ts_bucket = first_bucket + i * db.BUCKET_WINDOW * 60
+        from_date, err = db.get_next_pending_from_date(client, ts_bucket)
+        if err:
+            print(f"next_fire_ts error for ts_bucket={ts_bucket}: {err}")
+            return -1, err
+        if from_date != -1:
+            return from_date, None
+    return -1, None
+
+def arm(ts, now_ts):
+    # schedules can't be armed in the past.
+    ts = max(ts, now_ts + FIRE_WINDOW)
+    ts = ts - ts % FIRE_WINDOW
+    try:
+        get_backend().arm(ts)
+    except Exception as e:
+        print(f"scheduler.arm error: {e}")
+        return e
+    return None
+
+# rearm computes the next pending reminder and arms the schedule for it.
+def rearm(client, now_ts=None):
+    if now_ts is None:
+        now_ts = utils.utc_now_ts()
+    ts, err = next_fire_ts(client, now_ts)
+    # a reminder may be due before the heartbeat.
+    if err:
+        ts = now_ts + RETRY
+    elif ts == -1:
+        ts = now_ts + HEARTBEAT
+    return arm(ts, now_ts)
+
+# arm_if_earlier is called when a reminder is created so that it does not wait for the heartbeat.
+def arm_if_earlier(ts, now_ts=None):
+    if now_ts is None:
+        now_ts = utils.utc_now_ts()
+    try:
+        armed_ts = get_backend().get()
+    except Exception as e:
+        print(f"scheduler.get error: {e}")
+        armed_ts = -1
+    # a schedule armed in the past already fired and will not fire again.
+    if armed_ts >= now_ts and armed_ts <= ts:
+        return None
+    return arm(ts, now_ts)
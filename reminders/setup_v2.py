@@ -31,7 +31,7 @@ def run(msg, user, timestamp, client):
         hist.append({"role": m["role"], "content": m["text"], "type": m.get("type", ""), "exclude": True})
 
     hist.append({"role": "user", "content": msg, "type": "setup", "timestamp": timestamp})
-    out = chat.get_openai_completion([{"role": msg["role"], "content": msg["content"]} for msg in hist])
+    out = chat.get_openai_completion([{"role": msg["role"], "content": msg["content"]} for msg in hist], stage="setup")
 
     if not out:
         return wa.send("Sorry there was an error 😔 let's try again later", user=user, client=client, hist=hist, type_="error")
@@ -0,0 +1,88 @@
+import sys
+import os
+reminders_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+sys.path.append(reminders_dir)
+import reminders.cache as cache
+import reminders.chat as chat
+import reminders.dynamodb as db
+import reminders.metrics as metrics
+
+# to run tests: python reminders/unit_tests/cache_tests.py
+
+def test_lru_cache():
+    passed = True
+    now = [0]
+    c = cache.LRUCache(maxsize=2, ttl=10, clock=lambda: now[0])
+    c.set("a", 1)
+    c.set("b", 2)
+    c.get("a")  # "a" is now the most recently used.
+    c.set("c", 3)
+    if c.get("b") != (None, False) or c.get("a") != (1, True) or c.get("c") != (3, True):
+        passed = False
+        print("Failed lru_cache: the least recently used entry must be evicted")
+    now[0] = 10
+    if c.get("a") != (None, False) or len(c) != 1:
+        passed = False
+        print("Failed lru_cache: expired entries must not be returned")
+    return passed
+
+# StubClient stands in for the completion cache table.
+class StubClient:
+    def __init__(self):
+        self.items = {}
+
+    def get_item(self, TableName, Key, **kwargs):
+        item = self.items.get(Key["key"]["S"])
+        return {"ResponseMetadata": {"HTTPStatusCode": 200}, **({"Item": item} if item else {})}
+
+    def put_item(self, TableName, Item):
+        self.items[Item["key"]["S"]] = Item
+        return {"ResponseMetadata": {"HTTPStatusCode": 200}}
+
+def test_completion_cache():
+    passed = True
+    client = StubClient()
+    # the patches are undone so that the other tests see the real client and completions.
+    get_client, request_completion_ = db.get_client, chat.request_completion
+    try:
+        db.get_client = lambda: client
+        requests = []
+        def request_completion(data, **kwargs):
+            requests.append(data)
+            return "timezone: Europe/Paris" if data["messages"][-1]["content"] != "error" else ""
+        chat.request_completion = request_completion
+
+        msgs = [{"role": "system", "content": "prompt"}, {"role": "user", "content": "/timezone Paris"}]
+        metrics.reset()
+        outs = [chat.get_openai_completion(msgs, cache=True) for _ in range(2)]
+        chat.completion_cache.clear()  # new lambda container: only the dynamodb tier is left.
+        outs.append(chat.get_openai_completion(msgs, cache=True))
+        chat.get_openai_completion(msgs)  # not cached.
+        counters = metrics.summary()
+        if outs != ["timezone: Europe/Paris"] * 3 or len(requests) != 2:
+            passed = False
+            print(f"Failed completion_cache: expected 2 requests, got {len(requests)}. outs={outs}")
+        if (counters.get("completion_cache.miss"), counters.get("completion_cache.hit.memory"), counters.get("completion_cache.hit.dynamodb")) != (1, 1, 1):
+            passed = False
+            print(f"Failed completion_cache: wrong counters {counters}")
+
+        # errors are not cached.
+        error_msgs = [{"role": "user", "content": "error"}]
+        chat.get_openai_completion(error_msgs, cache=True)
+        chat.get_openai_completion(error_msgs, cache=True)
+        if len(requests) != 4:
+            passed = False
+            print("Failed completion_cache: empty completions must not be cached")
+    finally:
+        db.get_client, chat.request_completion = get_client, request_completion_
+        chat.completion_cache.clear()
+    return passed
+
+
+if __name__ == "__main__":
+    print("test lru_cache...")
+    if test_lru_cache():
+        print("PASSED")
+    print("test completion_cache...")
+    if test_completion_cache():
+        print("PASSED")
@@ -0,0 +1,157 @@
+import sys
+import os
+reminders_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+sys.path.append(reminders_dir)
+import reminders.codec as codec
+
+# to run tests: python reminders/unit_tests/codec_tests.py
+
+def test_round_trip():
+    passed = True
+    item = {
+        "wa_id": {"S": "123"},
+        "user_name": {"S": "Tim"},
+        "consent": {"BOOL": True},
+        "locked_ts": {"N": "1700000000"},
+        "message_ids": {"L": [{"S": "a"}, {"S": ""}, {"S": "b"}]},
+        "stats": {"M": {"messages_sent": {"N": "3"}, "active_days": {"SS": ["20231114"]}}},
+        "events": {"L": [{"M": {"ts_bucket": {"N": "360"}, "event_id": {"S": "legacy"}}}]},
+        "events_v2": {"L": [{"M": {
+            "ts_bucket": {"N": "360"},
+            "event_id": {"S": "e1"},
+            "event_name": {"S": "water the plants"},
+            "from_date": {"N": "1700000000"},
+            "to_date": {"N": "not a number"},
+            "frequency": {"S": "every day"},
+        }}]},
+        "events_by_id": {"M": {"e3": {"M": {"event_id": {"S": "e3"}, "from_date": {"N": "1700000360"}}}}},
+    }
+    user = codec.User.decode(item)
+
+    expected = {
+        "wa_id": "123",
+        "user_name": "Tim",
+        "user_timezone": "UTC",
+        "subscription": {"subID": "", "subStatus": ""},
+        "conversation": [],
+        "events_v1": [{"ts_bucket": "360", "event_id": "legacy"}],
+        "events_v2": [{
+            "ts_bucket": "360",
+            "event_id": "e1",
+            "event_name": "water the plants",
+            "from_date": 1700000000,
+            "from_date_str": "",
+            "to_date": -1,
+            "to_date_str": "",
+            "frequency": "every day",
+            "version": "2",
+            "reschedule": True,
+            "children": [],
+        }],
+        "events_by_id": {"e3": codec.Event.new(event_id="e3", from_date=1700000360)},
+        "consent": True,
+        "locked": False,
+        "locked_ts": "1700000000",
+        "message_ids": ["a", "b"],
+        "stats": {"messages_sent": 3, "active_days": ["20231114"], "reminders_created": 0, "creation_ts": 0, "last_active_ts": 0, "chat_messages": 0},
+        "verbose": False,
+    }
+    if user != expected:
+        passed = False
+        print(f"Failed round trip: wrong decoded user {user}")
+
+    # records and dicts with the same keys encode the same way.
+    event = user["events_v2"][0]
+    if codec.Event.encode(event) != codec.Event.encode(event.to_dict()):
+        passed = False
+        print("Failed round trip: a record and its dict encode differently")
+    if codec.Event.decode(codec.Event.encode(event)) != event:
+        passed = False
+        print(f"Failed round trip: {codec.Event.encode(event)}")
+    # keys missing from a dict get their default value.
+    encoded = codec.Event.encode({"event_id": "e2", "from_date": 10})
+    if encoded.get("version") != {"S": "2"} or encoded.get("reschedule") != {"BOOL": True} or "ts_bucket" in encoded:
+        passed = False
+        print(f"Failed round trip: wrong defaults {encoded}")
+    # the local conversation is not written.
+    encoded = codec.User.encode(user)
+    if "conversation" in encoded or encoded["events"] != item["events"] or codec.User.decode(encoded)["events_by_id"] != user["events_by_id"]:
+        passed = False
+        print(f"Failed round trip: wrong user item {codec.User.encode(user)}")
+    # rules are written from dicts and read back as records.
+    rule = {"rule_id": "r1", "wa_id": "123", "event_name": "water the plants", "frequency": "every day", "from_date": 1700000000,
+            "to_date": -1, "to_date_str": "", "cursor": 1700086400, "occurrences": [{"ts_bucket": 472222, "event_id": "e1", "from_date": 1700000000}]}
+    encoded = codec.Rule.encode(rule)
+    if encoded["occurrences"] != {"L": [{"M": {"ts_bucket": {"N": "472222"}, "event_id": {"S": "e1"}, "from_date": {"N": "1700000000"}}}]} or codec.Rule.decode(encoded) != rule:
+        passed = False
+        print(f"Failed round trip: wrong rule item {encoded}")
+    return passed
+
+def test_dict_interface():
+    passed = True
+    user = codec.User.new(user_name="Tim")
+    user["user_timezone"] = "Europe/Paris"
+    if (user["user_name"], user.get("user_timezone"), user.get("unknown", 1), "verbose" in user) != ("Tim", "Europe/Paris", 1, True):
+        passed = False
+        print(f"Failed dict interface: {user}")
+    try:
+        user["unknown"] = 1
+        passed = False
+        print("Failed dict interface: setting an unknown key must raise KeyError")
+    except KeyError:
+        pass
+    # mutable defaults are not shared.
+    other = codec.User.new()
+    user["message_ids"].append("a")
+    user["stats"]["messages_sent"] = 1
+    if other["message_ids"] or other["stats"]["messages_sent"]:
+        passed = False
+        print("Failed dict interface: records share their defaults")
+    if dict(user.items()).keys() != set(codec.User._names):
+        passed = False
+        print("Failed dict interface: wrong items")
+    return passed
+
+# lists are decoded and encoded a column at a time: they must give the same records and items as one by one.
+def test_lists():
+    passed = True
+    items = [{
+        "ts_bucket": {"N": "360"},
+        "event_id": {"S": f"e{i}"},
+        "event_name": {"S": "water the plants"},
+        "from_date": {"N": str(1700000000 + i)},
+        "to_date": {"N": "-1"},
+        "frequency": {"S": "every day"},
+        "children": {"L": [{"M": {"ts_bucket": {"N": "360"}, "event_id": {"S": f"c{i}.{j}"}}} for j in range(i % 3)]},
+    } for i in range(2 * codec.COLUMN_MIN)]
+    del items[3]["event_name"]  # missing attribute.
+    items[5]["from_date"] = {"N": "not a number"}  # malformed attribute.
+    items[7]["children"] = {"L": [{"S": "not a map"}]}
+    events = codec.Event.decode_list(items)
+    if events != [codec.Event.decode(item) for item in items] or events[3]["event_name"] != "" or events[5]["from_date"] != -1:
+        passed = False
+        print(f"Failed lists: wrong decoded events {events[:8]}")
+
+    # records and dicts, and numbers that are not written.
+    events[0]["ts_bucket"] = ""
+    objs = events[:-1] + [events[-1].to_dict()]
+    if codec.Event.encode_list(objs) != [codec.Event.encode(obj) for obj in objs] or "ts_bucket" in codec.Event.encode_list(objs)[0]:
+        passed = False
+        print(f"Failed lists: wrong encoded events {codec.Event.encode_list(objs)[:2]}")
+    user = codec.User.decode({"events_by_id": {"M": {item["event_id"]["S"]: {"M": item} for item in items}}})
+    if list(user["events_by_id"].values()) != codec.Event.decode_list(items) or codec.User.decode(codec.User.encode(user)) != user:
+        passed = False
+        print("Failed lists: wrong events_by_id")
+    return passed
+
+
+if __name__ == "__main__":
+    print("test round trip...")
+    if test_round_trip():
+        print("PASSED")
+    print("test dict interface...")
+    if test_dict_interface():
+        print("PASSED")
+    print("test lists...")
+    if test_lists():
+        print("PASSED")
@@ -0,0 +1,76 @@
+import sys
+import os
+import threading
+import time
+reminders_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+sys.path.append(reminders_dir)
+import reminders.dispatch as dispatch
+
+# to run tests: python reminders/unit_tests/dispatch_tests.py
+
+def test_slow_prepare_does_not_block_sends():
+    now = int(time.time())
+    events = [{"event_id": str(i), "from_date": now} for i in range(50)]
+    release = threading.Event()
+    sent = []
+
+    def prepare(event):
+        # a slow reschedule, e.g. an OpenAI call.
+        if event["event_id"] == "0":
+            release.wait(5)
+        return "prepared"
+
+    def send(event, prepared):
+        sent.append((event["event_id"], prepared))
+        if len(sent) == len(events):
+            release.set()
+
+    start = time.time()
+    num_sent = dispatch.run(events, send=send, prepare=prepare)
+    passed = True
+    if num_sent != len(events):
+        passed = False
+        print(f"Failed: expected {len(events)} sent, got {num_sent}")
+    if time.time() - start > 4:
+        passed = False
+        print("Failed: sends waited for the slow prepare")
+    if ("0", None) not in sent:
+        passed = False
+        print("Failed: event 0 should be sent without its prepared value")
+    return passed
+
+def test_groups_are_sent_in_order():
+    now = int(time.time())
+    events = [{"event_id": str(i), "from_date": now + 2 - i % 3} for i in range(9)]
+    slept = []
+    sent = []
+    lock = threading.Lock()
+
+    def send(event, _):
+        with lock:
+            sent.append(event["from_date"])
+
+    # fake clock: sleeping moves time forward.
+    clock = [now]
+    def sleep(t):
+        slept.append(t)
+        clock[0] += t
+
+    dispatch.run(events, send=send, send_workers=1, sleep=sleep, clock=lambda: clock[0])
+    passed = True
+    if sent != sorted(sent):
+        passed = False
+        print(f"Failed: events sent out of order: {sent}")
+    if slept != [1, 1]:
+        passed = False
+        print(f"Failed: expected to sleep once per due second, got {slept}")
+    return passed
+
+
+if __name__ == "__main__":
+    print("test slow prepare does not block sends...")
+    if test_slow_prepare_does_not_block_sends():
+        print("PASSED")
+    print("test groups are sent in order...")
+    if test_groups_are_sent_in_order():
+        print("PASSED")
@@ -0,0 +1,220 @@
+import sys
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+reminders_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+sys.path.append(reminders_dir)
+import reminders.dynamodb as db
+
+from botocore.exceptions import ClientError
+
+# to run tests: python reminders/unit_tests/dynamodb_tests.py
+
+# StubClient records the batch writes, the batch gets and the projections of get_item. The first batch leaves `unprocessed` items unprocessed.
+class StubClient:
+    def __init__(self, unprocessed=0):
+        self.unprocessed = unprocessed
+        self.batches = []
+        self.written = []
+        self.increments = []
+        self.projections = []
+        self.user = {}
+        self.get_batches = []
+        self.updates = []
+        self.unprocessed_keys = 0
+        self.lock = threading.Lock()
+
+    def batch_write_item(self, RequestItems):
+        requests = RequestItems[db.EVENTS_TABLE]
+        self.batches.append(len(requests))
+        n, self.unprocessed = self.unprocessed, 0
+        self.written += requests[n:]
+        resp = {"ResponseMetadata": {"HTTPStatusCode": 200}}
+        if n:
+            resp["UnprocessedItems"] = {db.EVENTS_TABLE: requests[:n]}
+        return resp
+
+    # batch_get_item returns an item for every key, except `unprocessed_keys` keys of the first call.
+    def batch_get_item(self, RequestItems):
+        keys = RequestItems[db.EVENTS_TABLE]["Keys"]
+        self.get_batches.append(len(keys))
+        with self.lock:
+            n, self.unprocessed_keys = self.unprocessed_keys, 0
+        items = [dict(k, event_timestamp={"N": k["ts_bucket"]["N"]}) for k in keys[n:]]
+        resp = {"ResponseMetadata": {"HTTPStatusCode": 200}, "Responses": {db.EVENTS_TABLE: items}}
+        if n:
+            resp["UnprocessedKeys"] = {db.EVENTS_TABLE: {"Keys": keys[:n]}}
+        return resp
+
+    # get_item returns the attributes of `self.user` in the ProjectionExpression.
+    def get_item(self, **kwargs):
+        self.projections.append(sorted(kwargs["ExpressionAttributeNames"].values()))
+        attrs = kwargs["ExpressionAttributeNames"].values()
+        return {"ResponseMetadata": {"HTTPStatusCode": 200}, "Item": {k: v for k, v in self.user.items() if k in attrs}}
+
+    # update_item records the updates of events_by_id, and fails like dynamodb if the map doesn't exist.
+    def update_item(self, **kwargs):
+        values = kwargs.get("ExpressionAttributeValues", {})
+        if ":c" in values:
+            self.increments.append(int(values[":c"]["N"]))
+        expression = kwargs["UpdateExpression"]
+        if "events_by_id." in expression:
+            if "events_by_id" not in self.user:
+                raise ClientError({"Error": {"Code": "ValidationException", "Message": "invalid document path"}}, "UpdateItem")
+            self.updates.append(kwargs)
+        elif expression.startswith("SET events_by_id = if_not_exists"):
+            self.user["events_by_id"] = values[":empty"]
+        return {"ResponseMetadata": {"HTTPStatusCode": 200}}
+
+def child_events(n):
+    return [
+        {
+            "ts_bucket": db.get_ts_bucket(1700000000 + i * 360),
+            "event_id": f"wa_id:drink water:{1700000000 + i * 360}:-1:once",
+            "event_name": "drink water",
+            "from_date": 1700000000 + i * 360,
+            "from_date_str": "Tuesday, 2023-11-14 22:13:20",
+            "to_date": 1700086400,
+            "to_date_str": "Wednesday, 2023-11-15 22:13:20",
+            "frequency": "every 6 minutes",
+            "reschedule": False,
+        }
+        for i in range(n)
+    ]
+
+def test_create_events_v2_batch():
+    passed = True
+    client = StubClient(unprocessed=3)
+    err = db.create_events_v2_batch(client, wa_id="wa_id", events=child_events(60))
+    if err:
+        passed = False
+        print(f"Failed create_events_v2_batch: {err}")
+    if client.batches != [25, 3, 25, 10]:
+        passed = False
+        print(f"Failed create_events_v2_batch: expected 25 item batches and the unprocessed items retried, got {client.batches}")
+    if len({r["PutRequest"]["Item"]["event_id"]["S"] for r in client.written}) != 60:
+        passed = False
+        print(f"Failed create_events_v2_batch: expected 60 events written, got {len(client.written)}")
+    if client.increments != [60]:
+        passed = False
+        print(f"Failed create_events_v2_batch: the reminder count must be incremented once, got {client.increments}")
+    item = client.written[0]["PutRequest"]["Item"]
+    if item["pending_bucket"] != item["ts_bucket"] or item["reschedule"] != {"BOOL": False}:
+        passed = False
+        print(f"Failed create_events_v2_batch: wrong item {item}")
+    return passed
+
+def test_get_user_profile():
+    passed = True
+    client = StubClient()
+    client.user = {
+        "wa_id": {"S": "wa_id"},
+        "user_name": {"S": "Tim"},
+        "user_timezone": {"S": "Europe/Paris"},
+        "subscription": {"M": {"subStatus": {"S": "active"}}},
+        "events_v2": {"L": [{"M": {"event_id": {"S": "e1"}, "from_date": {"N": "1700000000"}}}]},
+        "stats": {"M": {"chat_messages": {"N": "120"}}},
+    }
+    user, err = db.get_user(client, "wa_id", profile=db.USER_SETTINGS)
+    if err or client.projections[-1] != sorted(db.USER_SETTINGS):
+        passed = False
+        print(f"Failed get_user: expected a projection on {db.USER_SETTINGS}, got {client.projections[-1]} {err}")
+    # the other fields have their default value.
+    if (user["user_timezone"], user["user_name"], user["events_v2"], user["stats"]["chat_messages"]) != ("Europe/Paris", "Tim", [], 0):
+        passed = False
+        print(f"Failed get_user: wrong partial user {user}")
+
+    user, err = db.get_user(client, "wa_id")
+    if err or client.projections[-1] != sorted(db.USER_FULL):
+        passed = False
+        print(f"Failed get_user: expected a projection on {db.USER_FULL}, got {client.projections[-1]} {err}")
+    if user["subscription"]["subStatus"] != "active" or user["stats"]["chat_messages"] != 120 or user["events_v2"][0]["event_id"] != "e1":
+        passed = False
+        print(f"Failed get_user: wrong user {user}")
+    return passed
+
+def test_user_settings_cache():
+    passed = True
+    client = StubClient()
+    client.user = {"wa_id": {"S": "wa_id"}, "user_timezone": {"S": "Europe/Paris"}}
+    db.settings_cache.clear()
+    # 40 events of 4 users, prepared concurrently like check_reminders does.
+    wa_ids = [f"wa_id_{i % 4}" for i in range(40)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        settings = list(pool.map(lambda wa_id: db.get_user_settings(client, wa_id)[0], wa_ids))
+    if len(client.projections) != 4:
+        passed = False
+        print(f"Failed user settings cache: expected one read per user, got {len(client.projections)}")
+    if any(s.get("user_timezone") != "Europe/Paris" for s in settings):
+        passed = False
+        print(f"Failed user settings cache: wrong settings {settings[0]}")
+
+    # updates invalidate the entry.
+    db.update_user_timezone(client, "wa_id_0", "America/New_York")
+    client.user["user_timezone"] = {"S": "America/New_York"}
+    settings, _ = db.get_user_settings(client, "wa_id_0")
+    if settings.get("user_timezone") != "America/New_York" or len(client.projections) != 5:
+        passed = False
+        print(f"Failed user settings cache: expected the updated timezone, got {settings}")
+    return passed
+
+def test_get_events():
+    passed = True
+    client = StubClient()
+    client.unprocessed_keys = 30
+    keys = [{"ts_bucket": str(1700000000 + i * 360), "event_id": f"event {i}"} for i in range(250)]
+    events, err = db.get_events(client, keys + keys[:50])
+    if err:
+        passed = False
+        print(f"Failed get_events: {err}")
+    if max(client.get_batches) > db.BATCH_GET_LIMIT or sum(client.get_batches) != 250 + 30:
+        passed = False
+        print(f"Failed get_events: expected chunks of at most {db.BATCH_GET_LIMIT} unique keys and the unprocessed keys retried, got {client.get_batches}")
+    if [e["event_id"] for e in events] != [k["event_id"] for k in keys]:
+        passed = False
+        print(f"Failed get_events: expected the 250 events sorted by date, got {len(events)}")
+    return passed
+
+def test_user_events():
+    passed = True
+    client = StubClient()
+    event = child_events(1)[0]
+    # the user has no events_by_id map yet.
+    err = db.put_user_event(client, "wa_id", event, remove_id="old event")
+    if err or "events_by_id" not in client.user or len(client.updates) != 1:
+        passed = False
+        print(f"Failed user events: expected the map to be created and the event written, got {err} {client.updates}")
+    update = client.updates[-1]
+    # only the entry of the event is written.
+    if update["UpdateExpression"] != "SET events_by_id.#id = :e REMOVE events_by_id.#rid" or update["ExpressionAttributeNames"] != {"#id": event["event_id"], "#rid": "old event"}:
+        passed = False
+        print(f"Failed user events: wrong update {update}")
+    err = db.remove_user_event(client, "wa_id", event["event_id"])
+    if err or client.updates[-1]["UpdateExpression"] != "REMOVE events_by_id.#id":
+        passed = False
+        print(f"Failed user events: wrong remove {err} {client.updates[-1]}")
+
+    # legacy list and map are merged, sorted by date.
+    user = {"events_v2": [{"event_id": "a", "from_date": 3}, {"event_id": "b", "from_date": 1}], "events_by_id": {"c": {"event_id": "c", "from_date": 2}}}
+    if [e["event_id"] for e in db.user_events_v2(user)] != ["b", "c", "a"]:
+        passed = False
+        print(f"Failed user events: wrong merge {db.user_events_v2(user)}")
+    return passed
+
+
+if __name__ == "__main__":
+    print("test create_events_v2_batch...")
+    if test_create_events_v2_batch():
+        print("PASSED")
+    print("test get_user profile...")
+    if test_get_user_profile():
+        print("PASSED")
+    print("test user settings cache...")
+    if test_user_settings_cache():
+        print("PASSED")
+    print("test get_events...")
+    if test_get_events():
+        print("PASSED")
+    print("test user events...")
+    if test_user_events():
+        print("PASSED")
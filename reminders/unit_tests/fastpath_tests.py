@@ -0,0 +1,101 @@
+import sys
+import os
+reminders_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+sys.path.append(reminders_dir)
+import reminders.fastpath as fastpath
+import reminders.parser as parser
+import reminders.utils as utils
+
+# to run tests: python reminders/unit_tests/fastpath_tests.py
+
+TZ = "Europe/Paris"
+NOW = utils.usr_local_str_to_utc("Monday, 2023-06-05 16:35:20", TZ)
+
+def test_fastpath_run():
+    tests = [
+        {
+            "msg": "Remind me to call mom at 5pm tomorrow",
+            "expected": ("Call mom", "Tuesday, 2023-06-06 17:00:00", "once"),
+            "reason": "Time then day."
+        },
+        {
+            "msg": "remind me at 09:30 to take my pills",
+            "expected": ("Take my pills", "Tuesday, 2023-06-06 09:30:00", "once"),
+            "reason": "Time before the task, already passed today."
+        },
+        {
+            "msg": "Remind me to meet Tom at the cafe at 5pm.",
+            "expected": ("Meet Tom at the cafe", "Monday, 2023-06-05 17:00:00", "once"),
+            "reason": "`at` in the task, case is kept."
+        },
+        {
+            "msg": "remind me in 10 minutes to check the oven",
+            "expected": ("Check the oven", "Monday, 2023-06-05 16:45:00", "once"),
+            "reason": "Relative time."
+        },
+        {
+            "msg": "remind me tonight at 10 to sleep",
+            "expected": ("Sleep", "Monday, 2023-06-05 22:00:00", "once"),
+            "reason": "Tonight is pm."
+        },
+        {
+            "msg": "remind me to stretch every day at 9am",
+            "expected": ("Stretch", "Tuesday, 2023-06-06 09:00:00", "every day"),
+            "reason": "Daily recurrence."
+        },
+        {
+            "msg": "remind me to go to the gym every monday at 7am",
+            "expected": ("Go to the gym", "Monday, 2023-06-12 07:00:00", "every week"),
+            "reason": "Weekly recurrence on the current weekday, already passed."
+        },
+        {
+            "msg": "remind me to drink water every 2 hours",
+            "expected": ("Drink water", "Monday, 2023-06-05 18:35:00", "every 2 hours"),
+            "reason": "Interval recurrence starts one interval from now."
+        },
+        {"msg": "remind me to call mom", "expected": None, "reason": "No time."},
+        {"msg": "remind me to pay rent every month", "expected": None, "reason": "Monthly recurrence needs a day."},
+        {"msg": "remind me to buy milk at 5pm and eggs at 6pm", "expected": None, "reason": "Two times."},
+        {"msg": "remind me to leave today at 9am", "expected": None, "reason": "In the past."},
+        {"msg": "remind me to call at 25:00", "expected": None, "reason": "Invalid time."},
+        {
+            "msg": "remind me to buy \"bio\" milk at 17:00",
+            "expected": ("Buy \"bio\" milk", "Monday, 2023-06-05 17:00:00", "once"),
+            "reason": "Quotes in the task, 24 hours time."
+        },
+        {"msg": "remind me to stretch every day at 9", "expected": None, "reason": "Bare hour without am/pm."},
+        {"msg": "remind me to call mom at 5", "expected": None, "reason": "Bare hour without am/pm."},
+        {"msg": "remind me to call mom at 5:30", "expected": None, "reason": "Hour and minutes without am/pm."},
+        {"msg": "remind me to call mom at 12:15", "expected": None, "reason": "Noon or midnight without am/pm."},
+        {"msg": "remind me to drink water every 0 minutes", "expected": None, "reason": "Zero interval."},
+        {"msg": "remind me to drink water every 1 minute", "expected": None, "reason": "Below recurrence.MIN_INTERVAL."},
+        {"msg": "remind me in 0 minutes to check the oven", "expected": None, "reason": "Not in the future."},
+        {"msg": "remind me to call (mom) at 5pm", "expected": None, "reason": "Parenthesis can't be written as a command."},
+        {"msg": "remind me to say \"hi\" at 5pm", "expected": None, "reason": "The parser strips quotes around arguments."},
+        {"msg": "rappelle moi d'appeler maman demain à 17h", "expected": None, "reason": "Not english."},
+    ]
+    passed = True
+    for i, t in enumerate(tests):
+        params, confirmation = fastpath.run(t["msg"], NOW, {"user_timezone": TZ})
+        actual = None
+        if params:
+            fn, kwargs = params[0]
+            actual = (kwargs["event_name"], kwargs["from_date_str"], kwargs["frequency"])
+            if fn != "create" or len(params) != 1 or kwargs["from_date"] != utils.usr_local_str_to_utc(kwargs["from_date_str"], TZ) or not confirmation:
+                passed = False
+                print(f"Failed on test {i} ({t['reason']}): invalid params {params}")
+            # the command written to the conversation reads back as the same reminder.
+            parsed, err = parser.run(fastpath.to_commands(params), {"user_timezone": TZ})
+            if err or parsed != params:
+                passed = False
+                print(f"Failed on test {i} ({t['reason']}): the command reads back as {parsed}. err={err}")
+        if actual != t["expected"]:
+            passed = False
+            print(f"Failed on test {i} ({t['reason']}): expected {t['expected']}, got {actual}")
+    return passed
+
+
+if __name__ == "__main__":
+    print("test fastpath.run...")
+    if test_fastpath_run():
+        print("PASSED")
@@ -0,0 +1,67 @@
+import sys
+import os
+reminders_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+sys.path.append(reminders_dir)
+import reminders.lock as lock
+import reminders.utils as utils
+
+# to run tests: python reminders/unit_tests/lock_tests.py
+
+# StubClient answers `get_item` with the next lock state of `states`.
+class StubClient:
+    def __init__(self, states):
+        self.states = states
+        self.requests = []
+
+    def get_item(self, **kwargs):
+        self.requests.append(kwargs)
+        locked, lock_expires_ts = self.states.pop(0) if len(self.states) > 1 else self.states[0]
+        return {
+            "ResponseMetadata": {"HTTPStatusCode": 200},
+            "Item": {"locked": {"BOOL": locked}, "lock_expires_ts": {"N": str(lock_expires_ts)}, "lock_token": {"N": "7"}},
+        }
+
+def test_wait_for_release():
+    now = utils.utc_now_ts()
+    tests = [
+        {
+            "states": [(True, now + 60), (True, now + 60), (False, 0)],
+            "deadline": now + 30,
+            "expected": True,
+            "reason": "Lock released before the deadline."
+        },
+        {
+            "states": [(True, now - 1)],
+            "deadline": now + 30,
+            "expected": True,
+            "reason": "Expired leases are free."
+        },
+        {
+            "states": [(True, now + 600)],
+            "deadline": now,
+            "expected": False,
+            "reason": "Lock still held at the deadline."
+        },
+    ]
+    passed = True
+    for i, t in enumerate(tests):
+        client = StubClient(t["states"])
+        slept = []
+        actual = lock.wait_for_release(client, "wa_id", t["deadline"], sleep=slept.append)
+        if actual != t["expected"]:
+            passed = False
+            print(f"Failed on test {i} ({t['reason']}): expected {t['expected']}, got {actual}")
+        if any(s < 0 or s > lock.BACKOFF_CAP for s in slept):
+            passed = False
+            print(f"Failed on test {i}: backoff out of bounds: {slept}")
+        # only the lock attributes are read.
+        if any(r["ExpressionAttributeNames"] != {f"#p{j}": f for j, f in enumerate(lock.db.LOCK_FIELDS)} for r in client.requests):
+            passed = False
+            print(f"Failed on test {i}: get_item did not project the lock attributes")
+    return passed
+
+
+if __name__ == "__main__":
+    print("test wait_for_release...")
+    if test_wait_for_release():
+        print("PASSED")
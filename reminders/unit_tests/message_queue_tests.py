@@ -0,0 +1,75 @@
+import json
+import sys
+import os
+reminders_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+sys.path.append(reminders_dir)
+import reminders.message_queue as message_queue
+
+# to run tests: python reminders/unit_tests/message_queue_tests.py
+
+def webhook_event(wa_id, msg_id, text):
+    value = {
+        "contacts": [{"wa_id": wa_id}],
+        "messages": [{"id": msg_id, "from": wa_id, "timestamp": "1686000000", "type": "text", "text": {"body": text}}],
+    }
+    return {"body": json.dumps({"entry": [{"changes": [{"value": value}]}]})}
+
+def text_of(event):
+    return json.loads(event["body"])["entry"][0]["changes"][0]["value"]["messages"][0]["text"]["body"]
+
+def test_ingest():
+    passed = True
+    backend = message_queue.InMemoryBackend()
+    message_queue.set_backend(backend)
+
+    responses = [
+        message_queue.ingest(webhook_event("1", "a", "remind me")),
+        message_queue.ingest(webhook_event("1", "a", "remind me")),  # redelivery
+        message_queue.ingest(webhook_event("2", "b", "hello")),
+        message_queue.ingest({"body": json.dumps({"entry": [{"changes": [{"value": {"statuses": []}}]}]})}),
+        message_queue.ingest({"body": "not json"}),
+    ]
+    codes = [r["statusCode"] for r in responses]
+    if codes != [200, 200, 200, 200, 400]:
+        passed = False
+        print(f"Failed ingest: got status codes {codes}")
+    groups = [m["attributes"]["MessageGroupId"] for m in backend.messages]
+    if groups != ["1", "2"]:
+        passed = False
+        print(f"Failed ingest: expected one message per user, got groups {groups}")
+    return passed
+
+def test_work():
+    passed = True
+    backend = message_queue.InMemoryBackend()
+    message_queue.set_backend(backend)
+    for i, text in enumerate(["first", "fail", "third"]):
+        message_queue.ingest(webhook_event("1", f"m{i}", text))
+
+    handled = []
+    def handler(event):
+        if text_of(event) == "fail" and "fail" not in handled:
+            handled.append("fail")
+            raise Exception("LLM timeout")
+        handled.append(text_of(event))
+
+    resp = backend.drain(handler)
+    failed = [f["itemIdentifier"] for f in resp["batchItemFailures"]]
+    if handled != ["first", "fail"] or failed != ["2", "3"]:
+        passed = False
+        print(f"Failed work: the batch must stop at the first failure. handled={handled}, failed={failed}")
+    # redelivery of the failed messages, in order.
+    resp = backend.drain(handler)
+    if handled != ["first", "fail", "fail", "third"] or resp["batchItemFailures"] or backend.messages:
+        passed = False
+        print(f"Failed work: failed messages must be redelivered in order. handled={handled}")
+    return passed
+
+
+if __name__ == "__main__":
+    print("test ingest...")
+    if test_ingest():
+        print("PASSED")
+    print("test work...")
+    if test_work():
+        print("PASSED")
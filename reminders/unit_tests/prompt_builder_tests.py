@@ -0,0 +1,74 @@
+import sys
+import os
+reminders_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+sys.path.append(reminders_dir)
+import reminders.chat as chat
+import reminders.connections as connections
+import reminders.metrics as metrics
+import reminders.prompt_builder as prompt_builder
+import reminders.resilience as resilience
+from reminders.benchmarks.stubs import FakeOpenAIServer
+
+# to run tests: python reminders/unit_tests/prompt_builder_tests.py
+
+def test_fit():
+    passed = True
+    system = {"role": "system", "content": "prompt " * 100, "exclude": True}
+    turns = [{"role": "user" if i % 2 == 0 else "assistant", "content": f"message {i} " * 20} for i in range(10)]
+    messages = [system] + turns
+
+    out = prompt_builder.fit(messages, prompt_builder.count_message_tokens(messages))
+    if out != messages:
+        passed = False
+        print("Failed fit: messages within the budget must not change")
+
+    budget = prompt_builder.count_message_tokens([system] + turns[-3:])
+    out = prompt_builder.fit(messages, budget)
+    if out != [system] + turns[-3:]:
+        passed = False
+        print(f"Failed fit: expected the system prompt and the last 3 turns, got {[m['content'][:10] for m in out]}")
+
+    # the last messages are kept even if they don't fit.
+    out = prompt_builder.fit(messages, 0, keep_last=2)
+    if out != [system] + turns[-2:]:
+        passed = False
+        print(f"Failed fit: the last messages must be kept, got {[m['content'][:10] for m in out]}")
+
+    # older messages are cut, the last one is not.
+    long = "word " * (prompt_builder.MESSAGE_BUDGET * 2)
+    out = prompt_builder.fit([{"role": "user", "content": long}, {"role": "user", "content": long}], 10000)
+    if prompt_builder.count_tokens(out[0]["content"]) > prompt_builder.MESSAGE_BUDGET + 1 or out[1]["content"] != long:
+        passed = False
+        print("Failed fit: only older long messages must be cut")
+    return passed
+
+def test_usage():
+    passed = True
+    connections.reset()
+    chat.openai_breaker = resilience.CircuitBreaker()
+    messages = [{"role": "user", "content": "hi"}]
+    with FakeOpenAIServer([(200, {}, "one two three", 0)]) as server:
+        chat.OPENAI_URL = server.url
+        metrics.reset()
+        chat.get_openai_completion(messages, stage="programming")
+        stream = chat.stream_completion(messages, stage="reply")
+        "".join(stream)
+    counters = metrics.summary()
+    # non streamed completions report their usage.
+    if (counters.get("tokens.programming.prompt"), counters.get("tokens.programming.completion")) != (FakeOpenAIServer.PROMPT_TOKENS, 3):
+        passed = False
+        print(f"Failed usage: wrong usage of the programming stage {counters}")
+    # streamed completions are estimated.
+    if counters.get("tokens.reply.prompt") != prompt_builder.count_message_tokens(messages) or counters.get("tokens.reply.completion") != prompt_builder.count_tokens(stream.text):
+        passed = False
+        print(f"Failed usage: wrong estimate of the reply stage {counters}")
+    return passed
+
+
+if __name__ == "__main__":
+    print("test fit...")
+    if test_fit():
+        print("PASSED")
+    print("test usage...")
+    if test_usage():
+        print("PASSED")
@@ -0,0 +1,257 @@
+import sys
+import os
+reminders_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+sys.path.append(reminders_dir)
+import itertools
+import random
+import pendulum
+from botocore.exceptions import ClientError
+import reminders.codec as codec
+import reminders.dynamodb as db
+import reminders.execute as execute
+import reminders.recurrence as recurrence
+
+# to run tests: python reminders/unit_tests/recurrence_tests.py
+
+OK = {"ResponseMetadata": {"HTTPStatusCode": 200}}
+DAY = 24 * 60 * 60
+FROM_DATE = 1700000000
+
+# StubClient keeps the events and rules tables, and the events_by_id map of the user, in memory.
+class StubClient:
+    def __init__(self):
+        self.events = {}
+        self.rules = {}
+        self.user_events = {}
+
+    def put_item(self, TableName, Item):
+        if TableName == db.RULES_TABLE:
+            self.rules[Item["rule_id"]["S"]] = Item
+        else:
+            self.events[(Item["ts_bucket"]["N"], Item["event_id"]["S"])] = Item
+        return OK
+
+    def get_item(self, TableName, Key, **kwargs):
+        item = self.rules.get(Key["rule_id"]["S"])
+        return {**OK, **({"Item": item} if item else {})}
+
+    def update_item(self, TableName, Key, **kwargs):
+        if TableName == db.USERS_TABLE and "events_by_id.#id" in kwargs["UpdateExpression"]:
+            event_id = kwargs["ExpressionAttributeNames"]["#id"]
+            if kwargs["UpdateExpression"].startswith("REMOVE"):
+                self.user_events.pop(event_id, None)
+            else:
+                self.user_events[event_id] = kwargs["ExpressionAttributeValues"][":e"]["M"]
+            return OK
+        if TableName != db.RULES_TABLE:
+            return OK  # reminder counters and stats.
+        item = self.rules.get(Key["rule_id"]["S"])
+        values = kwargs["ExpressionAttributeValues"]
+        if item is None or item["cursor"] != values[":prev"]:
+            raise ClientError({"Error": {"Code": "ConditionalCheckFailedException"}}, "UpdateItem")
+        item["cursor"] = values[":c"]
+        item["occurrences"] = values[":o"]
+        return OK
+
+    def delete_item(self, TableName, Key):
+        if TableName == db.RULES_TABLE:
+            self.rules.pop(Key["rule_id"]["S"], None)
+        else:
+            self.events.pop((Key["ts_bucket"]["N"], Key["event_id"]["S"]), None)
+        return OK
+
+    def batch_write_item(self, RequestItems):
+        for request in RequestItems[db.EVENTS_TABLE]:
+            if "PutRequest" in request:
+                self.put_item(db.EVENTS_TABLE, request["PutRequest"]["Item"])
+            else:
+                key = request["DeleteRequest"]["Key"]
+                self.events.pop((key["ts_bucket"]["N"], key["event_id"]["S"]), None)
+        return OK
+
+    def dates(self):
+        return sorted(int(item["from_date"]["N"]) for item in self.events.values())
+
+def create(client, frequency, to_date=-1):
+    event_id = db.get_event_id_v2("wa_id", "water the plants", FROM_DATE, to_date, frequency)
+    return event_id, recurrence.create(
+        client=client,
+        wa_id="wa_id",
+        event_id=event_id,
+        ts_bucket=db.get_ts_bucket(FROM_DATE),
+        event_name="water the plants",
+        from_date=FROM_DATE,
+        from_date_str="Tuesday, 2023-11-14 22:13:20",
+        to_date=to_date,
+        to_date_str="",
+        frequency=frequency,
+        tz="UTC",
+    )
+
+# fire sends the occurrence at `ts` like check_reminders does.
+def fire(client, event_id, ts):
+    return recurrence.roll_forward(client, {"rule_id": event_id, "from_date": str(ts)})
+
+def test_rolling():
+    passed = True
+    client = StubClient()
+    event_id, err = create(client, "every day")
+    if err or client.dates() != [FROM_DATE + i * DAY for i in range(recurrence.LOOKAHEAD)]:
+        passed = False
+        print(f"Failed rolling: expected the first {recurrence.LOOKAHEAD} occurrences, got {client.dates()}. err={err}")
+    if (str(db.get_ts_bucket(FROM_DATE)), event_id) not in client.events:
+        passed = False
+        print("Failed rolling: the first occurrence must have the reminder's key")
+
+    for i in range(10):
+        fire(client, event_id, FROM_DATE + i * DAY)
+    fire(client, event_id, FROM_DATE + 9 * DAY)  # a second invocation fires the same occurrence.
+    rule, _ = db.get_rule(client, event_id)
+    if [o["from_date"] for o in rule["occurrences"]] != [FROM_DATE + i * DAY for i in range(10, 10 + recurrence.LOOKAHEAD)]:
+        passed = False
+        print(f"Failed rolling: expected {recurrence.LOOKAHEAD} pending occurrences, got {rule['occurrences']}")
+    if len(client.rules) != 1 or len(client.events) != 10 + recurrence.LOOKAHEAD:
+        passed = False
+        print(f"Failed rolling: expected one rule and one item per occurrence, got {len(client.rules)} rules, {len(client.events)} events")
+
+    err = recurrence.delete(client, event_id)
+    if err or client.rules or len(client.events) != 10:
+        passed = False
+        print(f"Failed rolling: delete must remove the rule and its pending occurrences. err={err}, events={len(client.events)}")
+    if fire(client, event_id, FROM_DATE + 10 * DAY) or len(client.events) != 10:
+        passed = False
+        print("Failed rolling: a deleted rule must not roll forward")
+    return passed
+
+# the reminders of the user as handle_message loads them, and the upcoming ones as /reminders lists them.
+def upcoming(client, now):
+    user = {"events_by_id": {k: codec.Event.decode(v) for k, v in client.user_events.items()}}
+    return [e for e in db.user_events_v2(user) if int(e["from_date"]) >= now or int(e["to_date"]) >= now]
+
+def test_listed_after_firing():
+    passed = True
+    client = StubClient()
+    event_id, err = create(client, "every day")
+    # like execute.create.
+    db.put_user_event(client, "wa_id", db.user_event(event_id, db.get_ts_bucket(FROM_DATE), "water the plants", FROM_DATE, "", -1, "", "every day"))
+    fire(client, event_id, FROM_DATE)
+
+    events = upcoming(client, FROM_DATE + 60)
+    if err or [(e["event_id"], e["from_date"]) for e in events] != [(event_id, FROM_DATE + DAY)]:
+        passed = False
+        print(f"Failed listed after firing: expected the reminder at its next occurrence, got {events}")
+        return passed
+
+    err = execute.execute("delete", {"event_index": "0"}, {"wa_id": "wa_id"}, events, client)
+    # the first occurrence has the reminder's key: it is deleted too.
+    if err or client.rules or client.user_events or client.events:
+        passed = False
+        print(f"Failed listed after firing: delete must remove the rule, its occurrences and the user's entry. err={err}, events={client.dates()}")
+    return passed
+
+def test_end_date():
+    passed = True
+    client = StubClient()
+    event_id, err = create(client, "every 2 days", to_date=FROM_DATE + 5 * DAY)
+    for ts in [FROM_DATE, FROM_DATE + 2 * DAY, FROM_DATE + 4 * DAY]:
+        fire(client, event_id, ts)
+    if err or client.dates() != [FROM_DATE, FROM_DATE + 2 * DAY, FROM_DATE + 4 * DAY] or client.rules:
+        passed = False
+        print(f"Failed end_date: expected 3 occurrences and no rule left, got {client.dates()}, {len(client.rules)} rules. err={err}")
+
+    # frequencies that the regex doesn't understand are stored as a single event.
+    client = StubClient()
+    _, err = create(client, "every weekday")
+    if err or len(client.events) != 1 or client.rules:
+        passed = False
+        print(f"Failed end_date: expected a single event, got {len(client.events)} events, {len(client.rules)} rules")
+    return passed
+
+# randomized property test of recurrence.occurrences against a step by step oracle.
+# months and years are checked against pendulum, which also clamps to the end of the month.
+def test_occurrences(cases=500, seed=0):
+    passed = True
+    rng = random.Random(seed)
+    units = ["minutes", "hours", "days", "weeks", "months", "years"]
+    for _ in range(cases):
+        unit = rng.choice(units)
+        value = rng.randint(5 if unit == "minutes" else 1, 30)
+        frequency = f"every {value} {unit}"
+        from_ts = rng.randint(0, 2_000_000_000)
+        horizon = rng.randint(0, {"minutes": 5, "hours": 60, "days": 1000, "weeks": 5000, "months": 20000, "years": 40000}[unit] * DAY)
+        to_ts = from_ts + horizon
+        after_ts = from_ts + rng.randint(0, horizon)
+
+        dates, err = recurrence.occurrences(frequency, from_ts, after_ts=after_ts, to_ts=to_ts)
+        dates = list(dates)
+        expected = []
+        anchor = pendulum.from_timestamp(from_ts)
+        for k in itertools.count(1):
+            if unit in ("months", "years"):
+                ts = int(anchor.add(months=k * value * (12 if unit == "years" else 1)).timestamp())
+            else:
+                ts = from_ts + k * value * recurrence.UNIT_SECONDS[unit.rstrip("s")]
+            if ts > to_ts:
+                break
+            if ts > after_ts:
+                expected.append(ts)
+        if err or dates != expected:
+            passed = False
+            print(f"Failed occurrences: {frequency} from {from_ts} after {after_ts} to {to_ts}: expected {expected[:5]}..., got {dates[:5]}... err={err}")
+            continue
+
+        # without an end date, the occurrences are the same.
+        infinite, _ = recurrence.occurrences(frequency, from_ts, after_ts=after_ts)
+        if list(itertools.islice(infinite, len(dates))) != dates:
+            passed = False
+            print(f"Failed occurrences: {frequency} without end date differs")
+    return passed
+
+def test_parse():
+    tests = [
+        ("every day", (24 * 60 * 60, 0), None),
+        ("Every 2 Weeks", (14 * 24 * 60 * 60, 0), None),
+        ("every 3 months", (0, 3), None),
+        ("every year", (0, 12), None),
+        ("every minute", (0, 0), "too_frequent"),
+        ("every 4 minutes", (0, 0), "too_frequent"),
+        ("every 0 days", (0, 0), "could not parse value: 0"),
+    ]
+    passed = True
+    for frequency, expected, expected_err in tests:
+        actual, err = recurrence.parse(frequency)
+        if actual != expected or err != expected_err:
+            passed = False
+            print(f"Failed parse {frequency}: expected {expected}, {expected_err}, got {actual}, {err}")
+    # months don't drift: a reminder on January 31st falls on the last day of each month.
+    jan_31 = int(pendulum.datetime(2023, 1, 31, 9).timestamp())
+    dates, _ = recurrence.occurrences("every month", jan_31, to_ts=int(pendulum.datetime(2023, 5, 1).timestamp()))
+    if [pendulum.from_timestamp(ts).day for ts in dates] != [28, 31, 30]:
+        passed = False
+        print("Failed parse: monthly reminders must not drift")
+    dec = int(pendulum.datetime(2023, 12, 15).timestamp())
+    if recurrence.next_occurrences("every month", dec, dec, -1, 1)[0] != [int(pendulum.datetime(2024, 1, 15).timestamp())]:
+        passed = False
+        print("Failed parse: december + 1 month must be january of the next year")
+    return passed
+
+
+if __name__ == "__main__":
+    # execute logs to the admin number.
+    os.environ.setdefault("TIM_PHONE_NUMBER", "33600000000")
+    db.get_user_settings = lambda client, wa_id: ({"user_timezone": "UTC"}, None)
+    print("test rolling...")
+    if test_rolling():
+        print("PASSED")
+    print("test listed after firing...")
+    if test_listed_after_firing():
+        print("PASSED")
+    print("test end_date...")
+    if test_end_date():
+        print("PASSED")
+    print("test occurrences...")
+    if test_occurrences():
+        print("PASSED")
+    print("test parse...")
+    if test_parse():
+        print("PASSED")
@@ -0,0 +1,110 @@
+import sys
+import os
+import time
+reminders_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+sys.path.append(reminders_dir)
+import reminders.chat as chat
+import reminders.connections as connections
+import reminders.resilience as resilience
+from reminders.benchmarks.stubs import FakeOpenAIServer
+
+# to run tests: python reminders/unit_tests/resilience_tests.py
+
+def test_retry_after():
+    tests = [
+        ({"retry-after-ms": "250"}, 0.25),
+        ({"Retry-After": "2"}, 2),
+        ({"Retry-After": "Wed, 21 Oct 2015 07:28:10 GMT"}, 10),
+        ({"Retry-After": "soon"}, -1),
+        ({}, -1),
+    ]
+    passed = True
+    for i, (headers, expected) in enumerate(tests):
+        actual = resilience.retry_after(headers, now_ts=1445412480)  # 07:28:00 GMT
+        if actual != expected:
+            passed = False
+            print(f"Failed on test {i}: expected {expected}, got {actual}")
+    return passed
+
+def test_circuit_breaker():
+    passed = True
+    now = [0]
+    breaker = resilience.CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=lambda: now[0])
+    breaker.record_failure()
+    breaker.record_failure()
+    if breaker.allow():
+        passed = False
+        print("Failed circuit_breaker: must open after 2 failures")
+    now[0] = 10
+    if not breaker.allow() or breaker.allow():
+        passed = False
+        print("Failed circuit_breaker: a single trial call must go through after the reset timeout")
+    breaker.record_failure()
+    if breaker.allow():
+        passed = False
+        print("Failed circuit_breaker: a failed trial must open the circuit again")
+    now[0] = 20
+    breaker.allow()
+    breaker.record_success()
+    if not breaker.allow() or not breaker.allow():
+        passed = False
+        print("Failed circuit_breaker: a successful trial must close the circuit")
+    return passed
+
+def completion(server, **kwargs):
+    chat.OPENAI_URL = server.url
+    connections.reset()
+    chat.openai_breaker = resilience.CircuitBreaker(**kwargs)
+    start = time.monotonic()
+    out = chat.request_completion({"model": chat.MODEL, "messages": []}, sleep=lambda s: time.sleep(min(s, 0.05)))
+    return out, time.monotonic() - start
+
+def test_request_completion():
+    passed = True
+    chat.BACKOFF_BASE = 0.01
+
+    with FakeOpenAIServer([(429, {"retry-after-ms": "20"}, "rate limited", 0), (200, {}, "hello", 0)]) as server:
+        out, _ = completion(server)
+        if out != "hello" or len(server.received) != 2:
+            passed = False
+            print(f"Failed request_completion: 429 must be retried. out={out}, requests={len(server.received)}")
+
+    with FakeOpenAIServer([(503, {}, "overloaded", 0)]) as server:
+        out, _ = completion(server)
+        if out != "" or len(server.received) != chat.MAX_ATTEMPTS:
+            passed = False
+            print(f"Failed request_completion: expected {chat.MAX_ATTEMPTS} attempts, got {len(server.received)}")
+
+    with FakeOpenAIServer([(400, {}, "bad request", 0)]) as server:
+        out, _ = completion(server)
+        if out != "" or len(server.received) != 1:
+            passed = False
+            print(f"Failed request_completion: 400 must not be retried, got {len(server.received)} requests")
+
+    with FakeOpenAIServer([(200, {}, "too late", 3)]) as server:
+        with resilience.deadline(1.5):
+            out, elapsed = completion(server)
+        if out != "" or elapsed > 2:
+            passed = False
+            print(f"Failed request_completion: must give up at the deadline. out={out}, elapsed={elapsed:.2f}s")
+
+    with FakeOpenAIServer([(500, {}, "down", 0)]) as server:
+        completion(server, failure_threshold=2, reset_timeout=60)
+        # the circuit opened after the 2nd attempt: the next call does not reach the server.
+        chat.request_completion({"model": chat.MODEL, "messages": []})
+        if len(server.received) != 2:
+            passed = False
+            print(f"Failed request_completion: the open circuit must fail fast. requests={len(server.received)}")
+    return passed
+
+
+if __name__ == "__main__":
+    print("test retry_after...")
+    if test_retry_after():
+        print("PASSED")
+    print("test circuit_breaker...")
+    if test_circuit_breaker():
+        print("PASSED")
+    print("test request_completion...")
+    if test_request_completion():
+        print("PASSED")
@@ -0,0 +1,103 @@
+import sys
+import os
+reminders_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+sys.path.append(reminders_dir)
+import reminders.dynamodb as db
+import reminders.scheduler as scheduler
+
+# to run tests: python reminders/unit_tests/scheduler_tests.py
+
+NOW = 1686000000 - 1686000000 % (db.BUCKET_WINDOW * 60)  # start of a bucket
+
+# StubClient answers `query` on the pending index with the pending from_dates stored per bucket.
+class StubClient:
+    def __init__(self, pending, failing=()):
+        self.pending = pending  # ts_bucket -> list of from_dates
+        self.failing = failing  # ts_buckets whose query fails
+        self.queries = 0
+
+    def query(self, **kwargs):
+        self.queries += 1
+        ts_bucket = int(kwargs["ExpressionAttributeValues"][":ts"]["N"])
+        if ts_bucket in self.failing:
+            return {"ResponseMetadata": {"HTTPStatusCode": 500}, "Error": {"Code": "InternalServerError"}}
+        return {
+            "ResponseMetadata": {"HTTPStatusCode": 200},
+            "Items": [{"from_date": {"N": str(ts)}} for ts in sorted(self.pending.get(ts_bucket, []))][:kwargs.get("Limit")],
+        }
+
+def test_rearm():
+    window = db.BUCKET_WINDOW * 60
+    tests = [
+        {
+            "pending": {NOW: [NOW + 200, NOW + 130]},
+            "expected": NOW + 120,
+            "reason": "Earliest event of the current bucket, floored to the minute."
+        },
+        {
+            "pending": {NOW + 3 * window: [NOW + 3 * window + 61]},
+            "expected": NOW + 3 * window + 60,
+            "reason": "Empty buckets are skipped."
+        },
+        {
+            "pending": {},
+            "expected": NOW + scheduler.HEARTBEAT,
+            "reason": "Nothing pending: arm the heartbeat."
+        },
+        {
+            "pending": {NOW: [NOW - 30]},
+            "expected": NOW + scheduler.FIRE_WINDOW,
+            "reason": "Overdue events can't be armed in the past."
+        },
+        {
+            "pending": {NOW + 3 * window: [NOW + 3 * window + 61]},
+            "failing": [NOW + window],
+            "expected": NOW + scheduler.RETRY,
+            "reason": "DynamoDB error: retry after a bucket window, not the heartbeat."
+        },
+    ]
+    passed = True
+    for i, t in enumerate(tests):
+        backend = scheduler.FakeBackend()
+        scheduler.set_backend(backend)
+        err = scheduler.rearm(StubClient(t["pending"], t.get("failing", ())), now_ts=NOW)
+        if err or backend.armed_ts != t["expected"]:
+            passed = False
+            print(f"Failed on test {i} ({t['reason']}): expected {t['expected']}, got {backend.armed_ts} (err={err})")
+    return passed
+
+def test_arm_if_earlier():
+    passed = True
+    backend = scheduler.FakeBackend()
+    scheduler.set_backend(backend)
+
+    scheduler.arm_if_earlier(NOW + 600, now_ts=NOW)
+    scheduler.arm_if_earlier(NOW + 900, now_ts=NOW)  # later: no-op
+    scheduler.arm_if_earlier(NOW + 300, now_ts=NOW)
+    if backend.history != [NOW + 600, NOW + 300]:
+        passed = False
+        print(f"Failed arm_if_earlier: got history {backend.history}")
+
+    fired = []
+    if backend.fire(lambda: fired.append(True), now_ts=NOW + 299) or fired:
+        passed = False
+        print("Failed fire: schedule fired before it was due")
+    if not backend.fire(lambda: fired.append(True), now_ts=NOW + 300) or not fired:
+        passed = False
+        print("Failed fire: schedule did not fire when due")
+
+    # the schedule already fired: a new reminder must re-arm it.
+    scheduler.arm_if_earlier(NOW + 900, now_ts=NOW + 400)
+    if backend.armed_ts != NOW + 900:
+        passed = False
+        print(f"Failed arm_if_earlier after fire: got {backend.armed_ts}")
+    return passed
+
+
+if __name__ == "__main__":
+    print("test rearm...")
+    if test_rearm():
+        print("PASSED")
+    print("test arm_if_earlier...")
+    if test_arm_if_earlier():
+        print("PASSED")
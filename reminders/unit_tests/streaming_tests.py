@@ -0,0 +1,83 @@
+import sys
+import os
+import time
+reminders_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+sys.path.append(reminders_dir)
+import reminders.chat as chat
+import reminders.connections as connections
+import reminders.handler_v2 as handler_v2
+import reminders.resilience as resilience
+from reminders.benchmarks.stubs import FakeOpenAIServer
+
+# to run tests: python reminders/unit_tests/streaming_tests.py
+
+def test_manager_request_end():
+    tests = [
+        ("Ok! @manager: create a reminder", -1, "Line not complete yet."),
+        ("Ok! @manager: create a reminder\n", -1, "The request can go on, on the next line."),
+        ("Ok! @manager: create a reminder\n\nI'll", 31, "Request followed by a blank line."),
+        ("Ok!\n@manager:\n", -1, "Summary on the next line, not received yet."),
+        ("Ok!\n@manager:\n\n", -1, "Blank line before the summary."),
+        ("Ok!\n@manager:\ncreate a reminder\n \n", 31, "Summary on the next line."),
+        ("@manager: create a reminder\nto call mom\nat 5pm\n\nI'll", 46, "Request on several lines."),
+        ("Sure, see you tomorrow!\n", -1, "No request."),
+    ]
+    passed = True
+    for i, (text, expected, reason) in enumerate(tests):
+        actual = handler_v2.manager_request_end(text)
+        if actual != expected:
+            passed = False
+            print(f"Failed on test {i} ({reason}): expected {expected}, got {actual}")
+    return passed
+
+def test_get_reply():
+    passed = True
+    connections.reset()
+    chat.openai_breaker = resilience.CircuitBreaker()
+    tail = " ".join(["blah"] * 40)
+    request = "Ok! @manager: I need to create two reminders:\n- call mom at 5pm\n- call dad at 6pm"
+    reply = f"{request}\n\n{tail}"
+    with FakeOpenAIServer([(200, {}, reply, 0)], token_delay=0.01) as server:
+        chat.OPENAI_URL = server.url
+        start = time.monotonic()
+        stream = chat.stream_completion([{"role": "user", "content": "hi"}])
+        full = "".join(stream)
+        full_duration = time.monotonic() - start
+        if full.replace(" \n", "\n").strip() != reply or stream.error or not stream.finished:
+            passed = False
+            print(f"Failed stream_completion: got {full!r}, error={stream.error}")
+
+        start = time.monotonic()
+        out = handler_v2.get_reply([{"role": "user", "content": "hi"}])
+        duration = time.monotonic() - start
+        if out.replace(" \n", "\n").strip() != request:
+            passed = False
+            print(f"Failed get_reply: got {out!r}")
+        if duration > full_duration / 2:
+            passed = False
+            print(f"Failed get_reply: did not stop early ({duration:.2f}s vs {full_duration:.2f}s for the full reply)")
+
+    with FakeOpenAIServer([(200, {}, "Hey! How can I help?", 0)]) as server:
+        chat.OPENAI_URL = server.url
+        out = handler_v2.get_reply([{"role": "user", "content": "hi"}])
+        if out.strip() != "Hey! How can I help?":
+            passed = False
+            print(f"Failed get_reply: expected the whole reply, got {out!r}")
+
+    # without a blank line, the request runs until the end of the stream.
+    with FakeOpenAIServer([(200, {}, request, 0)]) as server:
+        chat.OPENAI_URL = server.url
+        out = handler_v2.get_reply([{"role": "user", "content": "hi"}])
+        if out.replace(" \n", "\n").strip() != request:
+            passed = False
+            print(f"Failed get_reply: expected the whole request, got {out!r}")
+    return passed
+
+
+if __name__ == "__main__":
+    print("test manager_request_end...")
+    if test_manager_request_end():
+        print("PASSED")
+    print("test get_reply...")
+    if test_get_reply():
+        print("PASSED")
@@ -32,8 +32,9 @@ def valid_timezone(timezone):
         return False
 
 # country utils
-import phonenumbers
 def country_code_from_wa_id(wa_id):
+    # only needed when a user is created: not worth importing on every cold start.
+    import phonenumbers
     # Parse the string to a PhoneNumber object
     try:
         x = phonenumbers.parse(f"+{wa_id}")
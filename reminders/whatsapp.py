@@ -1,9 +1,8 @@
 import os
-import requests
 import json
 
-import reminders.dynamodb as db
-import reminders.utils as utils
+# connections, dynamodb and utils are imported in the functions that use them:
+# they pull in boto3, requests and pendulum, and verify (the GET code path of lambda_function) needs none of them.
 
 # verify performs the whatsapp verification process when setting up the webhook.
 def verify(event):
@@ -22,6 +21,7 @@ def verify(event):
 # send_message takes a contact_id and outbound_message_body
 # and sends it to the whatsapp user.
 def send_message(contact_id, body):
+    import reminders.connections as connections
     whatsapp_token = os.environ["WHATSAPP_TOKEN"]
     headers = {
         'Authorization': f'Bearer {whatsapp_token}',
@@ -38,7 +38,7 @@ def send_message(contact_id, body):
         }
     }
     phone_number_id = os.environ.get('PHONE_NUMBER_ID')
-    response = requests.post(
+    response = connections.get_session("whatsapp").post(
         f'https://graph.facebook.com/v16.0/{phone_number_id}/messages',
         headers=headers,
         json=json_data)
@@ -50,6 +50,8 @@ def send_message(contact_id, body):
 # - updating user conversation history
 # - sending message via WhatsApp
 def send(msg, user, client, hist, type_=""):
+    import reminders.dynamodb as db
+    import reminders.utils as utils
     # todo: add safeguard so that user never sees something for the manager.
     hist.append({"role": "assistant", "content": msg, "timestamp": utils.utc_now_ts(), "type": type_})
     print(f"Sending to user: {msg}")
@@ -88,6 +90,7 @@ def send_opt_in(contact_id, email="justtellmeapp@gmail.com"):
     return send_template(contact_id, TEMPLATES["opt_in"]["name"], TEMPLATES["opt_in"]["code"], [email])
 
 def send_template(contact_id, template_name, language_code, params):
+    import reminders.connections as connections
     whatsapp_token = os.environ.get("WHATSAPP_TOKEN")
     headers = {
         'Authorization': f'Bearer {whatsapp_token}',
@@ -118,7 +121,7 @@ def send_template(contact_id, template_name, language_code, params):
         }
     }
     phone_number_id = os.environ.get('PHONE_NUMBER_ID')
-    response = requests.post(
+    response = connections.get_session("whatsapp").post(
         f'https://graph.facebook.com/v16.0/{phone_number_id}/messages',
         headers=headers,
         json=json_data)
@@ -127,13 +130,14 @@ def send_template(contact_id, template_name, language_code, params):
 
 # ----- AUDIO -----
 def get_media_url(media_id):
+    import reminders.connections as connections
     url = f'https://graph.facebook.com/v16.0/{media_id}'
     whatsapp_token = os.environ.get("WHATSAPP_TOKEN")
     headers = {
         'Authorization': f'Bearer {whatsapp_token}',
         'Content-Type': 'application/json',
     }
-    response = requests.get(url, headers=headers)
+    response = connections.get_session("whatsapp").get(url, headers=headers)
     print(response.json())
     try:
         return response.json()["url"]
@@ -141,11 +145,12 @@ def get_media_url(media_id):
         return None
 
 def download_media(url, out_path):
+    import reminders.connections as connections
     whatsapp_token = os.environ.get("WHATSAPP_TOKEN")
     headers = {
         'Authorization': f'Bearer {whatsapp_token}',
     }
-    response = requests.get(url, headers=headers)
+    response = connections.get_session("whatsapp").get(url, headers=headers)
 
     if response.status_code == 200:
         with open(out_path, "wb") as file: